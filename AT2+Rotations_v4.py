@@ -3,9 +3,29 @@ from tkinter import filedialog, messagebox, scrolledtext
 import subprocess
 import tempfile
 import os
+import queue
+import asyncio
+import codecs
+import io
+import signal
+import concurrent.futures
+import heapq
+import threading
+import hashlib
+import json
+import csv
+import sqlite3
 import re
+import math
+import time
 from datetime import datetime
-from itertools import combinations
+from dataclasses import dataclass, asdict
+from itertools import combinations, islice
+import shutil
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
 
 population_history = []
 history_index = -1
@@ -140,31 +160,828 @@ def format_pops(input_str):
     pops = [p.strip() for p in clean_input.split() if p.strip()]
     return ','.join(f'"{p}"' for p in pops)
 
-# GET R LIBRARY PATHS
-def get_r_library_paths(rscript_path='Rscript'):
+def r_path(path):
+    # Paths go into R string literals, where a backslash starts an escape
+    return path.replace('\\', '/').replace('"', '\\"')
+
+# --- R INSTALLATION PROBE ---
+# What an Rscript binary offers (library paths, admixtools/tidyverse
+# versions and locations) is probed once and kept in r_probe.json, keyed by
+# the binary's path and valid while its mtime is unchanged.
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".admixtools2_gui")
+R_PROBE_CACHE_PATH = os.path.join(APP_DATA_DIR, "r_probe.json")
+R_PROBE_CODE = (
+    'for (p in .libPaths()) cat("LIB\\t", p, "\\n", sep = ""); '
+    'for (pkg in c("admixtools", "tidyverse")) { loc <- find.package(pkg, quiet = TRUE); '
+    'if (length(loc)) cat("PKG\\t", pkg, "\\t", as.character(packageVersion(pkg, lib.loc = dirname(loc))), "\\t", dirname(loc), "\\n", sep = "") }'
+)
+r_probe_lock = threading.Lock()
+
+def load_r_probes():
+    try:
+        with open(R_PROBE_CACHE_PATH, 'r', encoding='utf-8') as f:
+            probes = json.load(f)
+        return {'rscripts': probes.get('rscripts', {}), 'installs': probes.get('installs', {})}
+    except (OSError, ValueError, AttributeError):
+        return {'rscripts': {}, 'installs': {}}
+
+def save_r_probes(probes):
+    try:
+        os.makedirs(APP_DATA_DIR, exist_ok=True)
+        with open(R_PROBE_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(probes, f, indent=1)
+    except OSError:
+        pass  # Probing again next time is the only cost
+
+def resolve_rscript(rscript_path, probes):
+    # Bare names are looked up on PATH once and remembered
+    if os.path.dirname(rscript_path):
+        return rscript_path
+    known = probes['rscripts'].get(rscript_path)
+    if known and os.path.isfile(known):
+        return known
+    found = shutil.which(rscript_path)
+    if found:
+        probes['rscripts'][rscript_path] = found
+    return found or rscript_path
+
+def find_rscript(rscript_path='Rscript'):
+    # Installed Rscript for a name or path, through the cached PATH lookup
+    with r_probe_lock:
+        probes = load_r_probes()
+        unchanged = json.dumps(probes)
+        resolved = resolve_rscript(rscript_path, probes)
+        if json.dumps(probes) != unchanged:
+            save_r_probes(probes)
+    return resolved if os.path.isfile(resolved) else None
+
+def run_r_probe(rscript_path):
     try:
         result = subprocess.run(
-            [rscript_path, '-e', 'cat(.libPaths())'],
+            [rscript_path, '-e', R_PROBE_CODE],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
         )
-        paths_raw = result.stdout.strip()
-        paths = re.findall(r'\/[^\s"]+', paths_raw)
-        return paths
-    except Exception as e:
-        return []
-
-# CHECK IF PACKAGE EXISTS IN ANY OF THE R LIBRARY PATHS
-def check_package_in_paths(package_name, paths):
-    for path in paths:
-        if os.path.isdir(os.path.join(path, package_name)):
-            return path
+    except Exception:
+        return None
+    if result.returncode != 0:
+        return None
+    probe = {'lib_paths': [], 'packages': {}}
+    for line in result.stdout.splitlines():
+        fields = line.split('\t')
+        if fields[0] == 'LIB' and len(fields) == 2:
+            probe['lib_paths'].append(fields[1])
+        elif fields[0] == 'PKG' and len(fields) == 4:
+            probe['packages'][fields[1]] = {'version': fields[2], 'path': fields[3]}
+    return probe
+
+def probe_r_installation(rscript_path='Rscript', refresh=False):
+    with r_probe_lock:
+        probes = load_r_probes()
+        unchanged = json.dumps(probes)
+        resolved = resolve_rscript(rscript_path, probes)
+        try:
+            mtime_ns = os.stat(resolved).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        probe = probes['installs'].get(resolved)
+        if refresh or probe is None or probe.get('mtime_ns') != mtime_ns:
+            probe = run_r_probe(resolved)
+            if probe is None:
+                return {'lib_paths': [], 'packages': {}}  # Failed probes are not cached
+            probe['mtime_ns'] = mtime_ns
+            probes['installs'][resolved] = probe
+        if json.dumps(probes) != unchanged:
+            save_r_probes(probes)
+        return probe
+
+def r_package_path(rscript_path, package_name):
+    # Library holding the package; installing or removing packages does not
+    # touch Rscript, so a stale answer triggers one fresh probe
+    for refresh in (False, True):
+        package = probe_r_installation(rscript_path, refresh)['packages'].get(package_name)
+        if package and os.path.isdir(os.path.join(package['path'], package_name)):
+            return package['path']
     return None
 
 # Persistent variable to store modified R code
 custom_r_code = None
 
+# --- UI EVENT QUEUE ---
+# Analyses run on worker threads and never touch Tk widgets directly. They
+# post events to ui_events, which the main loop drains with root.after.
+ui_events = queue.Queue()
+job_running = threading.Event()
+
+def ui_insert(text):
+    ui_events.put(('insert', text))
+
+def ui_status(text):
+    ui_events.put(('status', text))
+
+def ui_error(title, message):
+    ui_events.put(('error', title, message))
+
+def ui_leaderboard(text):
+    ui_events.put(('leaderboard', text))
+
+def ui_phase(timer):
+    # Marks the timer rendered once the output queued before it is shown
+    ui_events.put(('phase', timer))
+
+def process_ui_events():
+    # Consecutive inserts are joined into one Text.insert call
+    pending_text = []
+    status_text = None
+    inserted = False
+    try:
+        # Bounded per tick so a flood of output cannot starve the window
+        for _ in range(1000):
+            event = ui_events.get_nowait()
+            if event[0] == 'insert':
+                pending_text.append(event[1])
+                continue
+            if pending_text:
+                output_text.insert(tk.END, ''.join(pending_text))
+                pending_text = []
+                inserted = True
+            if event[0] == 'status':
+                status_text = event[1]
+            elif event[0] == 'error':
+                messagebox.showerror(event[1], event[2])
+            elif event[0] == 'leaderboard':
+                show_leaderboard(event[1])
+            elif event[0] == 'phase':
+                event[1].rendered()
+    except queue.Empty:
+        pass
+
+    if pending_text:
+        output_text.insert(tk.END, ''.join(pending_text))
+        inserted = True
+    if inserted:
+        output_text.see(tk.END)
+    if status_text is not None:
+        status_label.config(text=status_text)
+    root.after(50, process_ui_events)
+
+def start_job(job, *args):
+    if job_running.is_set():
+        messagebox.showerror("Busy", "Another analysis is still running.")
+        return
+
+    def run():
+        try:
+            job(*args)
+        except Exception as e:
+            ui_error("Error", str(e))
+        finally:
+            job_running.clear()
+
+    job_cancelled.clear()
+    job_running.set()
+    threading.Thread(target=run, daemon=True).start()
+
+# --- R PROCESS EXECUTION ---
+# Every Rscript is started by one asyncio loop on a background thread, in
+# its own process group, and its output is streamed to the job thread
+# through a queue. Cancelling signals the whole group (SIGTERM, then
+# SIGKILL after a grace period), so R's children do not outlive a stopped
+# job. RProcess mirrors the parts of Popen the jobs use.
+R_KILL_GRACE_SECONDS = 5
+R_OUTPUT_CHUNK_BYTES = 1 << 16
+MEMORY_ADDRESS_SPACE_HEADROOM = 2  # RLIMIT_AS also counts memory R maps but never touches
+MEMORY_POLL_SECONDS = 0.5
+r_event_loop = None
+r_event_loop_lock = threading.Lock()
+active_r_processes = set()
+active_r_processes_lock = threading.Lock()
+job_cancelled = threading.Event()
+
+def get_r_event_loop():
+    global r_event_loop
+    with r_event_loop_lock:
+        if r_event_loop is None:
+            r_event_loop = asyncio.new_event_loop()
+            threading.Thread(target=r_event_loop.run_forever, daemon=True).start()
+        return r_event_loop
+
+def signal_process_group(pid, force):
+    try:
+        if os.name == 'nt':
+            # taskkill /T covers R.exe started by Rscript.exe
+            subprocess.run(['taskkill', '/T', '/PID', str(pid)] + (['/F'] if force else []), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(pid, signal.SIGKILL if force else signal.SIGTERM)
+    except (OSError, ProcessLookupError):
+        pass  # The group is already gone
+
+class RProcessOutput:
+    """Line iterator over an RProcess's merged stdout/stderr."""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def readline(self):
+        line = self.lines.get()
+        if line is None:
+            self.lines.put(None)  # Stay at EOF for later readers
+            return ''
+        return line
+
+class RProcessInput:
+    """Text stdin of an RProcess, written through the event loop."""
+
+    def __init__(self, process):
+        self.process = process
+
+    def write(self, text):
+        self.process.call(self.process.write_stdin(text.encode('utf-8')))
+
+    def flush(self):
+        pass  # write() drains
+
+    def close(self):
+        self.process.call(self.process.close_stdin())
+
+class RProcess:
+    """An Rscript child in its own process group, driven by asyncio."""
+
+    def __init__(self, args, stdin=False, memory_limit=None):
+        self.loop = get_r_event_loop()
+        self.stdout = RProcessOutput()
+        self.stdin = RProcessInput(self) if stdin else None
+        self.kill_status = None
+        self.kill_reason = None
+        self.process = self.call(self.start(args, stdin))
+        self.pid = self.process.pid
+        self.reader = asyncio.run_coroutine_threadsafe(self.pump(), self.loop)
+        if memory_limit:
+            self.limit_memory(memory_limit)
+        with active_r_processes_lock:
+            active_r_processes.add(self)
+        if job_cancelled.is_set():
+            self.cancel()
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def start(self, args, stdin):
+        if os.name == 'nt':
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {'start_new_session': True}
+        return await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if stdin else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=1 << 24,
+            **group
+        )
+
+    async def pump(self):
+        # Universal newlines, as Popen(text=True) read them: a bare \r ends
+        # a line too, so progress counters R rewrites in place arrive one
+        # update at a time
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(errors='replace'), translate=True)
+        pending = ''
+        try:
+            while True:
+                chunk = await self.process.stdout.read(R_OUTPUT_CHUNK_BYTES)
+                *lines, pending = (pending + decoder.decode(chunk, final=not chunk)).split('\n')
+                for line in lines:
+                    self.stdout.lines.put(line + '\n')
+                if not chunk:
+                    break
+            if pending:
+                self.stdout.lines.put(pending)
+            await self.process.wait()
+        finally:
+            self.stdout.lines.put(None)
+            with active_r_processes_lock:
+                active_r_processes.discard(self)
+
+    def limit_memory(self, limit_bytes):
+        # Linux only: RLIMIT_AS makes oversized allocations fail inside R,
+        # and resident memory is polled so the group is killed when it
+        # passes the limit anyway
+        if resource is None or not hasattr(resource, 'prlimit'):
+            return
+        try:
+            address_space = int(limit_bytes * MEMORY_ADDRESS_SPACE_HEADROOM)
+            resource.prlimit(self.pid, resource.RLIMIT_AS, (address_space, address_space))
+        except (OSError, ValueError):
+            pass  # The process already exited
+        asyncio.run_coroutine_threadsafe(self.watch_memory(limit_bytes), self.loop)
+
+    async def watch_memory(self, limit_bytes):
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        while self.process.returncode is None:
+            try:
+                with open(f"/proc/{self.pid}/statm", 'r') as f:
+                    resident = int(f.read().split()[1]) * page_size
+            except (OSError, ValueError, IndexError):
+                return
+            if resident > limit_bytes:
+                self.kill_for('oom', f"out of memory (over the {format_gigabytes(limit_bytes)} limit)")
+                return
+            await asyncio.sleep(MEMORY_POLL_SECONDS)
+
+    async def write_stdin(self, data):
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def close_stdin(self):
+        self.process.stdin.close()
+
+    async def terminate_group(self, grace):
+        if self.process.returncode is None:
+            signal_process_group(self.pid, force=False)
+            try:
+                await asyncio.wait_for(self.process.wait(), grace)
+            except asyncio.TimeoutError:
+                pass
+        # Children can outlive Rscript itself, so the group is always killed
+        signal_process_group(self.pid, force=True)
+        await self.process.wait()
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def poll(self):
+        return self.process.returncode
+
+    def wait(self, timeout=None):
+        try:
+            self.reader.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise subprocess.TimeoutExpired(self.process, timeout)
+        return self.process.returncode
+
+    def cancel(self, grace=R_KILL_GRACE_SECONDS):
+        # Returns at once; the group is signalled on the event loop
+        asyncio.run_coroutine_threadsafe(self.terminate_group(grace), self.loop)
+
+    def kill(self):
+        self.cancel(grace=0)
+
+    def kill_for(self, status, reason):
+        # Kills the process over a model limit and records which one
+        if self.kill_status is None and self.poll() is None:
+            self.kill_status = status
+            self.kill_reason = reason
+            self.kill()
+
+def stop_job():
+    # Cancels the running analysis: no new R processes are started and every
+    # running one is terminated with its process group
+    if not job_running.is_set():
+        return
+    job_cancelled.set()
+    with active_r_processes_lock:
+        processes = list(active_r_processes)
+    for process in processes:
+        process.cancel()
+    ui_status("Stopping...")
+
+# --- MODEL LIMITS ---
+# Rotation models can be given a wall-clock timeout and a per-worker memory
+# limit. A worker over either is killed with its process group, its model
+# is recorded as timed out or out of memory and the rotation carries on.
+class ModelLimitExceeded(RuntimeError):
+    """A model was stopped by its timeout or memory limit."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ModelWatchdog:
+    """Kills an RProcess once the model it is running passes the timeout."""
+
+    def __init__(self, timeout, process=None):
+        self.timeout = timeout
+        self.process = process
+        self.timer = None
+
+    def arm(self):
+        self.disarm()
+        if self.timeout:
+            self.timer = threading.Timer(self.timeout, self.process.kill_for, ('timeout', f"timed out after {self.timeout:g} s"))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def disarm(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+def format_gigabytes(limit_bytes):
+    return f"{limit_bytes / (1 << 30):g} GB"
+
+def failure_status(errors):
+    # R reports allocations refused under RLIMIT_AS as ordinary errors
+    return 'oom' if 'cannot allocate' in errors else None
+
+def limit_was_raised(entry, timeout, memory_limit):
+    # Journaled models that hit a limit are retried once it is raised or removed
+    status = entry.get('status')
+    if status not in ('timeout', 'oom'):
+        return False
+    limit = timeout if status == 'timeout' else memory_limit
+    return not limit or limit > entry.get('limit', 0)
+
+# --- PHASE TIMINGS ---
+# Every qpAdm or FST run and every rotation model is timed phase by phase.
+# Each phase ends at a PHASE marker printed by the generated R code, at an
+# admixtools "Computing ... block N out of M" line, at the result record,
+# or at a point in the Python job. A phase whose end is never seen is
+# counted in the next one. Records are appended to phase_timings.jsonl
+# once the UI has shown the result, and can be exported as CSV.
+PHASE_TIMINGS_PATH = os.path.join(APP_DATA_DIR, "phase_timings.jsonl")
+PHASES = ('spawn', 'libraries', 'data', 'blocks', 'result', 'parse', 'render')
+PHASE_CSV_FIELDS = ('finished', 'job', 'dataset', 'model', 'key', 'failed') + PHASES + ('total',)
+BLOCK_PROGRESS_PATTERN = re.compile(r'Computing .* block (\d+) out of (\d+)')
+phase_timings_lock = threading.Lock()
+
+class PhaseTimer:
+    """End times of the phases of one run, from the job's start."""
+
+    def __init__(self, job, dataset, model=None, key=None):
+        self.job = job
+        self.dataset = dataset
+        self.model = model
+        self.key = key
+        self.failed = False
+        self.started = time.monotonic()
+        self.ends = {}
+
+    def mark(self, phase):
+        self.ends[phase] = time.monotonic()
+
+    def feed(self, line):
+        if line.startswith("PHASE\t"):
+            self.mark(line.split('\t', 1)[1].strip())
+        elif line.startswith("RESULT_JSON\t"):
+            self.mark('result')
+        elif BLOCK_PROGRESS_PATTERN.search(line):
+            # Data reading ends at the first block, block computation at
+            # the last
+            if 'data' not in self.ends:
+                self.mark('data')
+            self.mark('blocks')
+
+    def durations(self):
+        durations = {}
+        previous = self.started
+        for phase in PHASES:
+            end = self.ends.get(phase)
+            if end is None or end < previous:
+                durations[phase] = None
+                continue
+            durations[phase] = round(end - previous, 4)
+            previous = end
+        durations['total'] = round(previous - self.started, 4)
+        return durations
+
+    def rendered(self):
+        # Called on the UI thread once the result is in the output window
+        self.mark('render')
+        record_phase_timings(self)
+
+def record_phase_timings(timer):
+    entry = {
+        'finished': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'job': timer.job,
+        'dataset': timer.dataset,
+        'model': timer.model,
+        'key': timer.key,
+        'failed': timer.failed
+    }
+    entry.update(timer.durations())
+    try:
+        with phase_timings_lock:
+            os.makedirs(APP_DATA_DIR, exist_ok=True)
+            with open(PHASE_TIMINGS_PATH, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+    except OSError:
+        pass  # Timings are diagnostics; never fail a run over them
+
+def load_phase_timings():
+    records = []
+    try:
+        with open(PHASE_TIMINGS_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # Partially written line
+    except OSError:
+        pass
+    return records
+
+def write_phase_timings_csv(path, records):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PHASE_CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
+
+# --- DATASET FINGERPRINT ---
+# A dataset is identified by the size, mtime and inode of its three files
+# and by FINGERPRINT_SAMPLES blocks read at even offsets through the
+# genotype file. With the full hash option it is identified by the
+# content of its files alone, read in full. Fingerprints are memoized per
+# prefix until a file's size, mtime or inode changes, so a dataset is
+# read once per session, not before every run.
+DATASET_EXTENSIONS = [('.geno', '.snp', '.ind'), ('.bed', '.bim', '.fam')]
+FINGERPRINT_SAMPLES = 16
+FINGERPRINT_BLOCK_BYTES = 1 << 16
+FINGERPRINT_CHUNK_BYTES = 1 << 22
+fingerprint_full_hash = False
+fingerprint_memo = {}
+fingerprint_memo_lock = threading.Lock()
+
+def set_fingerprint_full_hash(enabled):
+    global fingerprint_full_hash
+    fingerprint_full_hash = enabled
+
+def dataset_files(prefix):
+    # Genotype file first; None if the prefix does not point at an
+    # EIGENSTRAT or PLINK dataset
+    for extensions in DATASET_EXTENSIONS:
+        paths = [prefix + ext for ext in extensions]
+        if all(os.path.isfile(path) for path in paths):
+            return paths
+    return None
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (os.path.splitext(path)[1], stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+def hash_file_samples(digest, path, size):
+    with open(path, 'rb') as f:
+        if size <= FINGERPRINT_SAMPLES * FINGERPRINT_BLOCK_BYTES:
+            digest.update(f.read())
+            return
+        step = (size - FINGERPRINT_BLOCK_BYTES) // (FINGERPRINT_SAMPLES - 1)
+        for i in range(FINGERPRINT_SAMPLES):
+            f.seek(i * step)
+            digest.update(f.read(FINGERPRINT_BLOCK_BYTES))
+
+def hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FINGERPRINT_CHUNK_BYTES), b''):
+            digest.update(chunk)
+
+def dataset_fingerprint(prefix, full_hash=None):
+    if full_hash is None:
+        full_hash = fingerprint_full_hash
+    paths = dataset_files(prefix)
+    if paths is None:
+        return None
+
+    signature = tuple(file_signature(path) for path in paths)
+    key = (os.path.abspath(prefix), full_hash)
+    with fingerprint_memo_lock:
+        memo = fingerprint_memo.get(key)
+    if memo and memo[0] == signature:
+        return memo[1]
+
+    if full_hash:
+        digest = hashlib.sha1(b"full")
+        for path in paths:
+            digest.update(os.path.splitext(path)[1].encode('utf-8'))
+            hash_file(digest, path)
+    else:
+        digest = hashlib.sha1(b"sampled")
+        for entry in signature:
+            digest.update(':'.join(map(str, entry)).encode('utf-8'))
+        hash_file_samples(digest, paths[0], signature[0][1])
+    fingerprint = digest.hexdigest()
+
+    # A file written to while it was read is read again next time
+    if tuple(file_signature(path) for path in paths) == signature:
+        with fingerprint_memo_lock:
+            fingerprint_memo[key] = (signature, fingerprint)
+    return fingerprint
+
+def fingerprint_mode(full_hash):
+    return 'full' if full_hash else 'sampled'
+
+def add_fingerprint_mode_column(db, table):
+    # Caches written before fingerprints had modes hold sampled fingerprints
+    columns = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    if 'mode' not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN mode TEXT NOT NULL DEFAULT 'sampled'")
+
+def purge_stale_fingerprints(db, table, dataset, fingerprint, mode):
+    # Rows computed on an older version of the dataset files are stale. A
+    # full and a sampled fingerprint of the same files never match, so only
+    # rows taken in the same mode are compared, and nothing is dropped when
+    # the dataset could not be fingerprinted at all.
+    if fingerprint is not None:
+        db.execute(f"DELETE FROM {table} WHERE dataset = ? AND mode = ? AND fingerprint != ?", (dataset, mode, fingerprint))
+    db.commit()
+
+# --- RESULT CACHE ---
+# qpAdm results are kept across sessions in an SQLite file, keyed by the
+# dataset fingerprint and the canonical model key.
+RESULT_CACHE_PATH = os.path.join(APP_DATA_DIR, "qpadm_cache.sqlite")
+
+class ResultCache:
+    """Persistent qpAdm result cache for one dataset."""
+
+    def __init__(self, prefix, path=RESULT_CACHE_PATH):
+        full_hash = fingerprint_full_hash
+        self.fingerprint = dataset_fingerprint(prefix, full_hash)
+        self.mode = fingerprint_mode(full_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Rotation scheduler threads share the connection
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                dataset TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                mode TEXT NOT NULL DEFAULT 'sampled',
+                model TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created TEXT NOT NULL,
+                PRIMARY KEY (fingerprint, model)
+            )
+        """)
+        add_fingerprint_mode_column(self.db, "results")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_dataset ON results (dataset)")
+        self.dataset = os.path.abspath(prefix)
+        purge_stale_fingerprints(self.db, "results", self.dataset, self.fingerprint, self.mode)
+
+    def get(self, key):
+        if self.fingerprint is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result FROM results WHERE fingerprint = ? AND model = ?",
+                (self.fingerprint, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, result):
+        if self.fingerprint is None:
+            return
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (dataset, fingerprint, mode, model, result, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.dataset, self.fingerprint, self.mode, key, result, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+# --- QPADM RESULT RECORDS ---
+# R hands qpAdm results over as one JSON line per model
+# (RESULT_JSON<TAB>{weights, rankdrop, popdrop}) at full precision, so
+# nothing is recovered from printed tibbles.
+R_EMIT_RESULT_CODE = """
+emit_result <- function(results) {
+    record <- list(
+        weights = results$weights,
+        rankdrop = results$rankdrop,
+        popdrop = results$popdrop
+    )
+    json <- jsonlite::toJSON(record, dataframe = "rows", digits = NA, na = "null")
+    cat("RESULT_JSON\\t", json, "\\n", sep = "")
+}
+"""
+
+POPDROP_FIELDS = {'pat', 'wt', 'dof', 'chisq', 'p', 'f4rank', 'feasible', 'best', 'dofdiff', 'chisqdiff', 'p_nested'}
+
+def record_number(value):
+    return float('nan') if value is None else float(value)
+
+@dataclass
+class QpadmWeight:
+    target: str
+    left: str
+    weight: float
+    se: float
+    z: float
+
+@dataclass
+class QpadmRank:
+    f4rank: int
+    dof: int
+    chisq: float
+    p: float
+
+@dataclass
+class QpadmPopdrop:
+    pat: str
+    wt: int
+    dof: int
+    chisq: float
+    p: float
+    f4rank: int
+    feasible: bool
+    weights: dict  # left population -> weight, NaN where dropped
+
+@dataclass
+class QpadmResult:
+    weights: list
+    rankdrop: list
+    popdrop: list
+
+    @classmethod
+    def from_json(cls, text):
+        record = json.loads(text)
+        weights = [
+            QpadmWeight(row.get('target', ''), row.get('left', ''), record_number(row.get('weight')), record_number(row.get('se')), record_number(row.get('z')))
+            for row in record.get('weights') or []
+        ]
+        rankdrop = [
+            QpadmRank(int(row['f4rank']), int(row['dof']), record_number(row.get('chisq')), record_number(row.get('p')))
+            for row in record.get('rankdrop') or []
+        ]
+        popdrop = [
+            QpadmPopdrop(
+                str(row.get('pat', '')),
+                int(row.get('wt') or 0),
+                int(row.get('dof') or 0),
+                record_number(row.get('chisq')),
+                record_number(row.get('p')),
+                int(row.get('f4rank') or 0),
+                bool(row.get('feasible')),
+                {name: record_number(value) for name, value in row.items() if name not in POPDROP_FIELDS}
+            )
+            for row in record.get('popdrop') or []
+        ]
+        return cls(weights, rankdrop, popdrop)
+
+    @classmethod
+    def from_record(cls, record):
+        # Inverse of asdict(), as kept in the rotation result store
+        return cls(
+            [QpadmWeight(**row) for row in record['weights']],
+            [QpadmRank(**row) for row in record['rankdrop']],
+            [QpadmPopdrop(**row) for row in record['popdrop']]
+        )
+
+    @property
+    def p(self):
+        # p-value of the full model (the popdrop pattern with nothing dropped)
+        for row in self.popdrop:
+            if row.wt == 0:
+                return row.p
+        return float('nan')
+
+    @property
+    def feasible(self):
+        return bool(self.weights) and all(0 <= w.weight <= 1 for w in self.weights)
+
+def is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def format_table(headers, rows):
+    # Numeric columns are right-aligned, text columns left-aligned
+    columns = list(zip(headers, *rows))
+    widths = [max(len(str(cell)) for cell in column) for column in columns]
+    numeric = [all(is_number(str(cell)) for cell in column[1:]) for column in columns]
+    lines = []
+    for row in [headers] + rows:
+        cells = [str(cell).rjust(width) if right else str(cell).ljust(width) for cell, width, right in zip(row, widths, numeric)]
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines) + '\n'
+
+def format_qpadm_result(result):
+    text = "Weights:\n" + format_table(
+        ["left", "weight", "se", "z"],
+        [[w.left, f"{w.weight:.6f}", f"{w.se:.6f}", f"{w.z:.3f}"] for w in result.weights]
+    )
+    if result.rankdrop:
+        text += "Rankdrop:\n" + format_table(
+            ["f4rank", "dof", "chisq", "p"],
+            [[r.f4rank, r.dof, f"{r.chisq:.3f}", f"{r.p:.4g}"] for r in result.rankdrop]
+        )
+    lefts = [w.left for w in result.weights]
+    text += "Popdrop:\n" + format_table(
+        ["pat", "wt", "dof", "chisq", "p", "f4rank", "feasible"] + lefts,
+        [[d.pat, d.wt, d.dof, f"{d.chisq:.3f}", f"{d.p:.4g}", d.f4rank, d.feasible] + [f"{d.weights.get(left, float('nan')):.4f}" for left in lefts] for d in result.popdrop]
+    )
+    return text
+
 # MAIN RUN FUNCTION
 def run_qpadm():
     target_pops_raw = target_entry.get()
@@ -193,56 +1010,61 @@ def run_qpadm():
     left_pops = format_pops(left_pops_raw)
     right_pops = format_pops(right_pops_raw)
 
-    r_lib_paths = get_r_library_paths(rscript_path)
-    package_path = check_package_in_paths("admixtools", r_lib_paths)
-    lib_path_code = f'.libPaths("{package_path}")\n' if package_path else ''
+    start_job(qpadm_job, rscript_path, dataset_prefix, target_pops_raw, left_pops_raw, right_pops_raw, target_pops, left_pops, right_pops, result_cache_var.get())
+
+def qpadm_job(rscript_path, dataset_prefix, target_pops_raw, left_pops_raw, right_pops_raw, target_pops, left_pops, right_pops, use_cache):
+    cache = ResultCache(dataset_prefix) if use_cache else None
+    cache_key = model_key(
+        [p.strip('"') for p in target_pops.split(',')],
+        [p.strip('"') for p in left_pops.split(',')],
+        [p.strip('"') for p in right_pops.split(',')],
+        'allsnps'
+    )
+    if cache is not None:
+        cached_result = cache.get(cache_key)
+        cache.close()
+        if cached_result is not None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ui_insert(f"\n---\nDone by pepsimanfire - Cached result retrieved at {timestamp}\n")
+            ui_insert(f"Target: {target_pops_raw}\nLeft: {left_pops_raw}\nRight: {right_pops_raw}\n\n")
+            ui_insert(cached_result)
+            ui_status("qpAdm completed (cached result).")
+            return
+
+    package_path = r_package_path(rscript_path, "admixtools")
+    lib_path_code = f'.libPaths("{r_path(package_path)}")\n' if package_path else ''
 
     r_code = f"""
 {lib_path_code}
 library(admixtools)
 library(tidyverse)
+cat("PHASE\\tlibraries\\n")
 
-prefix = "{dataset_prefix}"
+prefix = "{r_path(dataset_prefix)}"
 target = c({target_pops})
 left = c({left_pops})
 right = c({right_pops})
 
+{R_EMIT_RESULT_CODE}
 results = qpadm(prefix, left, right, target, allsnps = TRUE)
-
-cat("\\nRESULTS_WEIGHTS\\n")
-print(results$weights)
-cat("\\nRESULTS_POPDROP\\n")
-print(results$popdrop)
-cat("\\nRESULTS_SUMMARY\\n")
-cat("Blocks:", results$summary$nblocks, "SNPs:", results$summary$nsnps, "\\n")
+emit_result(results)
 """
 
     with tempfile.NamedTemporaryFile(delete=False, suffix=".R") as r_script:
         r_script.write(r_code.encode('utf-8'))
         r_script_path = r_script.name
 
+    timer = PhaseTimer('qpadm', dataset_prefix, key=cache_key)
     try:
-        process = subprocess.Popen(
-            [rscript_path, r_script_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding='utf-8'
-        )
+        process = RProcess([rscript_path, r_script_path])
+        timer.mark('spawn')
 
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        output_text.insert(tk.END, f"\n---\nDone by pepsimanfire - Run started at {timestamp}\n")
-        output_text.insert(tk.END, f"Target: {target_pops_raw}\nLeft: {left_pops_raw}\nRight: {right_pops_raw}\n\n")
-        output_text.see(tk.END)
-        output_text.update()
+        ui_insert(f"\n---\nDone by pepsimanfire - Run started at {timestamp}\n")
+        ui_insert(f"Target: {target_pops_raw}\nLeft: {left_pops_raw}\nRight: {right_pops_raw}\n\n")
 
         full_output = []
-        weights_output = ""
-        popdrop_output = ""
-        summary_output = ""
-        capturing_weights = False
-        capturing_popdrop = False
-        capturing_summary = False
+        parser = QpadmOutputParser()
 
         snps_count = None
         blocks_total = None
@@ -250,69 +1072,89 @@ cat("Blocks:", results$summary$nblocks, "SNPs:", results$summary$nsnps, "\\n")
         for raw_line in process.stdout:
             line = raw_line.strip()
             full_output.append(raw_line)
+            timer.feed(line)
 
-            if "RESULTS_WEIGHTS" in line:
-                capturing_weights = True
-                capturing_popdrop = capturing_summary = False
-                continue
-            elif "RESULTS_POPDROP" in line:
-                capturing_popdrop = True
-                capturing_weights = capturing_summary = False
-                continue
-            elif "RESULTS_SUMMARY" in line:
-                capturing_summary = True
-                capturing_weights = capturing_popdrop = False
-                continue
-
-            if capturing_weights:
-                weights_output += line + "\n"
-                continue
-            elif capturing_popdrop:
-                popdrop_output += line + "\n"
-                continue
-            elif capturing_summary:
-                if re.match(r'^Blocks:\s*SNPs:\s*$', line):
-                    continue
-                summary_output += line + "\n"
+            if line.startswith("RESULT_JSON\t"):
+                parser.feed(line)
                 continue
 
             snps_match = re.search(r'Computing block lengths for (\d+) SNPs', line)
             if snps_match:
                 snps_count = snps_match.group(1)
 
-            block_match = re.search(r'Computing .* block (\d+) out of (\d+)', line)
+            block_match = BLOCK_PROGRESS_PATTERN.search(line)
             if block_match:
                 block_num, total_blocks = block_match.groups()
                 blocks_total = total_blocks
-                status_label.config(text=f"Computing block {block_num} of {total_blocks}...")
-                status_label.update()
+                ui_status(f"Computing block {block_num} of {total_blocks}...")
 
             if "Error" in line or "error" in line:
-                output_text.insert(tk.END, f"❌ {line}\n")
-                output_text.see(tk.END)
-                output_text.update()
+                ui_insert(f"❌ {line}\n")
 
         process.wait()
 
-        if process.returncode != 0:
+        if job_cancelled.is_set():
+            ui_insert("\n⏹ qpAdm stopped.\n")
+            ui_status("qpAdm stopped.")
+            return
+
+        if process.returncode != 0 or parser.failed:
             error_message = '\n'.join(full_output)
-            output_text.insert(tk.END, f"\n❌ qpAdm failed with exit code {process.returncode}:\n{error_message}\n")
-            output_text.see(tk.END)
+            timer.failed = True
+            timer.mark('parse')
+            ui_insert(f"\n❌ qpAdm failed with exit code {process.returncode}:\n{error_message}\n")
+            ui_phase(timer)
         else:
-            output_text.insert(tk.END, "Weights:\n" + weights_output)
-            output_text.insert(tk.END, "Popdrop:\n" + popdrop_output)
-            if summary_output:
-                output_text.insert(tk.END, summary_output)
+            result = format_qpadm_result(parser.result)
             if blocks_total and snps_count:
-                output_text.insert(tk.END, f"Total: {blocks_total} Blocks, {snps_count} SNPs\n")
+                result += f"Total: {blocks_total} Blocks, {snps_count} SNPs\n"
+            timer.mark('parse')
+            ui_insert(result)
+            ui_phase(timer)
+            if use_cache:
+                cache = ResultCache(dataset_prefix)
+                cache.put(cache_key, result)
+                cache.close()
 
-        output_text.see(tk.END)
-        output_text.update()
-        status_label.config(text="qpAdm completed." if process.returncode == 0 else "qpAdm failed!")
+        ui_status("qpAdm completed." if process.returncode == 0 and not parser.failed else "qpAdm failed!")
 
     except Exception as e:
-        messagebox.showerror("Error running R", str(e))
+        ui_error("Error running R", str(e))
+
+    finally:
+        os.remove(r_script_path)
+
+def custom_r_code_job(rscript_path, edited_code):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".R") as temp_r_file:
+        temp_r_file.write(edited_code.encode('utf-8'))
+        r_script_path = temp_r_file.name
+
+    try:
+        process = RProcess([rscript_path, r_script_path])
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ui_insert(f"\n---\n[Done by pepsimanfire - Custom R Code Output - {timestamp}]\n")
+
+        full_output = []
+        for line in process.stdout:
+            ui_insert(line)
+            full_output.append(line)
+        
+        process.wait()
+
+        if job_cancelled.is_set():
+            ui_insert("\n⏹ Custom R code stopped.\n")
+            ui_status("Custom R code stopped.")
+            return
+
+        if process.returncode != 0:
+            error_message = ''.join(full_output)
+            ui_insert(f"\n❌ Custom R code failed (exit code {process.returncode}):\n{error_message}\n")
+            ui_status("Custom R code failed!")
+        else:
+            ui_status("Custom R code executed.")
 
+    except Exception as e:
+        ui_error("Execution Error", str(e))
     finally:
         os.remove(r_script_path)
 
@@ -332,9 +1174,8 @@ def edit_and_run_r_code():
         return
 
     # Default R code template
-    r_lib_paths = get_r_library_paths(rscript_path)
-    package_path = check_package_in_paths("admixtools", r_lib_paths)
-    lib_path_code = f'.libPaths("{package_path}")\n' if package_path else ''
+    package_path = r_package_path(rscript_path, "admixtools")
+    lib_path_code = f'.libPaths("{r_path(package_path)}")\n' if package_path else ''
 
     default_r_code = f"""
 {lib_path_code}
@@ -342,7 +1183,7 @@ library(admixtools)
 library(tidyverse)
 
 # You must edit these:
-prefix = "{dataset_prefix}" # <- If your dataset name is john_merged and your folder is john/dataset, put it like this: john/dataset/john_merged
+prefix = "{r_path(dataset_prefix)}" # <- If your dataset name is john_merged and your folder is john/dataset, put it like this: john/dataset/john_merged
 target = c("POP1")  # <- Replace with your actual target populations
 left = c("LEFT1", "LEFT2")  # <- Replace with your left populations
 right = c("RIGHT1", "RIGHT2")  # <- Replace with your right populations
@@ -386,41 +1227,7 @@ cat("Blocks:", results$summary$nblocks, "SNPs:", results$summary$nsnps, "\\n")
         edited_code = text_editor.get("1.0", tk.END)
         custom_r_code = edited_code  # Save persistently
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".R") as temp_r_file:
-            temp_r_file.write(edited_code.encode('utf-8'))
-            r_script_path = temp_r_file.name
-
-        try:
-            process = subprocess.Popen(
-                [rscript_path, r_script_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8'
-            )
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            output_text.insert(tk.END, f"\n---\n[Done by pepsimanfire - Custom R Code Output - {timestamp}]\n")
-
-            full_output = []
-            for line in process.stdout:
-                output_text.insert(tk.END, line)
-                full_output.append(line)
-                output_text.see(tk.END)
-            
-            process.wait()
-            
-            if process.returncode != 0:
-                error_message = ''.join(full_output)
-                output_text.insert(tk.END, f"\n❌ Custom R code failed (exit code {process.returncode}):\n{error_message}\n")
-                output_text.see(tk.END)
-                status_label.config(text="Custom R code failed!")
-            else:
-                status_label.config(text="Custom R code executed.")
-
-        except Exception as e:
-            messagebox.showerror("Execution Error", str(e))
-        finally:
-            os.remove(r_script_path)
+        start_job(custom_r_code_job, rscript_path, edited_code)
 
     def restore_original_code():
         nonlocal text_editor
@@ -448,6 +1255,1275 @@ cat("Blocks:", results$summary$nblocks, "SNPs:", results$summary$nsnps, "\\n")
     run_button = tk.Button(editor_win, text="Run This Code", command=run_edited_r_code, bg="lightgreen")
     run_button.pack(pady=5)
 
+# --- R WORKER POOL ---
+# Rotation models are evaluated by long-lived Rscript processes. Each worker
+# loads admixtools once, then reads one model per line from stdin
+# (id<TAB>target<TAB>left<TAB>right, populations comma-separated) and answers
+# with a RESULT_JSON record between MODEL_BEGIN and MODEL_DONE lines.
+# The single-session engine runs the same program over a file of requests;
+# the qpadm_multi engine reads that file in batches and evaluates each
+# batch with one qpadm_multi() call on the in-memory f2 blocks.
+R_WORKER_CODE = """
+{lib_path_code}
+suppressPackageStartupMessages({{
+    library(admixtools)
+    library(tidyverse)
+}})
+
+{data_code}
+
+split_pops <- function(x) {{
+    if (is.na(x) || !nzchar(x)) return(character(0))
+    strsplit(x, ",", fixed = TRUE)[[1]]
+}}
+{emit_result_code}
+run_model <- function(fields) {{
+    target <- split_pops(fields[2])
+    left <- split_pops(fields[3])
+    right <- split_pops(fields[4])
+    tryCatch({{
+        emit_result(qpadm(qpadm_data, left, right, target{qpadm_options}))
+    }}, error = function(e) {{
+        cat("ERROR:", conditionMessage(e), "\\n")
+    }})
+}}
+
+con <- file({requests_source})
+open(con)
+cat("WORKER_READY\\n")
+flush(stdout())
+{request_loop}
+"""
+
+R_SINGLE_MODEL_LOOP = """
+while (length(line <- readLines(con, n = 1)) > 0) {
+    fields <- strsplit(line, "\\t", fixed = TRUE)[[1]]
+    cat("MODEL_BEGIN\\t", line, "\\n", sep = "")
+    run_model(fields)
+    cat("MODEL_DONE\\t", fields[1], "\\n", sep = "")
+    flush(stdout())
+}
+"""
+
+# One failing model makes qpadm_multi() fail the whole batch, so such a
+# batch is rerun model by model to report which ones failed. MODEL_RETRY
+# announces the rerun, whose models are timed one at a time.
+R_MULTI_MODEL_LOOP = """
+while (length(lines <- readLines(con, n = {batch_size})) > 0) {{
+    batch <- strsplit(lines, "\\t", fixed = TRUE)
+    models <- list(
+        target = lapply(batch, function(fields) split_pops(fields[2])),
+        left = lapply(batch, function(fields) split_pops(fields[3])),
+        right = lapply(batch, function(fields) split_pops(fields[4]))
+    )
+    results <- tryCatch(
+        qpadm_multi(qpadm_data, models, verbose = FALSE),
+        error = function(e) NULL
+    )
+    if (is.null(results)) {{
+        cat("MODEL_RETRY\\n")
+        flush(stdout())
+    }}
+    for (i in seq_along(lines)) {{
+        cat("MODEL_BEGIN\\t", lines[i], "\\n", sep = "")
+        if (is.null(results)) run_model(batch[[i]]) else emit_result(results[[i]])
+        cat("MODEL_DONE\\t", batch[[i]][1], "\\n", sep = "")
+        flush(stdout())
+    }}
+}}
+"""
+QPADM_MULTI_BATCH_SIZE = 50
+
+def build_worker_r_code(lib_path_code, prefix, f2_dir=None, f2_pops=None, requests_path=None, batch_size=None):
+    if f2_dir:
+        # f2 mode: load the precomputed blocks once per worker
+        pops_code = ','.join(f'"{p}"' for p in f2_pops)
+        data_code = f'qpadm_data <- f2_from_precomp("{r_path(f2_dir)}", pops = c({pops_code}), verbose = FALSE)'
+        qpadm_options = ''
+    else:
+        data_code = f'qpadm_data <- "{r_path(prefix)}"'
+        qpadm_options = ', allsnps = TRUE'
+    requests_source = f'"{r_path(requests_path)}"' if requests_path else '"stdin"'
+    request_loop = R_MULTI_MODEL_LOOP.format(batch_size=batch_size) if batch_size else R_SINGLE_MODEL_LOOP
+    return R_WORKER_CODE.format(
+        lib_path_code=lib_path_code,
+        data_code=data_code,
+        qpadm_options=qpadm_options,
+        requests_source=requests_source,
+        request_loop=request_loop,
+        emit_result_code=R_EMIT_RESULT_CODE
+    )
+
+def format_model_request(model_id, target, left, right):
+    return '\t'.join([str(model_id), ','.join(target), ','.join(left), ','.join(right)])
+
+def parse_model_request(request):
+    fields = request.rstrip('\n').split('\t')
+    fields += [''] * (4 - len(fields))
+    model_id, target, left, right = fields[:4]
+    return (int(model_id), target.split(',') if target else [], left.split(',') if left else [], right.split(',') if right else [])
+
+class RWorker:
+    """A warm Rscript process serving model requests over stdin/stdout."""
+
+    def __init__(self, rscript_path, script_path, memory_limit=None):
+        self.process = RProcess([rscript_path, script_path], stdin=True, memory_limit=memory_limit)
+
+    def wait_ready(self):
+        startup_output = []
+        for raw_line in self.process.stdout:
+            if raw_line.strip() == "WORKER_READY":
+                return
+            startup_output.append(raw_line)
+        self.process.wait()
+        raise RuntimeError(f"R worker exited during startup (exit code {self.process.returncode}):\n" + ''.join(startup_output))
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def run_model(self, model_id, target, left, right, timeout=None):
+        # Yields the worker's output lines for one model
+        watchdog = ModelWatchdog(timeout, self.process)
+        try:
+            self.process.stdin.write(format_model_request(model_id, target, left, right) + '\n')
+            self.process.stdin.flush()
+            watchdog.arm()
+            for raw_line in self.process.stdout:
+                if raw_line.startswith("MODEL_DONE\t"):
+                    return
+                if raw_line.startswith("MODEL_BEGIN\t"):
+                    continue
+                yield raw_line
+        finally:
+            watchdog.disarm()
+        self.process.wait()
+        if self.process.kill_status:
+            raise ModelLimitExceeded(self.process.kill_status, self.process.kill_reason)
+        raise RuntimeError(f"R worker exited unexpectedly (exit code {self.process.returncode})")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+
+
+class RWorkerPool:
+    """Fixed-size set of RWorker processes sharing one generated R script."""
+
+    def __init__(self, rscript_path, r_code, size=1, memory_limit=None):
+        self.rscript_path = rscript_path
+        self.memory_limit = memory_limit
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".R", mode='w', encoding='utf-8') as r_script:
+            r_script.write(r_code)
+            self.script_path = r_script.name
+
+        self.idle = queue.Queue()
+        self.workers = []
+        try:
+            # Start every process before waiting so libraries load in parallel
+            self.workers = [RWorker(rscript_path, self.script_path, memory_limit) for _ in range(size)]
+            for worker in self.workers:
+                worker.wait_ready()
+                self.idle.put(worker)
+        except Exception:
+            self.close()
+            raise
+
+    def acquire(self):
+        worker = self.idle.get()
+        if not worker.is_alive():
+            # Replace workers that died or were killed over a limit
+            self.workers.remove(worker)
+            worker = RWorker(self.rscript_path, self.script_path, self.memory_limit)
+            self.workers.append(worker)
+            worker.wait_ready()
+        return worker
+
+    def release(self, worker):
+        self.idle.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        if os.path.exists(self.script_path):
+            os.remove(self.script_path)
+
+# --- ROTATION ENGINES ---
+# Both engines take (model_id, target, left, right) jobs and yield events:
+# ('begin', id, job), ('line', id, raw_line), ('failed', id, message, status),
+# ('done', id). The status is 'timeout' or 'oom' when a model limit stopped
+# the model, otherwise None.
+ENGINE_POOL = "Worker pool"
+ENGINE_BATCH = "Single R session"
+ENGINE_MULTI = "qpadm_multi batches (f2 only)"
+
+# --- PARALLEL SCHEDULER ---
+class LockedIterator:
+    """Lets several scheduler threads pull jobs from one iterator."""
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            return next(self.iterator)
+
+def merge_event_streams(streams):
+    # Drains each event stream on its own thread and yields events as they
+    # arrive
+    events = queue.Queue()
+    finished = object()
+
+    def drain(stream):
+        try:
+            for event in stream:
+                events.put(event)
+        except Exception as e:
+            events.put(('error', None, str(e)))
+        finally:
+            events.put(finished)
+
+    threads = [threading.Thread(target=drain, args=(stream,), daemon=True) for stream in streams]
+    for thread in threads:
+        thread.start()
+
+    running = len(threads)
+    while running:
+        event = events.get()
+        if event is finished:
+            running -= 1
+        else:
+            yield event
+
+def schedule_rotation_models(engine, jobs, parallel, pool=None, build_r_code=None, rscript_path=None, timeout=None, memory_limit=None, batch_size=None):
+    # Runs up to `parallel` models at once: pool workers share one job
+    # iterator, single-session runs each get an interleaved share of the jobs.
+    if engine in (ENGINE_BATCH, ENGINE_MULTI):
+        streams = [
+            run_models_in_session(rscript_path, build_r_code, requests_path, timeout, memory_limit, batch_size)
+            for requests_path in write_request_files(jobs, parallel)
+        ]
+    else:
+        shared_jobs = LockedIterator(jobs)
+        streams = [run_models_on_pool(pool, shared_jobs, timeout) for _ in range(parallel)]
+    return merge_event_streams(streams)
+
+def run_models_on_pool(pool, jobs, timeout=None):
+    for job in jobs:
+        if job_cancelled.is_set():
+            return
+        model_id = job[0]
+        worker = pool.acquire()
+        try:
+            yield ('begin', model_id, job)
+            for raw_line in worker.run_model(*job, timeout=timeout):
+                yield ('line', model_id, raw_line)
+        except ModelLimitExceeded as e:
+            yield ('failed', model_id, str(e), e.status)
+        except Exception as e:
+            yield ('failed', model_id, str(e), None)
+        finally:
+            pool.release(worker)
+        yield ('done', model_id)
+
+def write_request_files(jobs, count):
+    # Deals jobs round-robin into `count` request files as they are
+    # generated; files that stay empty are dropped
+    request_files = [
+        tempfile.NamedTemporaryFile(delete=False, suffix=".tsv", mode='w', encoding='utf-8')
+        for _ in range(count)
+    ]
+    try:
+        for idx, job in enumerate(jobs):
+            request_files[idx % count].write(format_model_request(*job) + '\n')
+    finally:
+        for requests_file in request_files:
+            requests_file.close()
+
+    paths = []
+    for requests_file in request_files:
+        if os.path.getsize(requests_file.name) > 0:
+            paths.append(requests_file.name)
+        else:
+            os.remove(requests_file.name)
+    return paths
+
+def run_models_in_session(rscript_path, build_r_code, requests_path, timeout=None, memory_limit=None, batch_size=None):
+    # One Rscript loops over every request in the file. When a session dies
+    # or is killed over a limit, the models it was working on fail and a
+    # fresh session takes over the rest of the file.
+    while requests_path:
+        requests_path = yield from run_session(rscript_path, build_r_code, requests_path, timeout, memory_limit, batch_size)
+
+def run_session(rscript_path, build_r_code, requests_path, timeout, memory_limit, batch_size):
+    # Records are split on the markers, and MODEL_BEGIN echoes the request
+    # it starts. Returns the file of requests left for a new session.
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".R", mode='w', encoding='utf-8') as r_script:
+        r_script.write(build_r_code(requests_path))
+        r_script_path = r_script.name
+
+    # qpadm_multi computes a whole batch before printing any of it, so its
+    # timeout covers the batch; a batch rerun model by model after
+    # MODEL_RETRY, and every model of the single-session engine, gets the
+    # timeout of one model
+    batch = batch_size or 1
+    batch_watchdog = ModelWatchdog(timeout * batch if timeout else None)
+    model_watchdog = ModelWatchdog(timeout)
+    try:
+        process = RProcess([rscript_path, r_script_path], memory_limit=memory_limit)
+        batch_watchdog.process = model_watchdog.process = process
+
+        session_output = []
+        current_model = None
+        models_done = 0
+        retrying = False
+        for raw_line in process.stdout:
+            if raw_line.startswith("MODEL_BEGIN\t"):
+                job = parse_model_request(raw_line.split('\t', 1)[1])
+                current_model = job[0]
+                batch_watchdog.disarm()  # The batch is computed, now printing
+                if batch == 1 or retrying:
+                    model_watchdog.arm()
+                yield ('begin', current_model, job)
+            elif raw_line.startswith("MODEL_DONE\t"):
+                models_done += 1
+                model_watchdog.disarm()
+                if batch > 1 and models_done % batch == 0:
+                    retrying = False
+                    batch_watchdog.arm()
+                yield ('done', current_model)
+                current_model = None
+            elif current_model is not None:
+                yield ('line', current_model, raw_line)
+            elif raw_line.strip() == "MODEL_RETRY":
+                retrying = True
+                batch_watchdog.disarm()
+            elif raw_line.strip() == "WORKER_READY":
+                if batch > 1:
+                    batch_watchdog.arm()
+            else:
+                session_output.append(raw_line)
+
+        process.wait()
+        batch_watchdog.disarm()
+        model_watchdog.disarm()
+        if job_cancelled.is_set():
+            return None
+
+        if process.kill_status:
+            message = process.kill_reason
+        else:
+            message = f"R session exited (exit code {process.returncode})"
+            if session_output:
+                message += ":\n" + ''.join(session_output)
+
+        # Requests are processed in file order, so the lines after the last
+        # finished one were in flight (one model, the rest of a batch, or
+        # the model a rerun batch was on) and fail; the rest go to a new
+        # session. A session that died before its first model fails
+        # everything, as a new one would too.
+        in_flight = 1 if retrying else batch - models_done % batch
+        if models_done == 0 and current_model is None and (batch == 1 or not process.kill_status):
+            in_flight = None
+        with open(requests_path, 'r', encoding='utf-8') as f, \
+                tempfile.NamedTemporaryFile(delete=False, suffix=".tsv", mode='w', encoding='utf-8') as requests_file:
+            remaining = islice(f, models_done, None)
+            for line in islice(remaining, in_flight):
+                job = parse_model_request(line)
+                if job[0] != current_model:
+                    yield ('begin', job[0], job)
+                yield ('failed', job[0], message, process.kill_status)
+                yield ('done', job[0])
+            requests_file.writelines(remaining)
+
+        if os.path.getsize(requests_file.name) == 0:
+            os.remove(requests_file.name)
+            return None
+        return requests_file.name
+
+    finally:
+        batch_watchdog.disarm()
+        model_watchdog.disarm()
+        os.remove(r_script_path)
+        os.remove(requests_path)
+
+class QpadmOutputParser:
+    """Collects the result record and errors of one model's output."""
+
+    def __init__(self):
+        self.result = None
+        self.errors = ""
+
+    def feed(self, raw_line):
+        line = raw_line.strip()
+
+        if line.startswith("RESULT_JSON\t"):
+            try:
+                self.result = QpadmResult.from_json(line.split('\t', 1)[1])
+            except (ValueError, KeyError, TypeError) as e:
+                self.errors += f"ERROR: unreadable result record ({e})\n"
+        elif line.startswith("ERROR:"):
+            self.errors += line + "\n"
+
+    @property
+    def failed(self):
+        return bool(self.errors) or self.result is None
+
+# --- ROTATION JOURNAL ---
+# Finished models are appended to <prefix>.rotation_journal.jsonl as they
+# complete, so an interrupted rotation can be restarted and skip them.
+# Only a resumed run reads the journal, and it keeps just the key, status
+# and file offset of each model; results are read back when replayed. A
+# fresh run moves the old journal to <prefix>.rotation_journal.jsonl.1.
+def rotation_journal_path(prefix):
+    return f"{prefix}.rotation_journal.jsonl"
+
+def model_key(target, left, right, options):
+    # Canonical identity of a model, independent of population order
+    return json.dumps([sorted(target), sorted(left), sorted(right), options], separators=(',', ':'))
+
+class RotationJournal:
+    """Append-only record of completed rotation models."""
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.completed = {}
+        if not resume and os.path.isfile(path):
+            os.replace(path, path + '.1')
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None  # Partially written line
+                    if entry is not None:
+                        indexed = {'finished': entry['finished'], 'offset': offset}
+                        if entry.get('status'):
+                            indexed['status'] = entry['status']
+                            indexed['limit'] = entry.get('limit')
+                        self.completed[entry['key']] = indexed
+                    offset += len(line)
+        self.lock = threading.Lock()
+        self.reader = None
+        self.file = open(path, 'ab')
+        if self.file.tell() > 0:
+            # Start on a fresh line in case the last write was cut off
+            self.file.write(b'\n')
+
+    def result(self, entry):
+        with self.lock:
+            if self.reader is None:
+                self.reader = open(self.path, 'rb')
+            self.reader.seek(entry['offset'])
+            return json.loads(self.reader.readline())['result']
+
+    def record(self, key, model_id, result, status=None, limit=None):
+        entry = {
+            'key': key,
+            'model': model_id,
+            'finished': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'result': result
+        }
+        if status:
+            # Kept so the model is retried when the limit is raised
+            entry['status'] = status
+            entry['limit'] = limit
+        with self.lock:
+            self.file.write((json.dumps(entry) + '\n').encode('utf-8'))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+        if self.reader is not None:
+            self.reader.close()
+
+def format_model_result(model_id, parser):
+    if parser.failed:
+        return f"❌ Model {model_id} failed:\n{parser.errors or 'no result record'}\n"
+    return format_qpadm_result(parser.result) + "\n"
+
+# --- ROTATION RESULT STORE ---
+# Every computed rotation model is also written to an SQLite store with its
+# p-value, feasibility and source set, so finished rotations can be queried
+# without scrolling through the output.
+ROTATION_RESULTS_PATH = os.path.join(APP_DATA_DIR, "rotation_results.sqlite")
+
+class RotationResultStore:
+    """Indexed store of rotation model results across runs and datasets."""
+
+    def __init__(self, path=ROTATION_RESULTS_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Rotation scheduler threads look up replayed models
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS models (
+                id INTEGER PRIMARY KEY,
+                dataset TEXT NOT NULL,
+                model TEXT NOT NULL,
+                run TEXT NOT NULL,
+                target TEXT NOT NULL,
+                left_pops TEXT NOT NULL,
+                right_pops TEXT NOT NULL,
+                n_sources INTEGER NOT NULL,
+                p REAL,
+                feasible INTEGER NOT NULL,
+                record TEXT NOT NULL,
+                created TEXT NOT NULL,
+                UNIQUE (dataset, model)
+            );
+            CREATE TABLE IF NOT EXISTS model_sources (
+                model_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                PRIMARY KEY (source, model_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS models_target_p ON models (target, p);
+            CREATE INDEX IF NOT EXISTS models_feasible_p ON models (feasible, p);
+            CREATE INDEX IF NOT EXISTS models_p ON models (p);
+        """)
+        self.db.commit()
+
+    def add(self, dataset, key, run, target, left, right, result):
+        # A model recomputed on the same dataset updates its row in place;
+        # its source set is part of the key so model_sources stays valid
+        dataset = os.path.abspath(dataset)
+        p = result.p
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO models (dataset, model, run, target, left_pops, right_pops, n_sources, p, feasible, record, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (dataset, model) DO UPDATE SET run = excluded.run, p = excluded.p, feasible = excluded.feasible, "
+                "record = excluded.record, created = excluded.created",
+                (
+                    dataset, key, run, ','.join(target), ','.join(left), ','.join(right), len(left),
+                    None if math.isnan(p) else p, int(result.feasible), json.dumps(asdict(result)),
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                )
+            )
+            model_id = self.db.execute("SELECT id FROM models WHERE dataset = ? AND model = ?", (dataset, key)).fetchone()[0]
+            self.db.executemany(
+                "INSERT OR IGNORE INTO model_sources (model_id, source) VALUES (?, ?)",
+                [(model_id, source) for source in left]
+            )
+            self.db.commit()
+
+    def get_result(self, dataset, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT record FROM models WHERE dataset = ? AND model = ?",
+                (os.path.abspath(dataset), key)
+            ).fetchone()
+        return QpadmResult.from_record(json.loads(row[0])) if row else None
+
+    def query(self, dataset=None, target=None, min_p=None, feasible_only=False, sources=(), limit=1000):
+        conditions = []
+        params = []
+        if dataset:
+            conditions.append("dataset = ?")
+            params.append(os.path.abspath(dataset))
+        if target:
+            conditions.append("target = ?")
+            params.append(target)
+        if min_p is not None:
+            conditions.append("p >= ?")
+            params.append(min_p)
+        if feasible_only:
+            conditions.append("feasible = 1")
+        for source in unique_pops(sources):
+            conditions.append("id IN (SELECT model_id FROM model_sources WHERE source = ?)")
+            params.append(source)
+        sql = "SELECT run, target, left_pops, right_pops, p, feasible FROM models"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY p DESC LIMIT ?"
+        params.append(limit)
+        return self.db.execute(sql, params).fetchall()
+
+    def close(self):
+        self.db.close()
+
+# --- ROTATION LEADERBOARD ---
+# The K best models of a running rotation are kept in a min-heap keyed on
+# p-value, so each result costs at most one O(log K) heap update.
+class ModelLeaderboard:
+    """Bounded top-K of rotation models by full-model p-value."""
+
+    def __init__(self, size, feasible_only=True):
+        self.size = size
+        self.feasible_only = feasible_only
+        self.heap = []
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def offer(self, model_id, target, left, right, result):
+        # Returns True when the leaderboard changed
+        p = result.p
+        if math.isnan(p) or (self.feasible_only and not result.feasible):
+            return False
+        with self.lock:
+            self.counter += 1
+            entry = (p, -self.counter, model_id, target, left, right)
+            if len(self.heap) < self.size:
+                heapq.heappush(self.heap, entry)
+            elif p > self.heap[0][0]:
+                heapq.heapreplace(self.heap, entry)
+            else:
+                return False
+        return True
+
+    def ranked(self):
+        with self.lock:
+            return sorted(self.heap, reverse=True)
+
+    def format(self):
+        rows = [
+            [rank, f"{p:.4g}", model_id, ', '.join(target), ', '.join(left), ', '.join(right)]
+            for rank, (p, _, model_id, target, left, right) in enumerate(self.ranked(), start=1)
+        ]
+        title = f"Top {self.size} models by p-value" + (" (feasible only)" if self.feasible_only else "") + "\n\n"
+        if not rows:
+            return title + "No qualifying models yet.\n"
+        return title + format_table(["rank", "p", "model", "target", "left", "right"], rows)
+
+# --- PARTITIONED F2 EXTRACTION ---
+# extract_f2 reads the whole genome in one R process. With more than one
+# partition the autosomes are split into runs of whole, consecutive
+# chromosomes of about equal SNP count. Each run is written out as a
+# dataset of its own (the SNP rows of those chromosomes, all samples) and
+# extracted with the same extract_f2 arguments in its own R process of a
+# PSOCK cluster. Every SNP filter of extract_f2 looks at one SNP at a time
+# and jackknife blocks never span chromosomes, so concatenating the
+# per-partition block files in chromosome order gives the blocks of a
+# serial extraction. Datasets that cannot be split row by row (transposed
+# genotypes, unexpected file sizes) are extracted serially.
+# The partition datasets are written once, to <prefix>_f2_partitions/<count>
+# next to the dataset, and reused by later extractions until the dataset
+# fingerprint changes. Writing them can be stopped with the job.
+F2_AUTOSOMES = {str(chrom) for chrom in range(1, 23)}
+PACKED_GENO_MAGIC = b"GENO"
+PLINK_BED_MAGIC = b"\x6c\x1b\x01"
+PARTITION_COPY_BYTES = 1 << 22
+PARTITION_MANIFEST_NAME = "partitions.json"
+
+R_F2_PARTITION_CODE = """
+f2_partition_prefixes <- c({prefixes})
+
+load_admixtools <- function(lib_paths) {{
+    .libPaths(lib_paths)
+    suppressMessages(library(admixtools))
+    NULL
+}}
+
+extract_f2_partition <- function(outdir, part_prefix, args) {{
+    do.call(extract_f2, c(list(part_prefix, outdir), args))
+    NULL
+}}
+
+bind_blocks <- function(parts) {{
+    # Blocks are the last dimension of every block file
+    d <- dim(parts[[1]])
+    if (is.null(d)) return(do.call(c, parts))
+    n <- length(d)
+    merged <- array(unlist(lapply(parts, as.vector)), dim = c(d[-n], sum(sapply(parts, function(p) dim(p)[n]))))
+    if (!is.null(dimnames(parts[[1]]))) {{
+        dimnames(merged) <- c(dimnames(parts[[1]])[-n], list(unlist(lapply(parts, function(p) dimnames(p)[[n]]))))
+    }}
+    merged
+}}
+
+merge_f2_partitions <- function(part_dirs, outdir) {{
+    for (file in list.files(part_dirs[1], recursive = TRUE)) {{
+        target <- file.path(outdir, file)
+        dir.create(dirname(target), recursive = TRUE, showWarnings = FALSE)
+        if (grepl("\\\\.rds$", file)) {{
+            saveRDS(bind_blocks(lapply(file.path(part_dirs, file), readRDS)), target)
+        }} else {{
+            file.copy(file.path(part_dirs[1], file), target, overwrite = TRUE)
+        }}
+    }}
+}}
+
+extract_f2_partitioned <- function(pref, outdir, ...) {{
+    # pref has been split into f2_partition_prefixes; every partition gets
+    # the arguments of the serial call
+    part_dirs <- file.path(outdir, paste0(".partition_", seq_along(f2_partition_prefixes)))
+    cat("Extracting f2 in", length(part_dirs), "chromosome partitions\\n")
+    cl <- parallel::makeCluster(length(part_dirs))
+    on.exit(parallel::stopCluster(cl))
+    parallel::clusterCall(cl, load_admixtools, .libPaths())
+    parallel::clusterMap(cl, extract_f2_partition, part_dirs, f2_partition_prefixes,
+                         MoreArgs = list(args = list(...)))
+    merge_f2_partitions(part_dirs, outdir)
+    unlink(part_dirs, recursive = TRUE)
+}}
+"""
+
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+def dataset_layout(prefix):
+    # (genotype, SNP and sample extensions, header bytes, bytes per SNP)
+    # of a dataset stored one SNP per record; None if it is not
+    if all(os.path.isfile(prefix + ext) for ext in ('.geno', '.snp', '.ind')):
+        extensions = ('.geno', '.snp', '.ind')
+        samples = count_lines(prefix + '.ind')
+        with open(prefix + '.geno', 'rb') as f:
+            magic = f.read(len(PACKED_GENO_MAGIC))
+        if magic == PACKED_GENO_MAGIC:
+            record = max(48, (samples + 3) // 4)
+            header = record
+        else:
+            # Text EIGENSTRAT; TGENO and CRLF files do not match the size check
+            record = samples + 1
+            header = 0
+    elif all(os.path.isfile(prefix + ext) for ext in ('.bed', '.bim', '.fam')):
+        extensions = ('.bed', '.bim', '.fam')
+        with open(prefix + '.bed', 'rb') as f:
+            if f.read(len(PLINK_BED_MAGIC)) != PLINK_BED_MAGIC:
+                return None
+        record = (count_lines(prefix + '.fam') + 3) // 4
+        header = len(PLINK_BED_MAGIC)
+    else:
+        return None
+    snps = count_lines(prefix + extensions[1])
+    if os.path.getsize(prefix + extensions[0]) != header + snps * record:
+        return None
+    return extensions, header, record
+
+def chromosome_partitions(prefix, count):
+    # SNP row ranges of up to count runs of consecutive autosomes, balanced
+    # by SNP count; None if the dataset has fewer than two autosomes
+    if os.path.isfile(prefix + ".snp"):
+        path, chrom_column = prefix + ".snp", 1
+    elif os.path.isfile(prefix + ".bim"):
+        path, chrom_column = prefix + ".bim", 0
+    else:
+        return None
+
+    chromosomes = {}
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        row = 0
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            chrom = fields[chrom_column] if len(fields) > chrom_column else ''
+            if chrom.lower().startswith('chr'):
+                chrom = chrom[3:]
+            if chrom in F2_AUTOSOMES:
+                ranges = chromosomes.setdefault(chrom, [])
+                if ranges and ranges[-1][1] == row:
+                    ranges[-1][1] = row + 1
+                else:
+                    ranges.append([row, row + 1])
+            row += 1
+
+    count = min(count, len(chromosomes))
+    if count < 2:
+        return None
+    sizes = {chrom: sum(stop - start for start, stop in ranges) for chrom, ranges in chromosomes.items()}
+    total = sum(sizes.values())
+    partitions = [[]]
+    assigned = 0
+    for chrom, ranges in chromosomes.items():
+        # A chromosome goes to the next partition if most of it is past
+        # this partition's share
+        if partitions[-1] and assigned + sizes[chrom] / 2 > total * len(partitions) / count:
+            partitions.append([])
+        partitions[-1].extend(ranges)
+        assigned += sizes[chrom]
+    return [sorted(ranges) for ranges in partitions]
+
+def write_partition_dataset(prefix, layout, ranges, part_prefix, progress):
+    # False if the job was stopped before the genotypes were copied
+    (geno_ext, snp_ext, sample_ext), header, record = layout
+    rows = sum(stop - start for start, stop in ranges)
+    with open(prefix + geno_ext, 'rb') as source, open(part_prefix + geno_ext, 'wb') as target:
+        head = source.read(header)
+        if geno_ext == '.geno' and header:
+            # The packed header carries the SNP count
+            fields = head.split(b'\0', 1)[0].split()
+            fields[2] = str(rows).encode('ascii')
+            head = b' '.join(fields).ljust(header, b'\0')
+        target.write(head)
+        for start, stop in ranges:
+            source.seek(header + start * record)
+            left = (stop - start) * record
+            while left:
+                if job_cancelled.is_set():
+                    return False
+                chunk = source.read(min(left, PARTITION_COPY_BYTES))
+                if not chunk:
+                    raise OSError(f"{prefix + geno_ext} ended early")
+                target.write(chunk)
+                left -= len(chunk)
+                progress(len(chunk))
+
+    keep = bytearray(ranges[-1][1])
+    for start, stop in ranges:
+        keep[start:stop] = b'\1' * (stop - start)
+    with open(prefix + snp_ext, 'rb') as source, open(part_prefix + snp_ext, 'wb') as target:
+        row = 0
+        for line in source:
+            if not line.strip():
+                continue
+            if row < len(keep) and keep[row]:
+                target.write(line)
+            row += 1
+    shutil.copyfile(prefix + sample_ext, part_prefix + sample_ext)
+    return True
+
+def f2_partitions_dir(prefix, count):
+    return os.path.join(f"{prefix}_f2_partitions", str(count))
+
+def cached_f2_partitions(part_dir, prefix):
+    # Prefixes of a finished partition set written from the current
+    # dataset files; the fingerprint is compared in the mode it was taken in
+    try:
+        with open(os.path.join(part_dir, PARTITION_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        fingerprint = dataset_fingerprint(prefix, manifest['mode'] == 'full')
+        if fingerprint is None or fingerprint != manifest['fingerprint']:
+            return None
+        prefixes = [os.path.join(part_dir, name) for name in manifest['partitions']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return prefixes
+
+def remove_stale_f2_partitions(prefix):
+    # Partition sets of older versions of the dataset files, for any count
+    root = f"{prefix}_f2_partitions"
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        part_dir = os.path.join(root, name)
+        if cached_f2_partitions(part_dir, prefix) is None:
+            shutil.rmtree(part_dir, ignore_errors=True)
+
+def prepare_f2_partitions(prefix, count):
+    # Prefixes of the partition datasets; empty for a serial extraction.
+    # A stopped job also gets none, and its R process is cancelled as it
+    # starts.
+    if count < 2:
+        return []
+    part_dir = f2_partitions_dir(prefix, count)
+    prefixes = cached_f2_partitions(part_dir, prefix)
+    if prefixes is not None:
+        return prefixes
+    partitions = chromosome_partitions(prefix, count)
+    layout = dataset_layout(prefix) if partitions else None
+    if layout is None:
+        return []
+
+    full_hash = fingerprint_full_hash
+    fingerprint = dataset_fingerprint(prefix, full_hash)
+    remove_stale_f2_partitions(prefix)
+    prefixes = [os.path.join(part_dir, f"partition_{i + 1}") for i in range(len(partitions))]
+    total = max(1, sum(stop - start for ranges in partitions for start, stop in ranges) * layout[2])
+    copied = 0
+    shown = None
+
+    def progress(size):
+        nonlocal copied, shown
+        copied += size
+        percent = copied * 100 // total
+        if percent != shown:
+            shown = percent
+            ui_status(f"Writing {len(partitions)} chromosome partitions: {percent}%")
+
+    try:
+        os.makedirs(part_dir, exist_ok=True)
+        for ranges, part_prefix in zip(partitions, prefixes):
+            if not write_partition_dataset(prefix, layout, ranges, part_prefix, progress):
+                shutil.rmtree(part_dir, ignore_errors=True)
+                return []
+        # Files that changed while they were copied give mismatched partitions
+        if fingerprint is None or dataset_fingerprint(prefix, full_hash) != fingerprint:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            return []
+        manifest = {'mode': fingerprint_mode(full_hash), 'fingerprint': fingerprint,
+                    'partitions': [os.path.basename(part_prefix) for part_prefix in prefixes]}
+        manifest_path = os.path.join(part_dir, PARTITION_MANIFEST_NAME)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    except (OSError, ValueError, IndexError):
+        shutil.rmtree(part_dir, ignore_errors=True)
+        return []
+    return prefixes
+
+def f2_partition_code(prefixes):
+    return R_F2_PARTITION_CODE.format(prefixes=','.join(f'"{r_path(prefix)}"' for prefix in prefixes))
+
+# --- ROTATION F2 EXTRACTION ---
+# In f2 mode the union of all rotation populations is extracted once with
+# extract_f2 and every model is evaluated against those blocks. The
+# extraction runs in as many chromosome partitions as there are parallel
+# workers. The directory carries a manifest of the dataset, its
+# fingerprint and the extraction options; blocks from another dataset or
+# an older version of its files are extracted again.
+R_EXTRACT_F2_CODE = """
+{lib_path_code}
+library(admixtools)
+library(tidyverse)
+
+prefix <- "{prefix}"
+my_f2_dir <- "{f2_dir}"
+mypops <- c({pops})
+{partition_code}
+{extract}(prefix, my_f2_dir, pops = mypops, overwrite = TRUE, maxmiss = 1)
+cat("F2_EXTRACTION_DONE\\n")
+"""
+
+F2_MANIFEST_NAME = ".rotation_f2.json"
+F2_EXTRACT_OPTIONS = "maxmiss=1"  # Tag of the extract_f2 arguments in R_EXTRACT_F2_CODE
+
+def f2_pops_hash(pops):
+    return hashlib.sha1('\n'.join(sorted(pops)).encode('utf-8')).hexdigest()[:12]
+
+def managed_f2_dir(prefix, pops):
+    # One directory per population set, next to the dataset
+    return os.path.join(f"{prefix}_f2", f2_pops_hash(pops))
+
+def f2_options_tag(pops):
+    # f2 results depend on the population set the blocks were extracted for
+    return f"f2:{F2_EXTRACT_OPTIONS}:{f2_pops_hash(pops)}"
+
+def load_f2_manifest(f2_dir):
+    try:
+        with open(os.path.join(f2_dir, F2_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+def save_f2_manifest(f2_dir, manifest):
+    path = os.path.join(f2_dir, F2_MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+def f2_dir_matches(manifest, prefix, pops):
+    # The blocks hold every population of the run and were extracted from
+    # the current files of this dataset with the same options
+    if (manifest is None
+            or manifest.get('dataset') != os.path.abspath(prefix)
+            or manifest.get('options') != F2_EXTRACT_OPTIONS
+            or not set(pops) <= set(manifest.get('pops') or [])):
+        return False
+    # Compared in the mode it was taken in, so toggling the full-hash
+    # fingerprint does not force a re-extraction
+    fingerprint = dataset_fingerprint(prefix, manifest.get('mode') == 'full')
+    return fingerprint is not None and fingerprint == manifest.get('fingerprint')
+
+def extract_rotation_f2(rscript_path, lib_path_code, prefix, f2_dir, pops, partitions):
+    manifest = load_f2_manifest(f2_dir)
+    if f2_dir_matches(manifest, prefix, pops):
+        ui_insert(f"Using existing f2 blocks in {f2_dir}\n")
+        return True
+    if manifest is not None:
+        ui_insert(f"f2 blocks in {f2_dir} do not match this dataset, its current files or these populations; extracting again\n")
+
+    os.makedirs(f2_dir, exist_ok=True)
+    # The old manifest no longer describes blocks that are being rewritten
+    try:
+        os.remove(os.path.join(f2_dir, F2_MANIFEST_NAME))
+    except FileNotFoundError:
+        pass
+    full_hash = fingerprint_full_hash
+    manifest = {
+        'dataset': os.path.abspath(prefix),
+        'mode': fingerprint_mode(full_hash),
+        'fingerprint': dataset_fingerprint(prefix, full_hash),
+        'options': F2_EXTRACT_OPTIONS,
+        'pops': sorted(set(pops))
+    }
+    partition_prefixes = prepare_f2_partitions(prefix, partitions)
+    r_code = R_EXTRACT_F2_CODE.format(
+        lib_path_code=lib_path_code,
+        prefix=r_path(prefix),
+        f2_dir=r_path(f2_dir),
+        pops=','.join(f'"{p}"' for p in pops),
+        partition_code=f2_partition_code(partition_prefixes) if partition_prefixes else '',
+        extract='extract_f2_partitioned' if partition_prefixes else 'extract_f2'
+    )
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".R", mode='w', encoding='utf-8') as r_script:
+        r_script.write(r_code)
+        r_script_path = r_script.name
+
+    partition_note = f" in {len(partition_prefixes)} chromosome partitions" if partition_prefixes else ""
+    ui_insert(f"Extracting f2 blocks for {len(pops)} populations into {f2_dir}{partition_note}\n")
+
+    try:
+        process = RProcess([rscript_path, r_script_path])
+
+        full_output = []
+        extraction_done = False
+        for raw_line in process.stdout:
+            line = raw_line.strip()
+            full_output.append(raw_line)
+            if line == "F2_EXTRACTION_DONE":
+                extraction_done = True
+            elif line:
+                ui_status(f"Extracting f2: {line[:100]}")
+
+        process.wait()
+
+        if job_cancelled.is_set():
+            ui_insert("⏹ f2 extraction stopped.\n")
+            return False
+
+        if process.returncode != 0 or not extraction_done:
+            error_message = ''.join(full_output)
+            ui_insert(f"❌ f2 extraction failed (exit code {process.returncode}):\n{error_message}\n")
+            return False
+
+        manifest['updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        save_f2_manifest(f2_dir, manifest)
+        ui_insert("f2 extraction completed.\n")
+        return True
+
+    except Exception as e:
+        ui_insert(f"❌ f2 extraction failed: {str(e)}\n")
+        return False
+
+    finally:
+        os.remove(r_script_path)
+
+# --- ROTATION MODELS ---
+def parse_pop_list(pop_str):
+    if not pop_str:
+        return []
+    pops = [p.strip().strip('"') for p in pop_str.split(',')]
+    return [p for p in pops if p]
+
+def unique_pops(pops):
+    return list(dict.fromkeys(pops))
+
+def canonical_rotation_sides(fixed_left, fixed_right, rotation_pool, target=None):
+    # Pool members that are already fixed on either side, or are the target,
+    # are not rotated, so with a duplicate-free pool every combination is a
+    # distinct model with no left/right overlap and no dedupe pass is needed.
+    # Returns None when the fixed sides overlap or contain the target, since
+    # every model would.
+    fixed_left = unique_pops(fixed_left)
+    fixed_right = unique_pops(fixed_right)
+    fixed = set(fixed_left) | set(fixed_right)
+    if set(fixed_left) & set(fixed_right) or target in fixed:
+        return None
+    pool = [p for p in unique_pops(rotation_pool) if p not in fixed and p != target]
+    return fixed_left, fixed_right, pool
+
+def count_rotation_models(targets, fixed_left, fixed_right, rotation_pool, model_min, model_max):
+    # Every mode draws one combination per model, so D, L and R all have
+    # sum(C(pool, k)) models over the size range, for each target
+    total = 0
+    for target in unique_pops(targets):
+        sides = canonical_rotation_sides(fixed_left, fixed_right, rotation_pool, target)
+        if sides is None:
+            continue
+        pool_size = len(sides[2])
+        total += sum(math.comb(pool_size, size) for size in range(max(model_min, 0), model_max + 1))
+    return total
+
+def iter_rotation_models(rotation_mode, fixed_left, fixed_right, rotation_pool, model_min, model_max, target=None):
+    # Streams each distinct (left, right) model once, in combinations order
+    sides = canonical_rotation_sides(fixed_left, fixed_right, rotation_pool, target)
+    if sides is None:
+        return
+    fixed_left, fixed_right, pool = sides
+
+    for size in range(max(model_min, 0), model_max + 1):
+        for combo in combinations(pool, size):
+            if rotation_mode == "r":
+                # RIGHT-ONLY: Rotation pool only added to right (left stays fixed)
+                yield fixed_left, fixed_right + list(combo)
+            elif rotation_mode == "l":
+                # LEFT-ONLY: Rotation pool only added to left (right stays fixed)
+                yield fixed_left + list(combo), fixed_right
+            else:
+                # DEFAULT: rotate both sides
+                yield fixed_left + list(combo), fixed_right + [p for p in pool if p not in combo]
+
+def iter_rotation_jobs(rotation_mode, targets, fixed_left, fixed_right, rotation_pool, model_min, model_max):
+    # Each target gets the full model set; jobs are numbered across targets
+    model_id = 0
+    for target in unique_pops(targets):
+        for left, right in iter_rotation_models(rotation_mode, fixed_left, fixed_right, rotation_pool, model_min, model_max, target):
+            model_id += 1
+            yield (model_id, [target], left, right)
+
+# --- ROTATION ESTIMATE ---
+# Mean worker-seconds per model are measured on every rotation and kept per
+# dataset and data mode; older runs are scaled down so recent ones count
+# more.
+ROTATION_TIMINGS_PATH = os.path.join(APP_DATA_DIR, "rotation_timings.json")
+ROTATION_TIMING_HISTORY = 500
+ROTATION_CONFIRM_MODELS = 10000
+ROTATION_CONFIRM_SECONDS = 12 * 3600
+
+def rotation_timing_key(prefix, use_f2):
+    return f"{os.path.abspath(prefix)}|{'f2' if use_f2 else 'allsnps'}"
+
+def load_rotation_timings():
+    try:
+        with open(ROTATION_TIMINGS_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def seconds_per_model(prefix, use_f2):
+    timing = load_rotation_timings().get(rotation_timing_key(prefix, use_f2))
+    if not timing or timing['models'] <= 0:
+        return None
+    return timing['seconds'] / timing['models']
+
+def add_timing(timing, models, seconds):
+    # Accumulates into a {'models', 'seconds'} record, scaled down past the
+    # history size
+    total_models = timing['models'] + models
+    total_seconds = timing['seconds'] + seconds
+    if total_models > ROTATION_TIMING_HISTORY:
+        scale = ROTATION_TIMING_HISTORY / total_models
+        total_models *= scale
+        total_seconds *= scale
+    timing['models'] = total_models
+    timing['seconds'] = total_seconds
+
+def record_rotation_timings(prefix, use_f2, models, seconds, shapes=None):
+    # `shapes` maps a model shape to its measured (models, seconds)
+    if models <= 0 and not shapes:
+        return
+    timings = load_rotation_timings()
+    key = rotation_timing_key(prefix, use_f2)
+    timing = timings.setdefault(key, {'models': 0, 'seconds': 0.0})
+    if models > 0:
+        add_timing(timing, models, seconds)
+    for shape, (shape_models, shape_seconds) in (shapes or {}).items():
+        add_timing(timing.setdefault('shapes', {}).setdefault(shape, {'models': 0, 'seconds': 0.0}), shape_models, shape_seconds)
+    try:
+        os.makedirs(APP_DATA_DIR, exist_ok=True)
+        with open(ROTATION_TIMINGS_PATH, 'w', encoding='utf-8') as f:
+            json.dump(timings, f, indent=1)
+    except OSError:
+        pass  # The estimate is a convenience; never fail a run over it
+
+def format_model_count(count):
+    for limit, suffix in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if count >= limit:
+            return f"{count / limit:.1f}{suffix}"
+    return str(count)
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    if seconds < 2 * 86400:
+        return f"{seconds / 3600:.1f} hours"
+    return f"{seconds / 86400:.0f} days"
+
+def estimate_rotation(settings):
+    # Returns (model count, projected seconds or None, one-line summary)
+    total_models = count_rotation_models(
+        parse_pop_list(settings['target_pops']),
+        parse_pop_list(settings['fixed_left']),
+        parse_pop_list(settings['fixed_right']),
+        parse_pop_list(settings['rotation_pool']),
+        settings['model_min'],
+        settings['model_max']
+    )
+    per_model = seconds_per_model(settings['prefix'], settings['use_f2'])
+    summary = f"{format_model_count(total_models)} models"
+    if per_model is None:
+        return total_models, None, summary + " (no timings measured on this dataset yet)"
+    # Parallel workers only help as far as there are models to share
+    seconds = total_models * per_model / max(1, min(settings['parallel'], total_models))
+    summary += f", ~{format_duration(seconds)} ({per_model:.1f} s/model, {settings['parallel']} parallel)"
+    return total_models, seconds, summary
+
+# --- ROTATION PRIORITY ---
+# Rotation models can be run in another order than they are generated in:
+# cheapest first for early results, most expensive first so parallel
+# workers finish together, or models with the user's priority populations
+# first. The generated jobs are reordered through a heap of at most
+# PRIORITY_WINDOW jobs, so a huge rotation is never held in memory.
+PRIORITY_GENERATION = "Generation order"
+PRIORITY_SMALLEST = "Smallest first"
+PRIORITY_LONGEST = "Longest first"
+PRIORITY_USER = "Priority populations first"
+PRIORITY_WINDOW = 10000
+
+def model_shape(left, right):
+    return f"{len(left)}x{len(right)}"
+
+def model_dimension_cost(left, right):
+    # qpAdm fits the full model and every subset of the left populations,
+    # each on a left x right f4 matrix
+    return (2 ** len(left)) * max(1, len(left)) * max(1, len(right))
+
+class ModelCostModel:
+    """Estimated seconds per model, from its dimensions and observed timings."""
+
+    def __init__(self, prefix, use_f2):
+        timing = load_rotation_timings().get(rotation_timing_key(prefix, use_f2), {})
+        self.observed = {}
+        observed_seconds = dimension_units = 0.0
+        for shape, shape_timing in timing.get('shapes', {}).items():
+            if shape_timing['models'] <= 0:
+                continue
+            self.observed[shape] = shape_timing['seconds'] / shape_timing['models']
+            left_count, right_count = (int(n) for n in shape.split('x'))
+            observed_seconds += shape_timing['seconds']
+            dimension_units += shape_timing['models'] * model_dimension_cost([None] * left_count, [None] * right_count)
+        # Shapes not measured yet are scaled from their dimensions with the
+        # seconds per unit seen on the measured ones
+        self.seconds_per_unit = observed_seconds / dimension_units if dimension_units else None
+
+    def cost(self, left, right):
+        observed = self.observed.get(model_shape(left, right))
+        if observed is not None:
+            return observed
+        units = model_dimension_cost(left, right)
+        return units * self.seconds_per_unit if self.seconds_per_unit else units
+
+def prioritize_jobs(jobs, policy, cost_model, priority_pops=(), window=PRIORITY_WINDOW):
+    if policy == PRIORITY_GENERATION:
+        yield from jobs
+        return
+    priority_pops = set(priority_pops)
+
+    def rank(job):
+        _, job_target, left, right = job
+        cost = cost_model.cost(left, right)
+        if policy == PRIORITY_LONGEST:
+            return (-cost,)
+        if policy == PRIORITY_USER:
+            # Most priority populations first, cheapest first among equals
+            return (-len(priority_pops.intersection(job_target + left)), cost)
+        return (cost,)
+
+    heap = []
+    for job in jobs:
+        # The model number breaks ties, keeping generation order
+        heapq.heappush(heap, (rank(job), job[0], job))
+        if len(heap) >= window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
 # --- ROTATION FUNCTIONS ---
 def run_rotation():
     # --- Get Rscript path first ---
@@ -464,196 +2540,343 @@ def run_rotation():
             messagebox.showerror("Error", f"Rscript.exe not found at:\n{os.path.join(r_folder, 'bin', 'Rscript.exe')}\nor\n{os.path.join(r_folder, 'bin', 'x64', 'Rscript.exe')}")
             return
 
+    settings = read_rotation_settings()
+    if settings is None:
+        return
+    settings['rscript_path'] = rscript_path
+    if settings['engine'] == ENGINE_MULTI and not settings['use_f2']:
+        messagebox.showerror("Error", "The qpadm_multi engine works on precomputed f2 blocks. Tick 'Use precomputed f2 blocks' or pick another engine.")
+        return
+    if settings['priority_policy'] == PRIORITY_USER and not settings['priority_pops']:
+        messagebox.showerror("Error", "List the populations to run first in 'Priority pops', or pick another order.")
+        return
+
+    total_models, seconds, summary = estimate_rotation(settings)
+    if total_models == 0:
+        messagebox.showerror("No models", "These rotation settings produce no models. Check the targets, the pool, the model size range and that the fixed sides do not overlap or contain a target.")
+        return
+    if total_models > ROTATION_CONFIRM_MODELS or (seconds or 0) > ROTATION_CONFIRM_SECONDS:
+        if not messagebox.askyesno("Large rotation", f"This rotation is {summary}.\n\nStart it anyway?"):
+            return
+    start_job(rotation_job, settings)
+
+def read_rotation_settings():
     # --- Get Inputs ---
     target_pops = target_entry.get().strip()
     fixed_left = fixed_left_entry.get().strip()
     fixed_right = fixed_right_entry.get().strip()
     rotation_pool = rotation_pool_entry.get().strip()
-    model_min = int(model_min_entry.get())
-    model_max = int(model_max_entry.get())
+    try:
+        model_min = int(model_min_entry.get())
+        model_max = int(model_max_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Model size min and max must be whole numbers.")
+        return None
     prefix = prefix_entry.get().strip()
     rotation_mode = rotation_mode_entry.get().strip().lower()[0] if rotation_mode_entry.get().strip() else 'd'
+    use_f2 = rotation_f2_var.get()
+    engine = rotation_engine_var.get()
+    try:
+        parallel = max(1, int(parallel_workers_entry.get()))
+    except ValueError:
+        parallel = 1
+    f2_dir = rotation_f2_entry.get().strip()
+    try:
+        leaderboard_size = max(1, int(leaderboard_size_entry.get()))
+    except ValueError:
+        leaderboard_size = 20
+    try:
+        model_timeout = max(0.0, float(model_timeout_entry.get() or 0))
+        memory_limit = max(0.0, float(memory_limit_entry.get() or 0))
+    except ValueError:
+        messagebox.showerror("Error", "The model timeout and memory limit must be numbers (0 for no limit).")
+        return None
+
+    return {
+        'target_pops': target_pops,
+        'fixed_left': fixed_left,
+        'fixed_right': fixed_right,
+        'rotation_pool': rotation_pool,
+        'model_min': model_min,
+        'model_max': model_max,
+        'prefix': prefix,
+        'rotation_mode': rotation_mode,
+        'use_f2': use_f2,
+        'f2_dir': f2_dir,
+        'engine': engine,
+        'parallel': parallel,
+        'resume': rotation_resume_var.get(),
+        'use_cache': result_cache_var.get(),
+        'leaderboard_size': leaderboard_size,
+        'leaderboard_feasible': leaderboard_feasible_var.get(),
+        'model_timeout': model_timeout or None,
+        'memory_limit': int(memory_limit * (1 << 30)) or None,
+        'priority_policy': rotation_priority_var.get(),
+        'priority_pops': parse_pop_list(priority_pops_entry.get().strip())
+    }
+
+def estimate_rotation_dry_run():
+    settings = read_rotation_settings()
+    if settings is None:
+        return
+    summary = estimate_rotation(settings)[2]
+    ui_insert(f"\n[Rotation estimate] {summary}\n")
+    messagebox.showinfo("Rotation estimate", summary)
+
+def rotation_job(settings):
+    rscript_path = settings['rscript_path']
+    target_pops = settings['target_pops']
+    fixed_left = settings['fixed_left']
+    fixed_right = settings['fixed_right']
+    rotation_pool = settings['rotation_pool']
+    model_min = settings['model_min']
+    model_max = settings['model_max']
+    prefix = settings['prefix']
+    rotation_mode = settings['rotation_mode']
+    use_f2 = settings['use_f2']
+    f2_dir = settings['f2_dir']
+    engine = settings['engine']
+    parallel = settings['parallel']
+    resume = settings['resume']
+    use_cache = settings['use_cache']
+    model_timeout = settings['model_timeout']
+    memory_limit = settings['memory_limit']
+    priority_policy = settings['priority_policy']
+    leaderboard = ModelLeaderboard(settings['leaderboard_size'], settings['leaderboard_feasible'])
+
+    # Format populations; several targets each get the full model set
+    target = unique_pops(parse_pop_list(target_pops))
+    fixed_left_pops = parse_pop_list(fixed_left)
+    fixed_right_pops = parse_pop_list(fixed_right)
+    rotation_pool_pops = parse_pop_list(rotation_pool)
+
+    # Models are generated lazily and counted without enumerating them
+    total_models, _, estimate = estimate_rotation(settings)
 
-    # Format populations
-    def format_pop_list(pop_str):
-        if not pop_str:
-            return []
-        pops = [p.strip().strip('"') for p in pop_str.split(',')]
-        return [f'"{p}"' for p in pops if p]
-
-    fixed_left_pops = format_pop_list(fixed_left)
-    fixed_right_pops = format_pop_list(fixed_right)
-    rotation_pool_pops = format_pop_list(rotation_pool)
-
-    # --- Generate all models based on rotation mode ---
-    all_models = []
-    
-    if rotation_mode == "r":
-        # RIGHT-ONLY: Rotation pool only added to right (left stays fixed)
-        for size in range(model_min, model_max + 1):
-            for combo in combinations(rotation_pool_pops, size):
-                right = fixed_right_pops + list(combo)
-                left = fixed_left_pops  # Left remains unchanged
-                if not (set(left) & set(right)):  # Skip if overlap
-                    all_models.append((left, right))
-                    
-    elif rotation_mode == "l":
-        # LEFT-ONLY: Rotation pool only added to left (right stays fixed)
-        for size in range(model_min, model_max + 1):
-            for combo in combinations(rotation_pool_pops, size):
-                left = fixed_left_pops + list(combo)
-                right = fixed_right_pops  # Right remains unchanged
-                if not (set(left) & set(right)):  # Skip if overlap
-                    all_models.append((left, right))
-    else:
-        # DEFAULT: Original behavior - rotate both sides
-        for size in range(model_min, model_max + 1):
-            for combo in combinations(rotation_pool_pops, size):
-                rotating_left = list(combo)
-                rotating_right = [p for p in rotation_pool_pops if p not in rotating_left]
-                left = fixed_left_pops + rotating_left
-                right = fixed_right_pops + rotating_right
-                if not (set(left) & set(right)):  # Skip if overlap
-                    all_models.append((left, right))
-    
-    # Remove duplicates
-    unique_models = []
-    seen = set()
-    for left, right in all_models:
-        key = (tuple(sorted(left)), tuple(sorted(right)))
-        if key not in seen:
-            seen.add(key)
-            unique_models.append((left, right))
-    
-    # Print all models first
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    output_text.insert(tk.END, f"\n---\n[Rotation Analysis - {timestamp}]\n")
-    output_text.insert(tk.END, f"Target: {target_pops}\n")
-    output_text.insert(tk.END, f"Fixed Left: {fixed_left_pops}\n")
-    output_text.insert(tk.END, f"Fixed Right: {fixed_right_pops}\n")
-    output_text.insert(tk.END, f"Rotation Pool: {rotation_pool_pops}\n")
-    output_text.insert(tk.END, f"Rotation Mode: {'Right-only' if rotation_mode == 'r' else 'Left-only' if rotation_mode == 'l' else 'Default'}\n")
-    output_text.insert(tk.END, f"Model Size Range: {model_min}-{model_max}\n")
-    output_text.insert(tk.END, f"Total Models: {len(unique_models)}\n\n")
-    output_text.see(tk.END)
-    output_text.update()
-
-    # --- Run Models ---
-    total_models = len(unique_models)
-    for idx, (left, right) in enumerate(unique_models):
-        current_model = idx + 1
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        output_text.insert(tk.END, f"\n---\n[Model {current_model}/{total_models} - {timestamp}]\n")
-        output_text.insert(tk.END, f"Left: {', '.join(left)}\n")
-        output_text.insert(tk.END, f"Right: {', '.join(right)}\n")
-        output_text.update()
-
-        # Format populations for R
-        formatted_left = ','.join(left)
-        formatted_right = ','.join(right)
-        formatted_target = f'"{target_pops}"'
-
-        # Generate R code with same output format as run_qpadm()
-        r_code = f"""
-library(admixtools)
-library(tidyverse)
-
-prefix <- "{prefix}"
-target <- c({formatted_target})
-left <- c({formatted_left})
-right <- c({formatted_right})
-
-tryCatch({{
-    results <- qpadm(prefix, left, right, target, allsnps = TRUE)
-    
-    cat("\\nRESULTS_WEIGHTS\\n")
-    print(results$weights)
-    cat("\\nRESULTS_POPDROP\\n")
-    print(results$popdrop)
-}}, error = function(e) {{
-    cat("ERROR:", e$message, "\\n")
-}})
-"""
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".R", mode='w') as r_script:
-            r_script.write(r_code)
-            r_script_path = r_script.name
+    ui_insert(f"\n---\n[Rotation Analysis - {timestamp}]\n")
+    ui_insert(f"Target{'s' if len(target) > 1 else ''}: {', '.join(target)}\n")
+    ui_insert(f"Fixed Left: {', '.join(fixed_left_pops)}\n")
+    ui_insert(f"Fixed Right: {', '.join(fixed_right_pops)}\n")
+    ui_insert(f"Rotation Pool: {', '.join(rotation_pool_pops)}\n")
+    ui_insert(f"Rotation Mode: {'Right-only' if rotation_mode == 'r' else 'Left-only' if rotation_mode == 'l' else 'Default'}\n")
+    ui_insert(f"Model Size Range: {model_min}-{model_max}\n")
+    ui_insert(f"Data: {'precomputed f2 blocks' if use_f2 else 'genotypes (allsnps)'}\n")
+    ui_insert(f"Engine: {engine} ({parallel} parallel)\n")
+    if priority_policy == PRIORITY_USER:
+        ui_insert(f"Order: {priority_policy} ({', '.join(settings['priority_pops'])})\n")
+    elif priority_policy != PRIORITY_GENERATION:
+        ui_insert(f"Order: {priority_policy}\n")
+    if model_timeout or memory_limit:
+        limits = []
+        if model_timeout:
+            limits.append(f"{model_timeout:g} s per model")
+        if memory_limit:
+            limits.append(f"{format_gigabytes(memory_limit)} per worker")
+        ui_insert(f"Limits: {', '.join(limits)}\n")
+    ui_insert(f"Total Models: {total_models}\n")
+    ui_insert(f"Estimate: {estimate}\n\n")
+
+    # --- Start R workers ---
+    package_path = r_package_path(rscript_path, "admixtools")
+    lib_path_code = f'.libPaths("{r_path(package_path)}")\n' if package_path else ''
+
+    f2_pops = None
+    if use_f2:
+        f2_pops = unique_pops(target + fixed_left_pops + fixed_right_pops + rotation_pool_pops)
+        if not f2_dir:
+            f2_dir = managed_f2_dir(prefix, f2_pops)
+        if not extract_rotation_f2(rscript_path, lib_path_code, prefix, f2_dir, f2_pops, parallel):
+            ui_status("Rotation analysis stopped." if job_cancelled.is_set() else "Rotation analysis failed!")
+            return
 
-        try:
-            process = subprocess.Popen(
-                [rscript_path, r_script_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8'
-            )
-            
-            # Parse output the same way as run_qpadm()
-            full_output = []
-            weights_output = ""
-            popdrop_output = ""
-            summary_output = ""
-            capturing_weights = False
-            capturing_popdrop = False
-            capturing_summary = False
-
-            for raw_line in process.stdout:
-                line = raw_line.strip()
-                full_output.append(raw_line)
-
-                if "RESULTS_WEIGHTS" in line:
-                    capturing_weights = True
-                    capturing_popdrop = capturing_summary = False
-                    continue
-                elif "RESULTS_POPDROP" in line:
-                    capturing_popdrop = True
-                    capturing_weights = capturing_summary = False
-                    continue
-                elif "RESULTS_SUMMARY" in line:
-                    capturing_summary = True
-                    capturing_weights = capturing_popdrop = False
+    # --- Skip models already in the journal or the result cache ---
+    options = f2_options_tag(f2_pops) if use_f2 else 'allsnps'
+    journal = RotationJournal(rotation_journal_path(prefix), resume)
+    cache = ResultCache(prefix) if use_cache else None
+    store = RotationResultStore()
+    run_id = timestamp
+    journal_hits = cache_hits = 0
+    ui_leaderboard(leaderboard.format())
+
+    def pending_jobs():
+        # Runs on the scheduler threads as jobs are pulled
+        nonlocal journal_hits, cache_hits
+        for job in iter_rotation_jobs(rotation_mode, target, fixed_left_pops, fixed_right_pops, rotation_pool_pops, model_min, model_max):
+            if job_cancelled.is_set():
+                return
+            model_id, job_target, left, right = job
+            key = model_key(job_target, left, right, options)
+            entry = journal.completed.get(key)
+            if entry is not None and limit_was_raised(entry, model_timeout, memory_limit):
+                entry = None
+            if entry is not None:
+                journal_hits += 1
+                source = f"from journal, finished {entry['finished']}"
+                result = journal.result(entry)
+            else:
+                result = cache.get(key) if cache is not None else None
+                if result is None:
+                    yield job
                     continue
+                cache_hits += 1
+                source = "cached result"
+                journal.record(key, model_id, result)
+            stored_result = store.get_result(prefix, key)
+            if stored_result is not None and leaderboard.offer(model_id, job_target, left, right, stored_result):
+                ui_leaderboard(leaderboard.format())
+            ui_insert(f"\n---\n[Model {model_id}/{total_models} - {source}]\n")
+            ui_insert(f"Target: {', '.join(job_target)}\n")
+            ui_insert(f"Left: {', '.join(left)}\n")
+            ui_insert(f"Right: {', '.join(right)}\n")
+            ui_insert(result)
+
+    batch_size = QPADM_MULTI_BATCH_SIZE if engine == ENGINE_MULTI else None
+    build_r_code = lambda requests_path=None: build_worker_r_code(lib_path_code, prefix, f2_dir if use_f2 else None, f2_pops, requests_path, batch_size)
+
+    # Timings cover worker startup and, for the qpadm_multi engine, whole
+    # batches, so they are taken over the run rather than per model
+    run_started = time.monotonic()
+    pool = None
+    if engine == ENGINE_POOL:
+        ui_status(f"Starting {parallel} R worker(s)...")
+        try:
+            pool = RWorkerPool(rscript_path, build_r_code(), size=min(parallel, max(1, total_models)), memory_limit=memory_limit)
+        except Exception as e:
+            ui_insert(f"❌ Could not start R worker: {str(e)}\n")
+            ui_status("Rotation analysis failed!")
+            journal.close()
+            if cache is not None:
+                cache.close()
+            store.close()
+            return
 
-                if capturing_weights:
-                    weights_output += line + "\n"
-                elif capturing_popdrop:
-                    popdrop_output += line + "\n"
-                elif capturing_summary:
-                    summary_output += line + "\n"
-
-                # Show progress for long-running models
-                block_match = re.search(r'Computing .* block (\d+) out of (\d+)', line)
+    jobs = prioritize_jobs(pending_jobs(), priority_policy, ModelCostModel(prefix, use_f2), settings['priority_pops'])
+    events = schedule_rotation_models(engine, jobs, parallel, pool=pool, build_r_code=build_r_code, rscript_path=rscript_path,
+                                      timeout=model_timeout, memory_limit=memory_limit, batch_size=batch_size)
+
+    running_jobs = {}
+    parsers = {}
+    failures = {}
+    block_progress = {}
+    completed = 0
+    # Per-model times feed the cost estimates of later runs; qpadm_multi
+    # fits whole batches, so its models have no time of their own
+    model_started = {}
+    shape_timings = {}
+    # Rotation models run in warm R processes, so their phases start at
+    # the request; R startup is paid once per worker or session
+    phase_timers = {}
+    try:
+        for event in events:
+            kind, current_model = event[0], event[1]
+
+            if kind == 'begin':
+                running_jobs[current_model] = event[2]
+                model_started[current_model] = time.monotonic()
+                phase_timers[current_model] = PhaseTimer('rotation', prefix, current_model)
+                parsers[current_model] = QpadmOutputParser()
+                block_progress[current_model] = ""
+
+            elif kind == 'line':
+                line = event[2].strip()
+                parsers[current_model].feed(line)
+                phase_timers[current_model].feed(line)
+
+                # Track progress for long-running models
+                block_match = BLOCK_PROGRESS_PATTERN.search(line)
                 if block_match:
                     block_num, total_blocks = block_match.groups()
-                    status_label.config(text=f"Model {current_model}/{total_models} - Block {block_num}/{total_blocks}")
-                    status_label.update()
-
-            process.wait()
-
-            # Display results or errors
-            if process.returncode != 0:
-                error_message = '\n'.join(full_output)
-                output_text.insert(tk.END, f"❌ Model {current_model} failed (exit code {process.returncode}):\n{error_message}\n")
-            else:
-                if weights_output:
-                    output_text.insert(tk.END, "Weights:\n" + weights_output + "\n")
-                if popdrop_output:
-                    output_text.insert(tk.END, "Popdrop:\n" + popdrop_output + "\n")
-                if summary_output:
-                    output_text.insert(tk.END, "Summary:\n" + summary_output + "\n")
+                    block_progress[current_model] = f"Model {current_model} - Block {block_num}/{total_blocks}"
+
+            elif kind == 'failed':
+                failures[current_model] = (event[2], event[3])
+
+            elif kind == 'error':
+                ui_insert(f"❌ Scheduler error: {event[2]}\n")
+
+            elif kind == 'done':
+                _, job_target, left, right = running_jobs.pop(current_model)
+                parser = parsers.pop(current_model)
+                model_seconds = time.monotonic() - model_started.pop(current_model)
+                timer = phase_timers.pop(current_model)
+                block_progress.pop(current_model, None)
+                completed += 1
+
+                # Models finish out of order when running in parallel, so
+                # each one is printed as a whole under its own number
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                ui_insert(f"\n---\n[Model {current_model}/{total_models} - {timestamp}]\n")
+                ui_insert(f"Target: {', '.join(job_target)}\n")
+                ui_insert(f"Left: {', '.join(left)}\n")
+                ui_insert(f"Right: {', '.join(right)}\n")
+
+                # Display results or errors; worker crashes are not
+                # journaled so the model is retried on the next run, models
+                # stopped by a limit are journaled with the limit they hit
+                key = model_key(job_target, left, right, options)
+                timer.key = key
+                message, status = failures.pop(current_model, (None, None))
+                timer.failed = message is not None or parser.failed
+                if message is not None and job_cancelled.is_set():
+                    ui_insert(f"⏹ Model {current_model} stopped.\n")
+                elif status == 'timeout':
+                    result = f"⏱ Model {current_model} {message}\n"
+                    ui_insert(result)
+                    journal.record(key, current_model, result, status, model_timeout)
+                elif status == 'oom':
+                    result = f"❌ Model {current_model} ran {message}\n"
+                    ui_insert(result)
+                    journal.record(key, current_model, result, status, memory_limit)
+                elif message is not None:
+                    ui_insert(f"❌ Model {current_model} failed: {message}\n")
+                else:
+                    result = format_model_result(current_model, parser)
+                    ui_insert(result)
+                    status = failure_status(parser.errors) if memory_limit else None
+                    journal.record(key, current_model, result, status, memory_limit)
+                    if cache is not None and not parser.failed:
+                        cache.put(key, result)
+                    if engine != ENGINE_MULTI and not parser.failed:
+                        shape = shape_timings.setdefault(model_shape(left, right), [0, 0.0])
+                        shape[0] += 1
+                        shape[1] += model_seconds
+                    if parser.result is not None:
+                        store.add(prefix, key, run_id, job_target, left, right, parser.result)
+                        if leaderboard.offer(current_model, job_target, left, right, parser.result):
+                            ui_leaderboard(leaderboard.format())
+                timer.mark('parse')
+                ui_phase(timer)
+
+            # Aggregate progress across all running models
+            running = ', '.join(p for p in block_progress.values() if p)
+            done = completed + journal_hits + cache_hits
+            ui_status(f"{done}/{total_models} models done, {len(parsers)} running" + (f" | {running}" if running else ""))
 
-            output_text.see(tk.END)
-            output_text.update()
-
-        except Exception as e:
-            output_text.insert(tk.END, f"❌ Model {current_model} failed: {str(e)}\n")
-            output_text.see(tk.END)
-
-        finally:
-            if os.path.exists(r_script_path):
-                os.remove(r_script_path)
+    except Exception as e:
+        ui_insert(f"❌ Rotation failed: {str(e)}\n")
 
-    status_label.config(text="Rotation analysis completed!")
+    finally:
+        if pool is not None:
+            pool.close()
+        worker_seconds = (time.monotonic() - run_started) * min(parallel, completed)
+        record_rotation_timings(prefix, use_f2, completed, worker_seconds, shape_timings)
+        journal.close()
+        store.close()
+        if cache is not None:
+            cache.close()
+
+    if leaderboard.heap:
+        ui_insert(f"\n{leaderboard.format()}")
+    if journal_hits:
+        ui_insert(f"\nResumed from journal: {journal_hits} of {total_models} models were already finished.\n")
+    if cache_hits:
+        ui_insert(f"\nResult cache: {cache_hits} of {total_models} models were already computed for this dataset.\n")
+    if job_cancelled.is_set():
+        ui_insert(f"\n⏹ Rotation stopped after {completed + journal_hits + cache_hits} of {total_models} models.\n")
+        ui_status("Rotation analysis stopped.")
+        return
+    ui_status("Rotation analysis completed!")
     
 # --- MAIN WINDOW SETUP ---
 root = tk.Tk()
@@ -1226,6 +3449,159 @@ def validate_rotation_mode_input(new_text):
 rotation_mode_entry.config(validate="key")
 rotation_mode_entry.config(validatecommand=(rotation_mode_entry.register(validate_rotation_mode_input), '%P'))
 
+# Rotation engine
+tk.Label(rotation_frame, text="Rotation Engine:").grid(row=7, column=0, sticky='w', padx=5)
+rotation_engine_var = tk.StringVar(value=ENGINE_POOL)
+tk.OptionMenu(rotation_frame, rotation_engine_var, ENGINE_POOL, ENGINE_BATCH, ENGINE_MULTI).grid(row=7, column=1, sticky='w', padx=5)
+
+result_cache_var = tk.BooleanVar(value=True)
+tk.Checkbutton(rotation_frame, text="Reuse cached qpAdm results for this dataset (also for Run qpAdm)", variable=result_cache_var).grid(row=10, column=0, columnspan=2, sticky='w', padx=5)
+
+# Identify datasets by hashing every byte instead of sampled blocks
+full_fingerprint_var = tk.BooleanVar(value=False)
+tk.Checkbutton(rotation_frame, text="Full-hash dataset fingerprint", variable=full_fingerprint_var,
+               command=lambda: set_fingerprint_full_hash(full_fingerprint_var.get())).grid(row=10, column=2, sticky='w', padx=5)
+
+rotation_resume_var = tk.BooleanVar(value=True)
+tk.Checkbutton(rotation_frame, text="Resume: skip models already in the rotation journal", variable=rotation_resume_var).grid(row=9, column=0, columnspan=2, sticky='w', padx=5)
+
+tk.Label(rotation_frame, text="Parallel Workers:").grid(row=8, column=0, sticky='w', padx=5)
+parallel_workers_entry = tk.Entry(rotation_frame, width=5)
+parallel_workers_entry.insert(0, "1")
+parallel_workers_entry.grid(row=8, column=1, sticky='w', padx=5)
+
+# f2 mode: extract f2 blocks once for the whole rotation
+rotation_f2_var = tk.BooleanVar(value=False)
+tk.Checkbutton(rotation_frame, text="Use precomputed f2 blocks (extract once per rotation)", variable=rotation_f2_var).grid(row=5, column=0, columnspan=2, sticky='w', padx=5)
+
+tk.Label(rotation_frame, text="F2 Directory (optional):").grid(row=6, column=0, sticky='w', padx=5)
+rotation_f2_entry = tk.Entry(rotation_frame, width=150)
+rotation_f2_entry.grid(row=6, column=1, padx=5)
+
+def browse_rotation_f2_dir():
+    folder_selected = filedialog.askdirectory()
+    if folder_selected:
+        rotation_f2_entry.delete(0, tk.END)
+        rotation_f2_entry.insert(0, folder_selected)
+
+tk.Button(rotation_frame, text="Browse...", command=browse_rotation_f2_dir).grid(row=6, column=2, padx=(0, 5))
+
+# Query window over the rotation result store
+def open_rotation_results_window():
+    top = tk.Toplevel(root)
+    top.title("Rotation Results")
+    top.geometry("1100x600")
+    top.resizable(True, True)
+
+    query_frame = tk.Frame(top)
+    query_frame.pack(fill=tk.X, padx=5, pady=5)
+
+    tk.Label(query_frame, text="Target:").grid(row=0, column=0, sticky='w')
+    target_query_entry = tk.Entry(query_frame, width=30)
+    target_query_entry.grid(row=0, column=1, sticky='w', padx=5)
+
+    tk.Label(query_frame, text="Min p-value:").grid(row=0, column=2, sticky='w')
+    min_p_entry = tk.Entry(query_frame, width=8)
+    min_p_entry.insert(0, "0.05")
+    min_p_entry.grid(row=0, column=3, sticky='w', padx=5)
+
+    tk.Label(query_frame, text="Containing sources:").grid(row=1, column=0, sticky='w')
+    sources_entry = tk.Entry(query_frame, width=60)
+    sources_entry.grid(row=1, column=1, columnspan=3, sticky='we', padx=5)
+
+    feasible_var = tk.BooleanVar(value=True)
+    tk.Checkbutton(query_frame, text="Feasible only", variable=feasible_var).grid(row=0, column=4, sticky='w', padx=5)
+    this_dataset_var = tk.BooleanVar(value=True)
+    tk.Checkbutton(query_frame, text="This dataset only", variable=this_dataset_var).grid(row=1, column=4, sticky='w', padx=5)
+
+    results_text = scrolledtext.ScrolledText(top, wrap=tk.NONE, font=("Consolas", 10))
+    results_text.pack(expand=True, fill="both", padx=5, pady=(0, 5))
+
+    def run_query(event=None):
+        try:
+            min_p = float(min_p_entry.get()) if min_p_entry.get().strip() else None
+        except ValueError:
+            messagebox.showerror("Error", "Min p-value must be a number.", parent=top)
+            return
+        store = RotationResultStore()
+        try:
+            rows = store.query(
+                dataset=prefix_entry.get().strip() if this_dataset_var.get() else None,
+                target=target_query_entry.get().strip().strip('"') or None,
+                min_p=min_p,
+                feasible_only=feasible_var.get(),
+                sources=parse_pop_list(sources_entry.get())
+            )
+        finally:
+            store.close()
+        results_text.delete("1.0", tk.END)
+        results_text.insert(tk.END, f"{len(rows)} model(s), best p-value first\n\n")
+        if rows:
+            results_text.insert(tk.END, format_table(
+                ["p", "feasible", "target", "left", "right", "run"],
+                [["" if p is None else f"{p:.4g}", bool(feasible), target, left, right, run] for run, target, left, right, p, feasible in rows]
+            ))
+
+    tk.Button(query_frame, text="Search", command=run_query, width=10).grid(row=0, column=5, rowspan=2, padx=5)
+    for entry in (target_query_entry, min_p_entry, sources_entry):
+        entry.bind("<Return>", run_query)
+    run_query()
+
+tk.Button(rotation_frame, text="Browse Rotation Results...", command=open_rotation_results_window).grid(row=11, column=0, sticky='w', padx=5, pady=(5, 0))
+
+# Live leaderboard of the running rotation
+leaderboard_latest = "No rotation has run yet.\n"
+leaderboard_window = None
+
+def show_leaderboard(text):
+    global leaderboard_latest
+    leaderboard_latest = text
+    if leaderboard_window is not None and leaderboard_window.winfo_exists():
+        leaderboard_window.text.delete("1.0", tk.END)
+        leaderboard_window.text.insert("1.0", text)
+
+def open_leaderboard_window():
+    global leaderboard_window
+    if leaderboard_window is not None and leaderboard_window.winfo_exists():
+        leaderboard_window.lift()
+        return
+    leaderboard_window = tk.Toplevel(root)
+    leaderboard_window.title("Rotation Leaderboard")
+    leaderboard_window.geometry("1000x450")
+    leaderboard_window.text = scrolledtext.ScrolledText(leaderboard_window, wrap=tk.NONE, font=("Consolas", 10))
+    leaderboard_window.text.pack(expand=True, fill="both")
+    show_leaderboard(leaderboard_latest)
+
+leaderboard_frame = tk.Frame(rotation_frame)
+leaderboard_frame.grid(row=12, column=0, columnspan=2, sticky='w', padx=5, pady=(5, 0))
+tk.Label(leaderboard_frame, text="Leaderboard size (K):").pack(side=tk.LEFT)
+leaderboard_size_entry = tk.Entry(leaderboard_frame, width=5)
+leaderboard_size_entry.insert(0, "20")
+leaderboard_size_entry.pack(side=tk.LEFT, padx=5)
+leaderboard_feasible_var = tk.BooleanVar(value=True)
+tk.Checkbutton(leaderboard_frame, text="Feasible only", variable=leaderboard_feasible_var).pack(side=tk.LEFT, padx=5)
+tk.Button(leaderboard_frame, text="Show Leaderboard", command=open_leaderboard_window).pack(side=tk.LEFT, padx=5)
+
+limits_frame = tk.Frame(rotation_frame)
+limits_frame.grid(row=13, column=0, columnspan=2, sticky='w', padx=5, pady=(5, 0))
+tk.Label(limits_frame, text="Model timeout (s, 0 = none):").pack(side=tk.LEFT)
+model_timeout_entry = tk.Entry(limits_frame, width=7)
+model_timeout_entry.insert(0, "0")
+model_timeout_entry.pack(side=tk.LEFT, padx=5)
+tk.Label(limits_frame, text="Memory limit per worker (GB, 0 = none):").pack(side=tk.LEFT, padx=(10, 0))
+memory_limit_entry = tk.Entry(limits_frame, width=7)
+memory_limit_entry.insert(0, "0")
+memory_limit_entry.pack(side=tk.LEFT, padx=5)
+
+priority_frame = tk.Frame(rotation_frame)
+priority_frame.grid(row=14, column=0, columnspan=2, sticky='w', padx=5, pady=(5, 0))
+tk.Label(priority_frame, text="Order:").pack(side=tk.LEFT)
+rotation_priority_var = tk.StringVar(value=PRIORITY_GENERATION)
+tk.OptionMenu(priority_frame, rotation_priority_var, PRIORITY_GENERATION, PRIORITY_SMALLEST, PRIORITY_LONGEST, PRIORITY_USER).pack(side=tk.LEFT, padx=5)
+tk.Label(priority_frame, text="Priority pops:").pack(side=tk.LEFT, padx=(10, 0))
+priority_pops_entry = tk.Entry(priority_frame, width=30)
+priority_pops_entry.pack(side=tk.LEFT, padx=5)
+
 # Add this function to save output to text file
 def save_output_to_file():
     content = output_text.get("1.0", tk.END)
@@ -1247,6 +3623,24 @@ def save_output_to_file():
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save file: {str(e)}")
 
+def export_phase_timings():
+    records = load_phase_timings()
+    if not records:
+        messagebox.showerror("No timings", "No phase timings have been recorded yet.")
+        return
+
+    file_path = filedialog.asksaveasfilename(
+        defaultextension=".csv",
+        filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")]
+    )
+
+    if file_path:
+        try:
+            write_phase_timings_csv(file_path, records)
+            status_label.config(text=f"{len(records)} phase timings exported to {file_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export timings: {str(e)}")
+
 def clear_output():
     answer = messagebox.askyesno("Confirm Clear", "Are you sure you want to clear the output?")
     if answer:
@@ -1266,16 +3660,27 @@ rotation_run_button = tk.Button(
     command=run_rotation, 
     bg="#90EE90"
 )
-rotation_run_button.grid(row=8, column=0, columnspan=3, pady=10, sticky='we')
+rotation_run_button.grid(row=8, column=0, columnspan=2, pady=10, sticky='we')
+
+rotation_estimate_button = tk.Button(scrollable_frame, text="Estimate Rotation (Dry Run)", command=estimate_rotation_dry_run, bg="#D8F5D8")
+rotation_estimate_button.grid(row=8, column=2, pady=10, sticky='we')
 
 # Create a frame for the buttons
 button_frame = tk.Frame(scrollable_frame)
 button_frame.grid(row=11, column=2, sticky='e', padx=10, pady=(0, 10))  # Modified row from 11 to 10
 
+# Stop button: cancels the running analysis and its R processes
+stop_button = tk.Button(button_frame, text="⏹ Stop", command=stop_job, bg="#F4A6A6", width=10, height=1)
+stop_button.pack(side=tk.LEFT, padx=5)
+
 # Clear button
 clear_button = tk.Button(button_frame, text="Clear", command=clear_output, bg="lightgray", width=10, height=1)
 clear_button.pack(side=tk.LEFT, padx=5)
 
+# Exports the phase timings of past runs as CSV
+timings_button = tk.Button(button_frame, text="⏱ Timings", command=export_phase_timings, bg="lightgray", width=10, height=1)
+timings_button.pack(side=tk.LEFT, padx=5)
+
 
 #Button
 save_output_button = tk.Button(button_frame, text="💾 Save", command=save_output_to_file, bg="lightgray", width=10, height=1)
@@ -1306,4 +3711,7 @@ vertical_label.grid(row=0, column=3, rowspan=999, sticky='ns', padx=(60, 5), pad
 # Call this function after creating the output_text widget
 setup_output_search()
 
+# Apply output/status events posted by running analyses
+root.after(50, process_ui_events)
+
 root.mainloop()
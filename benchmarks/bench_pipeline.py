@@ -0,0 +1,243 @@
+"""Pipeline benchmarks against a fake Rscript.
+
+Runs the rotation, qpAdm, FST and FST matrix jobs of the GUI scripts against
+fake_rscript.py and reports model throughput, output parse time and UI
+update time, so the Python overhead of a release can be compared with
+another without R, admixtools or real data:
+
+    python benchmarks/bench_pipeline.py --models 500 --parallel 4
+    python benchmarks/bench_pipeline.py --label v4.1 --output bench.jsonl
+
+UI update time needs a display; without one only the UI event volume is
+reported.
+"""
+import argparse
+import json
+import os
+import platform
+import queue
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SCRIPT_PREFIX = '' if platform.system() == "Windows" else 'l_'
+
+def load_script(path):
+    # The GUI scripts build their window when run, so only the part before
+    # the window setup is executed
+    with open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    source = source[:source.index("# --- MAIN WINDOW SETUP")]
+    namespace = {'__name__': 'bench_' + os.path.basename(path), '__file__': path}
+    exec(compile(source, path, 'exec'), namespace)
+    return namespace
+
+def write_rscript_wrapper(work_dir):
+    # Rscript is started directly, so the fake gets a wrapper that runs it
+    # with this interpreter
+    fake = os.path.join(BENCH_DIR, 'fake_rscript.py')
+    if os.name == 'nt':
+        path = os.path.join(work_dir, 'Rscript.cmd')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'@"{sys.executable}" "{fake}" %*\n')
+    else:
+        path = os.path.join(work_dir, 'Rscript')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{fake}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+def time_parser(namespace):
+    # Counts the time spent in QpadmOutputParser.feed
+    timing = {'seconds': 0.0, 'lines': 0}
+    base = namespace['QpadmOutputParser']
+
+    class TimedParser(base):
+        def feed(self, raw_line):
+            started = time.perf_counter()
+            super().feed(raw_line)
+            timing['seconds'] += time.perf_counter() - started
+            timing['lines'] += 1
+
+    namespace['QpadmOutputParser'] = TimedParser
+    return timing
+
+def apply_ui_events(namespace):
+    # Replays the job's UI events through the script's own process_ui_events
+    # into a real Text widget, if there is a display
+    events = []
+    while True:
+        try:
+            events.append(namespace['ui_events'].get_nowait())
+        except queue.Empty:
+            break
+    inserted = sum(len(event[1]) for event in events if event[0] in ('insert', 'replace_last_line'))
+    stats = {'ui_events': len(events), 'ui_chars': inserted, 'ui_seconds': None}
+
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception:
+        return stats
+    root.withdraw()
+    namespace.update(
+        root=root,
+        output_text=tk.Text(root),
+        status_label=tk.Label(root),
+        show_leaderboard=lambda text: None
+    )
+    for event in events:
+        namespace['ui_events'].put(event)
+    started = time.perf_counter()
+    while not namespace['ui_events'].empty():
+        namespace['process_ui_events']()
+    root.update_idletasks()
+    stats['ui_seconds'] = time.perf_counter() - started
+    root.destroy()
+    return stats
+
+def bench_rotation(args, rscript_path, work_dir):
+    namespace = load_script(args.at2)
+    parse_timing = time_parser(namespace)
+    pool = [f"P{i}" for i in range(args.models)]
+    settings = {
+        'rscript_path': rscript_path,
+        'target_pops': 'Target',
+        'fixed_left': 'Left1',
+        'fixed_right': ','.join(f"Right{i}" for i in range(args.right)),
+        'rotation_pool': ','.join(pool),
+        'model_min': 1,
+        'model_max': 1,
+        'prefix': os.path.join(work_dir, 'bench'),
+        'rotation_mode': 'l',
+        'use_f2': False,
+        'f2_dir': '',
+        'engine': args.engine,
+        'parallel': args.parallel,
+        'resume': False,
+        'use_cache': False,
+        'leaderboard_size': 20,
+        'leaderboard_feasible': True,
+        'model_timeout': None,
+        'memory_limit': None,
+        'priority_policy': namespace['PRIORITY_GENERATION'],
+        'priority_pops': []
+    }
+    started = time.perf_counter()
+    namespace['rotation_job'](settings)
+    seconds = time.perf_counter() - started
+    result = {'scenario': 'rotation', 'models': args.models, 'seconds': seconds, 'models_per_second': args.models / seconds,
+              'parse_seconds': parse_timing['seconds'], 'parsed_lines': parse_timing['lines']}
+    result.update(apply_ui_events(namespace))
+    return result
+
+def bench_qpadm(args, rscript_path, work_dir):
+    namespace = load_script(args.at2)
+    parse_timing = time_parser(namespace)
+    left = ','.join(f"Left{i}" for i in range(3))
+    right = ','.join(f"Right{i}" for i in range(args.right))
+    format_pops = namespace['format_pops']
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        namespace['qpadm_job'](rscript_path, os.path.join(work_dir, 'bench'), 'Target', left, right,
+                               format_pops('Target'), format_pops(left), format_pops(right), False)
+    seconds = time.perf_counter() - started
+    result = {'scenario': 'qpadm', 'models': args.runs, 'seconds': seconds, 'models_per_second': args.runs / seconds,
+              'parse_seconds': parse_timing['seconds'], 'parsed_lines': parse_timing['lines']}
+    result.update(apply_ui_events(namespace))
+    return result
+
+def bench_fst(args, rscript_path, work_dir):
+    namespace = load_script(args.fst)
+    pop1 = [f"A{i}" for i in range(5)]
+    pop2 = [f"B{i}" for i in range(5)]
+    format_pops = namespace['format_pops']
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        namespace['fst_job'](rscript_path, os.path.join(work_dir, 'bench'), os.path.join(work_dir, 'f2'), False,
+                             ','.join(pop1), ','.join(pop2), format_pops(','.join(pop1)), format_pops(','.join(pop2)), 1)
+    seconds = time.perf_counter() - started
+    result = {'scenario': 'fst', 'models': args.runs, 'seconds': seconds, 'models_per_second': args.runs / seconds,
+              'parse_seconds': None, 'parsed_lines': None}
+    result.update(apply_ui_events(namespace))
+    return result
+
+def bench_fst_matrix(args, rscript_path, work_dir):
+    # Each run adds five populations, so all but the first compute only
+    # the new pairs; the dataset files exist so the pair cache is used
+    namespace = load_script(args.fst)
+    prefix = os.path.join(work_dir, 'matrix')
+    for ext in ('.geno', '.snp', '.ind'):
+        with open(prefix + ext, 'w', encoding='utf-8') as f:
+            f.write(ext)
+    pops = []
+    started = time.perf_counter()
+    for run in range(args.runs):
+        pops += [f"M{run}_{i}" for i in range(5)]
+        namespace['fst_matrix_job'](rscript_path, prefix, os.path.join(work_dir, 'f2_matrix'), False, list(pops), 1)
+    seconds = time.perf_counter() - started
+    result = {'scenario': 'fst_matrix', 'models': args.runs, 'seconds': seconds, 'models_per_second': args.runs / seconds,
+              'parse_seconds': None, 'parsed_lines': None}
+    result.update(apply_ui_events(namespace))
+    return result
+
+SCENARIOS = {'rotation': bench_rotation, 'qpadm': bench_qpadm, 'fst': bench_fst, 'fst_matrix': bench_fst_matrix}
+
+def format_seconds(seconds):
+    return "-" if seconds is None else f"{seconds:.3f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GUI pipelines against a fake Rscript.")
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--at2', default=os.path.join(REPO_DIR, f'{SCRIPT_PREFIX}AT2+Rotations_v4.py'))
+    parser.add_argument('--fst', default=os.path.join(REPO_DIR, f'{SCRIPT_PREFIX}FSTAnalysis_v4.py'))
+    parser.add_argument('--models', type=int, default=200, help="rotation models")
+    parser.add_argument('--runs', type=int, default=5, help="qpAdm, FST and FST matrix runs")
+    parser.add_argument('--right', type=int, default=6, help="right populations per model")
+    parser.add_argument('--engine', default="Worker pool", help="rotation engine (Worker pool or Single R session)")
+    parser.add_argument('--parallel', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the fake R spends per model")
+    parser.add_argument('--blocks', type=int, default=100, help="progress lines per model")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--tables', action='store_true', help="also print weights/popdrop tables")
+    parser.add_argument('--label', default='', help="release label stored with the results")
+    parser.add_argument('--output', help="append the results as JSON lines to this file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Caches, probes and timings go to a scratch home, not the user's
+        os.environ['HOME'] = os.environ['USERPROFILE'] = work_dir
+        os.environ.update(
+            FAKE_R_LATENCY=str(args.latency),
+            FAKE_R_BLOCKS=str(args.blocks),
+            FAKE_R_ERROR_RATE=str(args.error_rate),
+            FAKE_R_TABLES='1' if args.tables else '0'
+        )
+        rscript_path = write_rscript_wrapper(work_dir)
+
+        results = []
+        print(f"{'scenario':<10} {'models':>7} {'seconds':>9} {'models/s':>9} {'parse s':>9} {'ui events':>10} {'ui chars':>10} {'ui s':>8}")
+        for name in args.scenarios or SCENARIOS:
+            result = SCENARIOS[name](args, rscript_path, work_dir)
+            results.append(result)
+            print(f"{name:<10} {result['models']:>7} {result['seconds']:>9.3f} {result['models_per_second']:>9.1f} "
+                  f"{format_seconds(result['parse_seconds']):>9} {result['ui_events']:>10} {result['ui_chars']:>10} {format_seconds(result['ui_seconds']):>8}")
+
+    if args.output:
+        run = {
+            'label': args.label,
+            'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'options': {key: value for key, value in vars(args).items() if key not in ('output', 'label', 'scenarios')}
+        }
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(dict(run, **result)) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""Check that partitioned f2 extraction matches a serial extraction.
+
+Builds a small synthetic dataset (three autosomes with a chromosome X
+block between them, SNPs missing in every population, monomorphic SNPs
+and a pseudohaploid population) and checks that the chromosome partition
+datasets hold exactly the autosomal SNP rows of the original, in order,
+for packed and text EIGENSTRAT and PLINK files, and that they are reused
+until the dataset changes. With an Rscript that has
+admixtools, it then extracts f2 serially and in partitions with the GUI's
+own extract_f2 arguments and compares block_lengths and every block file:
+
+    python benchmarks/check_f2_partitions.py
+    python benchmarks/check_f2_partitions.py --partitions 3 --rscript /opt/R/bin/Rscript
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from bench_pipeline import REPO_DIR, SCRIPT_PREFIX, load_script
+
+POPS = {'PopA': 8, 'PopB': 8, 'PopC': 8, 'Pseudo': 6}
+CHROMOSOMES = [('1', 300), ('2', 260), ('X', 40), ('3', 220)]
+MORGANS_PER_SNP = 0.002
+
+R_CHECK_CODE = """
+{lib_path_code}
+suppressMessages(library(admixtools))
+
+prefix <- "{prefix}"
+pops <- c({pops})
+adjust_ph <- TRUE
+{partition_code}
+extract_f2(prefix, "{serial_dir}", pops = pops, overwrite = TRUE, maxmiss = 1, adjust_pseudohaploid = adjust_ph, fst = TRUE, verbose = FALSE)
+extract_f2_partitioned(prefix, "{partitioned_dir}", pops = pops, overwrite = TRUE, maxmiss = 1, adjust_pseudohaploid = adjust_ph, fst = TRUE, verbose = FALSE)
+
+serial <- sort(list.files("{serial_dir}", recursive = TRUE))
+partitioned <- sort(list.files("{partitioned_dir}", recursive = TRUE))
+for (file in setdiff(union(serial, partitioned), intersect(serial, partitioned))) cat("MISSING\\t", file, "\\n", sep = "")
+for (file in intersect(serial, partitioned)) {{
+    if (!grepl("\\\\.rds$", file)) next
+    same <- isTRUE(all.equal(readRDS(file.path("{serial_dir}", file)), readRDS(file.path("{partitioned_dir}", file))))
+    cat(if (same) "SAME" else "DIFF", "\\t", file, "\\n", sep = "")
+}}
+"""
+
+def make_genotypes(seed):
+    # One row of genotypes per SNP (None is missing), with the samples in
+    # POPS order; the pseudohaploid population is never heterozygous
+    rng = random.Random(seed)
+    samples = [(pop, f"{pop}_{i}") for pop, size in POPS.items() for i in range(size)]
+    snps = []
+    rows = []
+    for chrom, count in CHROMOSOMES:
+        for i in range(count):
+            snps.append((f"snp_{chrom}_{i}", chrom, i * MORGANS_PER_SNP, 1000 + i * 500))
+            if i % 37 == 5:
+                rows.append([None] * len(samples))  # Missing everywhere
+                continue
+            if i % 41 == 7:
+                rows.append([2] * len(samples))  # Monomorphic
+                continue
+            freq = rng.uniform(0.05, 0.95)
+            row = []
+            for pop, _ in samples:
+                if rng.random() < 0.05:
+                    row.append(None)
+                elif pop == 'Pseudo':
+                    row.append(2 if rng.random() < freq else 0)
+                else:
+                    row.append((rng.random() < freq) + (rng.random() < freq))
+            rows.append(row)
+    return samples, snps, rows
+
+def write_packed_eigenstrat(prefix, samples, snps, rows):
+    record = max(48, (len(samples) + 3) // 4)
+    with open(prefix + '.geno', 'wb') as f:
+        f.write(f"GENO {len(samples):7d} {len(snps):7d} {0x1234:x} {0x5678:x}".encode('ascii').ljust(record, b'\0'))
+        for row in rows:
+            packed = bytearray(record)
+            for i, genotype in enumerate(row):
+                packed[i // 4] |= (3 if genotype is None else genotype) << (6 - 2 * (i % 4))
+            f.write(packed)
+    write_eigenstrat_text_files(prefix, samples, snps)
+
+def write_text_eigenstrat(prefix, samples, snps, rows):
+    with open(prefix + '.geno', 'w', encoding='ascii', newline='\n') as f:
+        for row in rows:
+            f.write(''.join('9' if genotype is None else str(genotype) for genotype in row) + '\n')
+    write_eigenstrat_text_files(prefix, samples, snps)
+
+def write_eigenstrat_text_files(prefix, samples, snps):
+    with open(prefix + '.snp', 'w', encoding='ascii', newline='\n') as f:
+        for snp_id, chrom, morgans, position in snps:
+            f.write(f"{snp_id:>16} {chrom:>3} {morgans:.6f} {position:>10} A G\n")
+    with open(prefix + '.ind', 'w', encoding='ascii', newline='\n') as f:
+        for pop, sample in samples:
+            f.write(f"{sample:>12} U {pop}\n")
+
+def write_plink(prefix, samples, snps, rows):
+    codes = {None: 0b01, 0: 0b00, 1: 0b10, 2: 0b11}
+    record = (len(samples) + 3) // 4
+    with open(prefix + '.bed', 'wb') as f:
+        f.write(b"\x6c\x1b\x01")
+        for row in rows:
+            packed = bytearray(record)
+            for i, genotype in enumerate(row):
+                packed[i // 4] |= codes[genotype] << (2 * (i % 4))
+            f.write(packed)
+    with open(prefix + '.bim', 'w', encoding='ascii', newline='\n') as f:
+        for snp_id, chrom, morgans, position in snps:
+            f.write(f"{chrom}\t{snp_id}\t{morgans * 100:.4f}\t{position}\tA\tG\n")
+    with open(prefix + '.fam', 'w', encoding='ascii', newline='\n') as f:
+        for pop, sample in samples:
+            f.write(f"{pop} {sample} 0 0 0 -9\n")
+
+FORMATS = {'packed': write_packed_eigenstrat, 'text': write_text_eigenstrat, 'plink': write_plink}
+
+def check_partition_datasets(namespace, prefix, partitions):
+    # The partitions together hold the autosomal rows of the original, in
+    # file order, and the sample file unchanged; they are written once and
+    # written again when the dataset changes
+    layout = namespace['dataset_layout'](prefix)
+    if layout is None:
+        return "dataset layout not recognised"
+    prefixes = namespace['prepare_f2_partitions'](prefix, partitions)
+    if not prefixes:
+        return "dataset was not partitioned"
+    problem = compare_partitions(prefix, layout, prefixes, namespace['F2_AUTOSOMES'])
+    if problem:
+        return problem
+
+    geno_ext, _, sample_ext = layout[0]
+    written = os.stat(prefixes[0] + geno_ext).st_mtime_ns
+    if namespace['prepare_f2_partitions'](prefix, partitions) != prefixes or os.stat(prefixes[0] + geno_ext).st_mtime_ns != written:
+        return "partitions were not reused"
+    os.utime(prefix + sample_ext, ns=(0, 0))  # A new file signature
+    if namespace['prepare_f2_partitions'](prefix, partitions) != prefixes or os.stat(prefixes[0] + geno_ext).st_mtime_ns == written:
+        return "partitions were not written again after the dataset changed"
+    return None
+
+def compare_partitions(prefix, layout, prefixes, autosomes):
+    (geno_ext, snp_ext, sample_ext), header, record = layout
+    with open(prefix + snp_ext, 'r', encoding='ascii') as f:
+        snp_lines = [line for line in f if line.strip()]
+    chrom_column = 1 if snp_ext == '.snp' else 0
+    autosomal = [i for i, line in enumerate(snp_lines) if line.split()[chrom_column] in autosomes]
+    with open(prefix + geno_ext, 'rb') as f:
+        genotypes = f.read()
+    with open(prefix + sample_ext, 'rb') as f:
+        sample_file = f.read()
+
+    part_records = []
+    part_snps = []
+    for part_prefix in prefixes:
+        with open(part_prefix + geno_ext, 'rb') as f:
+            part_genotypes = f.read()
+        with open(part_prefix + snp_ext, 'r', encoding='ascii') as f:
+            lines = [line for line in f if line.strip()]
+        with open(part_prefix + sample_ext, 'rb') as f:
+            if f.read() != sample_file:
+                return f"{part_prefix + sample_ext} differs from the original"
+        if len(part_genotypes) != header + len(lines) * record:
+            return f"{part_prefix + geno_ext} does not match its SNP file"
+        if geno_ext == '.geno' and header:
+            fields = part_genotypes[:header].split(b'\0', 1)[0].split()
+            if int(fields[2]) != len(lines):
+                return f"{part_prefix + geno_ext} header has the wrong SNP count"
+        part_snps += lines
+        part_records += [part_genotypes[header + i * record:header + (i + 1) * record] for i in range(len(lines))]
+    if part_snps != [snp_lines[i] for i in autosomal]:
+        return "partition SNP rows differ from the autosomal rows"
+    if part_records != [genotypes[header + i * record:header + (i + 1) * record] for i in autosomal]:
+        return "partition genotype records differ from the autosomal records"
+    return None
+
+def check_against_serial(namespace, rscript, prefix, partitions, work_dir):
+    # Returns (files compared, problems), or None without admixtools
+    package_path = namespace['r_package_path'](rscript, "admixtools")
+    if package_path is None:
+        return None
+    prefixes = namespace['prepare_f2_partitions'](prefix, partitions)
+    r_path = namespace['r_path']
+    r_code = R_CHECK_CODE.format(
+        lib_path_code=f'.libPaths("{r_path(package_path)}")',
+        prefix=r_path(prefix),
+        pops=','.join(f'"{pop}"' for pop in POPS),
+        partition_code=namespace['f2_partition_code'](prefixes),
+        serial_dir=r_path(os.path.join(work_dir, 'serial')),
+        partitioned_dir=r_path(os.path.join(work_dir, 'partitioned'))
+    )
+    script_path = os.path.join(work_dir, 'check.R')
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write(r_code)
+    result = subprocess.run([rscript, script_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    compared = 0
+    problems = []
+    for line in result.stdout.splitlines():
+        status, _, file = line.partition('\t')
+        if status == 'SAME':
+            compared += 1
+        elif status in ('DIFF', 'MISSING'):
+            problems.append(f"{status.lower()}: {file}")
+    if result.returncode != 0:
+        problems.append(f"Rscript exited with code {result.returncode}:\n{result.stdout}")
+    elif not any(file.startswith('block_lengths') for file in os.listdir(os.path.join(work_dir, 'serial'))):
+        problems.append("serial extraction wrote no block_lengths files")
+    return compared, problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare partitioned and serial f2 extraction on a synthetic dataset.")
+    parser.add_argument('--script', default=os.path.join(REPO_DIR, f'{SCRIPT_PREFIX}FSTAnalysis_v4.py'),
+                        help="GUI script whose partitioning code is checked")
+    parser.add_argument('--partitions', type=int, default=2)
+    parser.add_argument('--rscript', default='Rscript')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    namespace = load_script(args.script)
+    samples, snps, rows = make_genotypes(args.seed)
+    failed = False
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, write in FORMATS.items():
+            format_dir = os.path.join(work_dir, name)
+            os.makedirs(format_dir)
+            prefix = os.path.join(format_dir, 'fixture')
+            write(prefix, samples, snps, rows)
+            problem = check_partition_datasets(namespace, prefix, args.partitions)
+            failed |= problem is not None
+            print(f"partition datasets ({name}): {problem or 'ok'}")
+
+        rscript = namespace['find_rscript'](args.rscript) if 'find_rscript' in namespace else shutil.which(args.rscript)
+        if not rscript:
+            print("serial comparison: skipped, Rscript not found")
+        else:
+            prefix = os.path.join(work_dir, 'packed', 'fixture')
+            outcome = check_against_serial(namespace, rscript, prefix, args.partitions, os.path.join(work_dir, 'packed'))
+            if outcome is None:
+                print("serial comparison: skipped, admixtools not installed")
+            else:
+                compared, problems = outcome
+                failed |= bool(problems)
+                print(f"serial comparison: {compared} block files identical")
+                for problem in problems:
+                    print(f"  {problem}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Stand-in for Rscript that answers the R scripts the GUI generates with
+# admixtools-like output, so the Python side of a run can be measured
+# without R, admixtools or genotype data. It is driven by environment
+# variables set by bench_pipeline.py:
+#   FAKE_R_LATENCY     seconds each model (or FST run) takes
+#   FAKE_R_BLOCKS      block progress lines printed per model
+#   FAKE_R_ERROR_RATE  fraction of models that fail with an R error
+#   FAKE_R_TABLES      1 to also print the weights/popdrop tables
+import sys
+import os
+import re
+import json
+import time
+import zlib
+
+LATENCY = float(os.environ.get('FAKE_R_LATENCY', '0'))
+BLOCKS = int(os.environ.get('FAKE_R_BLOCKS', '100'))
+ERROR_RATE = float(os.environ.get('FAKE_R_ERROR_RATE', '0'))
+TABLES = os.environ.get('FAKE_R_TABLES') == '1'
+SNPS = 1150639
+
+def r_vector(source, name):
+    # Reads name = c("A", "B") or name <- c("A", "B") from the script
+    match = re.search(rf'^{name}\s*(?:=|<-)\s*c\(([^)]*)\)', source, re.MULTILINE)
+    return re.findall(r'"([^"]*)"', match.group(1)) if match else []
+
+def print_phase(source, phase):
+    # Echoes the PHASE markers the generated script prints
+    if f'PHASE\\t{phase}' in source:
+        print(f"PHASE\t{phase}")
+
+def fails(model):
+    # The same models fail on every run
+    return zlib.crc32(model.encode('utf-8')) % 10000 < ERROR_RATE * 10000
+
+def print_progress(target, left, right):
+    pops = len(target) + len(left) + len(right)
+    print(f"ℹ Computing block lengths for {SNPS} SNPs...")
+    print(f"ℹ Computing f2 for {pops} populations...")
+    for block in range(1, BLOCKS + 1):
+        print(f"ℹ Computing f4 block {block} out of {BLOCKS}...")
+    time.sleep(LATENCY)
+
+def qpadm_record(target, left, right):
+    weight = 1 / max(1, len(left))
+    weights = [{'target': target[0], 'left': pop, 'weight': weight, 'se': 0.0123, 'z': weight / 0.0123} for pop in left]
+    rankdrop = [{'f4rank': len(left) - 1 - i, 'dof': len(right) - len(left) + i, 'chisq': 3.21, 'p': 0.36} for i in range(len(left))]
+    popdrop = []
+    for i in range(2 ** len(left) - 1):
+        pattern = format(i, f'0{len(left)}b')
+        row = {'pat': pattern, 'wt': pattern.count('1'), 'dof': len(right) - len(left), 'chisq': 3.21, 'p': 0.36 if i == 0 else 0.01,
+               'f4rank': len(left) - 1, 'feasible': True}
+        for pop in left:
+            row[pop] = weight
+        popdrop.append(row)
+    return {'weights': weights, 'rankdrop': rankdrop, 'popdrop': popdrop}
+
+def print_tables(record):
+    print(f"# A tibble: {len(record['weights'])} × 5")
+    print("  target left  weight     se     z")
+    for i, row in enumerate(record['weights'], 1):
+        print(f"{i} {row['target']} {row['left']} {row['weight']:.3f} {row['se']:.4f} {row['z']:.2f}")
+    print(f"# A tibble: {len(record['popdrop'])} × {7 + len(record['weights'])}")
+    for i, row in enumerate(record['popdrop'], 1):
+        print(f"{i} {row['pat']} {row['wt']} {row['dof']} {row['chisq']} {row['p']} {row['f4rank']} {row['feasible']}")
+
+def run_qpadm(target, left, right):
+    # Returns False when the model fails the way admixtools reports errors
+    print_progress(target, left, right)
+    if fails(','.join(target + left + right)):
+        print("ERROR: Error in qr.solve(...): singular matrix 'a' in solve")
+        return False
+    record = qpadm_record(target, left, right)
+    if TABLES:
+        print_tables(record)
+    print("RESULT_JSON\t" + json.dumps(record))
+    return True
+
+def run_worker(source):
+    requests = re.search(r'con <- file\("([^"]+)"\)', source).group(1)
+    batch_match = re.search(r'readLines\(con, n = (\d+)\)', source)
+    batch_size = int(batch_match.group(1)) if batch_match and 'qpadm_multi' in source else 1
+    con = sys.stdin if requests == 'stdin' else open(requests, 'r', encoding='utf-8')
+    print("WORKER_READY", flush=True)
+    batch = []
+    for line in con:
+        batch.append(line.rstrip('\n'))
+        if len(batch) < batch_size:
+            continue
+        run_batch(batch, batch_size > 1)
+        batch = []
+    if batch:
+        run_batch(batch, batch_size > 1)
+
+def run_batch(lines, multi):
+    # One failing model fails a qpadm_multi batch, which is then rerun
+    # model by model
+    models = [[field.split(',') if field else [] for field in line.split('\t')[1:4]] for line in lines]
+    if multi and any(fails(','.join(sum(pops, []))) for pops in models):
+        print("MODEL_RETRY", flush=True)
+    for line, pops in zip(lines, models):
+        print("MODEL_BEGIN\t" + line)
+        run_qpadm(*pops)
+        print("MODEL_DONE\t" + line.split('\t')[0], flush=True)
+
+def run_fst(source):
+    pop1 = r_vector(source, 'pop1') or r_vector(source, 'cover_pops')
+    pop2 = r_vector(source, 'pop2') or r_vector(source, 'f2_pops')
+    print_phase(source, 'libraries')
+    print("ℹ Reading allele frequencies from packedancestrymap files...")
+    print(f"ℹ {len(set(pop1 + pop2))} populations found")
+    # admixtools rewrites the SNP counter in place with a bare \r
+    for block in range(1, BLOCKS + 1):
+        print(f"\rℹ {block * SNPS // BLOCKS} SNPs read...", end='', flush=True)
+    print()
+    if 'F2_READY' in source:
+        print("F2_READY\tincremental" if 'pops2 = f2_pops' in source else "F2_READY\tfull")
+    print_phase(source, 'data')
+    time.sleep(LATENCY)
+    print_phase(source, 'blocks')
+    if 'FST_PAIR' in source:
+        # Matrix mode: one line per cover_pops x f2_pops pair
+        for a in r_vector(source, 'cover_pops'):
+            for b in r_vector(source, 'f2_pops'):
+                print(f"FST_PAIR\t{a}\t{b}\t0.{zlib.crc32(''.join(sorted((a, b))).encode('utf-8')) % 1000:03d}\t0.000456")
+        return
+    print(f"# A tibble: {len(pop1) * len(pop2)} × 4")
+    print("  pop1  pop2    est      se")
+    for i, (a, b) in enumerate(((a, b) for a in pop1 for b in pop2), 1):
+        print(f"{i} {a} {b} 0.{zlib.crc32((a + b).encode('utf-8')) % 1000:03d}  0.000456")
+
+def main():
+    if sys.argv[1] == '-e':
+        # The installation probe
+        lib_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_library')
+        print(f"LIB\t{lib_dir}")
+        print(f"PKG\tadmixtools\t2.0.0\t{lib_dir}")
+        return 0
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        source = f.read()
+    if "WORKER_READY" in source:
+        run_worker(source)
+    elif re.search(r'\bfst\(', source):
+        run_fst(source)
+    elif re.search(r'\bqpadm\(', source):
+        print_phase(source, 'libraries')
+        if not run_qpadm(r_vector(source, 'target'), r_vector(source, 'left'), r_vector(source, 'right')):
+            return 1
+    else:
+        print("Error: the fake Rscript does not know this script", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main())
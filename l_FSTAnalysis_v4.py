@@ -3,8 +3,22 @@ from tkinter import filedialog, messagebox, scrolledtext
 import subprocess
 import tempfile
 import os
+import queue
+import asyncio
+import codecs
+import io
+import signal
+import concurrent.futures
+import threading
+import hashlib
+import json
+import csv
+import sqlite3
+import struct
 import re
+import time
 from datetime import datetime
+from itertools import combinations
 import platform
 import shutil
 
@@ -23,35 +37,1083 @@ def format_pops(input_str):
     pops = [p.strip() for p in re.split(r'[,\s]+', clean_input) if p.strip()]
     return ','.join(f'"{p}"' for p in pops)
 
+def r_path(path):
+    # Paths go into R string literals, where a backslash starts an escape
+    return path.replace('\\', '/').replace('"', '\\"')
+
+
+# --- R INSTALLATION PROBE ---
+# What an Rscript binary offers (library paths, admixtools/tidyverse
+# versions and locations) is probed once and kept in r_probe.json, keyed by
+# the binary's path and valid while its mtime is unchanged.
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".admixtools2_gui")
+R_PROBE_CACHE_PATH = os.path.join(APP_DATA_DIR, "r_probe.json")
+R_PROBE_CODE = (
+    'for (p in .libPaths()) cat("LIB\\t", p, "\\n", sep = ""); '
+    'for (pkg in c("admixtools", "tidyverse")) { loc <- find.package(pkg, quiet = TRUE); '
+    'if (length(loc)) cat("PKG\\t", pkg, "\\t", as.character(packageVersion(pkg, lib.loc = dirname(loc))), "\\t", dirname(loc), "\\n", sep = "") }'
+)
+r_probe_lock = threading.Lock()
+
+def load_r_probes():
+    try:
+        with open(R_PROBE_CACHE_PATH, 'r', encoding='utf-8') as f:
+            probes = json.load(f)
+        return {'rscripts': probes.get('rscripts', {}), 'installs': probes.get('installs', {})}
+    except (OSError, ValueError, AttributeError):
+        return {'rscripts': {}, 'installs': {}}
 
-def get_r_library_paths(rscript_path='Rscript'):
+def save_r_probes(probes):
+    try:
+        os.makedirs(APP_DATA_DIR, exist_ok=True)
+        with open(R_PROBE_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(probes, f, indent=1)
+    except OSError:
+        pass  # Probing again next time is the only cost
+
+def resolve_rscript(rscript_path, probes):
+    # Bare names are looked up on PATH once and remembered
+    if os.path.dirname(rscript_path):
+        return rscript_path
+    known = probes['rscripts'].get(rscript_path)
+    if known and os.path.isfile(known):
+        return known
+    found = shutil.which(rscript_path)
+    if found:
+        probes['rscripts'][rscript_path] = found
+    return found or rscript_path
+
+def find_rscript(rscript_path='Rscript'):
+    # Installed Rscript for a name or path, through the cached PATH lookup
+    with r_probe_lock:
+        probes = load_r_probes()
+        unchanged = json.dumps(probes)
+        resolved = resolve_rscript(rscript_path, probes)
+        if json.dumps(probes) != unchanged:
+            save_r_probes(probes)
+    return resolved if os.path.isfile(resolved) else None
+
+def run_r_probe(rscript_path):
     try:
         result = subprocess.run(
-            [rscript_path, '-e', 'cat(.libPaths())'],
+            [rscript_path, '-e', R_PROBE_CODE],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
         )
-        paths_raw = result.stdout.strip()
-        paths = re.findall(r'\/[^\s"]+', paths_raw)
-        return paths
     except Exception:
-        return []
+        return None
+    if result.returncode != 0:
+        return None
+    probe = {'lib_paths': [], 'packages': {}}
+    for line in result.stdout.splitlines():
+        fields = line.split('\t')
+        if fields[0] == 'LIB' and len(fields) == 2:
+            probe['lib_paths'].append(fields[1])
+        elif fields[0] == 'PKG' and len(fields) == 4:
+            probe['packages'][fields[1]] = {'version': fields[2], 'path': fields[3]}
+    return probe
+
+def probe_r_installation(rscript_path='Rscript', refresh=False):
+    with r_probe_lock:
+        probes = load_r_probes()
+        unchanged = json.dumps(probes)
+        resolved = resolve_rscript(rscript_path, probes)
+        try:
+            mtime_ns = os.stat(resolved).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        probe = probes['installs'].get(resolved)
+        if refresh or probe is None or probe.get('mtime_ns') != mtime_ns:
+            probe = run_r_probe(resolved)
+            if probe is None:
+                return {'lib_paths': [], 'packages': {}}  # Failed probes are not cached
+            probe['mtime_ns'] = mtime_ns
+            probes['installs'][resolved] = probe
+        if json.dumps(probes) != unchanged:
+            save_r_probes(probes)
+        return probe
+
+def r_package_path(rscript_path, package_name):
+    # Library holding the package; installing or removing packages does not
+    # touch Rscript, so a stale answer triggers one fresh probe
+    for refresh in (False, True):
+        package = probe_r_installation(rscript_path, refresh)['packages'].get(package_name)
+        if package and os.path.isdir(os.path.join(package['path'], package_name)):
+            return package['path']
+    return None
+
+# --- UI EVENT QUEUE ---
+# Analyses run on worker threads and never touch Tk widgets directly. They
+# post events to ui_events, which the main loop drains with root.after.
+ui_events = queue.Queue()
+job_running = threading.Event()
+
+def ui_insert(text):
+    ui_events.put(('insert', text))
+
+def ui_replace_last_line(text):
+    ui_events.put(('replace_last_line', text))
+
+def ui_status(text):
+    ui_events.put(('status', text))
+
+def ui_error(title, message):
+    ui_events.put(('error', title, message))
+
+def ui_phase(timer):
+    # Marks the timer rendered once the output queued before it is shown
+    ui_events.put(('phase', timer))
+
+def process_ui_events():
+    # Consecutive inserts are joined into one Text.insert call
+    pending_text = []
+    status_text = None
+    inserted = False
+    try:
+        # Bounded per tick so a flood of output cannot starve the window
+        for _ in range(1000):
+            event = ui_events.get_nowait()
+            if event[0] == 'insert':
+                pending_text.append(event[1])
+                continue
+            if pending_text:
+                output_text.insert(tk.END, ''.join(pending_text))
+                pending_text = []
+                inserted = True
+            if event[0] == 'replace_last_line':
+                output_text.delete("end-2l", "end-1l")
+                output_text.insert(tk.END, event[1])
+                inserted = True
+            elif event[0] == 'status':
+                status_text = event[1]
+            elif event[0] == 'error':
+                messagebox.showerror(event[1], event[2])
+            elif event[0] == 'phase':
+                event[1].rendered()
+    except queue.Empty:
+        pass
+
+    if pending_text:
+        output_text.insert(tk.END, ''.join(pending_text))
+        inserted = True
+    if inserted:
+        output_text.see(tk.END)
+    if status_text is not None:
+        status_label.config(text=status_text)
+    root.after(50, process_ui_events)
+
+def start_job(job, *args):
+    if job_running.is_set():
+        messagebox.showerror("Busy", "Another analysis is still running.")
+        return
 
-def check_package_in_paths(package_name, paths):
-    for path in paths:
-        if os.path.isdir(os.path.join(path, package_name)):
-            return path
+    def run():
+        try:
+            job(*args)
+        except Exception as e:
+            ui_error("Error", str(e))
+        finally:
+            job_running.clear()
+
+    job_cancelled.clear()
+    job_running.set()
+    threading.Thread(target=run, daemon=True).start()
+
+# --- R PROCESS EXECUTION ---
+# Every Rscript is started by one asyncio loop on a background thread, in
+# its own process group, and its output is streamed to the job thread
+# through a queue. Cancelling signals the whole group (SIGTERM, then
+# SIGKILL after a grace period), so R's children do not outlive a stopped
+# job. RProcess mirrors the parts of Popen the jobs use.
+R_KILL_GRACE_SECONDS = 5
+R_OUTPUT_CHUNK_BYTES = 1 << 16
+r_event_loop = None
+r_event_loop_lock = threading.Lock()
+active_r_processes = set()
+active_r_processes_lock = threading.Lock()
+job_cancelled = threading.Event()
+
+def get_r_event_loop():
+    global r_event_loop
+    with r_event_loop_lock:
+        if r_event_loop is None:
+            r_event_loop = asyncio.new_event_loop()
+            threading.Thread(target=r_event_loop.run_forever, daemon=True).start()
+        return r_event_loop
+
+def signal_process_group(pid, force):
+    try:
+        if os.name == 'nt':
+            # taskkill /T covers R.exe started by Rscript.exe
+            subprocess.run(['taskkill', '/T', '/PID', str(pid)] + (['/F'] if force else []), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(pid, signal.SIGKILL if force else signal.SIGTERM)
+    except (OSError, ProcessLookupError):
+        pass  # The group is already gone
+
+class RProcessOutput:
+    """Line iterator over an RProcess's merged stdout/stderr."""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def readline(self):
+        line = self.lines.get()
+        if line is None:
+            self.lines.put(None)  # Stay at EOF for later readers
+            return ''
+        return line
+
+class RProcessInput:
+    """Text stdin of an RProcess, written through the event loop."""
+
+    def __init__(self, process):
+        self.process = process
+
+    def write(self, text):
+        self.process.call(self.process.write_stdin(text.encode('utf-8')))
+
+    def flush(self):
+        pass  # write() drains
+
+    def close(self):
+        self.process.call(self.process.close_stdin())
+
+class RProcess:
+    """An Rscript child in its own process group, driven by asyncio."""
+
+    def __init__(self, args, stdin=False):
+        self.loop = get_r_event_loop()
+        self.stdout = RProcessOutput()
+        self.stdin = RProcessInput(self) if stdin else None
+        self.process = self.call(self.start(args, stdin))
+        self.pid = self.process.pid
+        self.reader = asyncio.run_coroutine_threadsafe(self.pump(), self.loop)
+        with active_r_processes_lock:
+            active_r_processes.add(self)
+        if job_cancelled.is_set():
+            self.cancel()
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def start(self, args, stdin):
+        if os.name == 'nt':
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {'start_new_session': True}
+        return await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if stdin else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=1 << 24,
+            **group
+        )
+
+    async def pump(self):
+        # Universal newlines, as Popen(text=True) read them: a bare \r ends
+        # a line too, so progress counters R rewrites in place arrive one
+        # update at a time
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(errors='replace'), translate=True)
+        pending = ''
+        try:
+            while True:
+                chunk = await self.process.stdout.read(R_OUTPUT_CHUNK_BYTES)
+                *lines, pending = (pending + decoder.decode(chunk, final=not chunk)).split('\n')
+                for line in lines:
+                    self.stdout.lines.put(line + '\n')
+                if not chunk:
+                    break
+            if pending:
+                self.stdout.lines.put(pending)
+            await self.process.wait()
+        finally:
+            self.stdout.lines.put(None)
+            with active_r_processes_lock:
+                active_r_processes.discard(self)
+
+    async def write_stdin(self, data):
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def close_stdin(self):
+        self.process.stdin.close()
+
+    async def terminate_group(self, grace):
+        if self.process.returncode is None:
+            signal_process_group(self.pid, force=False)
+            try:
+                await asyncio.wait_for(self.process.wait(), grace)
+            except asyncio.TimeoutError:
+                pass
+        # Children can outlive Rscript itself, so the group is always killed
+        signal_process_group(self.pid, force=True)
+        await self.process.wait()
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def poll(self):
+        return self.process.returncode
+
+    def wait(self, timeout=None):
+        try:
+            self.reader.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise subprocess.TimeoutExpired(self.process, timeout)
+        return self.process.returncode
+
+    def cancel(self, grace=R_KILL_GRACE_SECONDS):
+        # Returns at once; the group is signalled on the event loop
+        asyncio.run_coroutine_threadsafe(self.terminate_group(grace), self.loop)
+
+    def kill(self):
+        self.cancel(grace=0)
+
+def stop_job():
+    # Cancels the running analysis: no new R processes are started and every
+    # running one is terminated with its process group
+    if not job_running.is_set():
+        return
+    job_cancelled.set()
+    with active_r_processes_lock:
+        processes = list(active_r_processes)
+    for process in processes:
+        process.cancel()
+    ui_status("Stopping...")
+
+# --- PHASE TIMINGS ---
+# Every qpAdm or FST run and every rotation model is timed phase by phase.
+# Each phase ends at a PHASE marker printed by the generated R code, at an
+# admixtools "Computing ... block N out of M" line, at the result record,
+# or at a point in the Python job. A phase whose end is never seen is
+# counted in the next one. Records are appended to phase_timings.jsonl
+# once the UI has shown the result, and can be exported as CSV.
+PHASE_TIMINGS_PATH = os.path.join(APP_DATA_DIR, "phase_timings.jsonl")
+PHASES = ('spawn', 'libraries', 'data', 'blocks', 'result', 'parse', 'render')
+PHASE_CSV_FIELDS = ('finished', 'job', 'dataset', 'model', 'key', 'failed') + PHASES + ('total',)
+BLOCK_PROGRESS_PATTERN = re.compile(r'Computing .* block (\d+) out of (\d+)')
+phase_timings_lock = threading.Lock()
+
+class PhaseTimer:
+    """End times of the phases of one run, from the job's start."""
+
+    def __init__(self, job, dataset, model=None, key=None):
+        self.job = job
+        self.dataset = dataset
+        self.model = model
+        self.key = key
+        self.failed = False
+        self.started = time.monotonic()
+        self.ends = {}
+
+    def mark(self, phase):
+        self.ends[phase] = time.monotonic()
+
+    def feed(self, line):
+        if line.startswith("PHASE\t"):
+            self.mark(line.split('\t', 1)[1].strip())
+        elif line.startswith("RESULT_JSON\t"):
+            self.mark('result')
+        elif BLOCK_PROGRESS_PATTERN.search(line):
+            # Data reading ends at the first block, block computation at
+            # the last
+            if 'data' not in self.ends:
+                self.mark('data')
+            self.mark('blocks')
+
+    def durations(self):
+        durations = {}
+        previous = self.started
+        for phase in PHASES:
+            end = self.ends.get(phase)
+            if end is None or end < previous:
+                durations[phase] = None
+                continue
+            durations[phase] = round(end - previous, 4)
+            previous = end
+        durations['total'] = round(previous - self.started, 4)
+        return durations
+
+    def rendered(self):
+        # Called on the UI thread once the result is in the output window
+        self.mark('render')
+        record_phase_timings(self)
+
+def record_phase_timings(timer):
+    entry = {
+        'finished': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'job': timer.job,
+        'dataset': timer.dataset,
+        'model': timer.model,
+        'key': timer.key,
+        'failed': timer.failed
+    }
+    entry.update(timer.durations())
+    try:
+        with phase_timings_lock:
+            os.makedirs(APP_DATA_DIR, exist_ok=True)
+            with open(PHASE_TIMINGS_PATH, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+    except OSError:
+        pass  # Timings are diagnostics; never fail a run over them
+
+def load_phase_timings():
+    records = []
+    try:
+        with open(PHASE_TIMINGS_PATH, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # Partially written line
+    except OSError:
+        pass
+    return records
+
+def write_phase_timings_csv(path, records):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PHASE_CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
+
+# --- DATASET FINGERPRINT ---
+# A dataset is identified by the size, mtime and inode of its three files
+# and by FINGERPRINT_SAMPLES blocks read at even offsets through the
+# genotype file. With the full hash option it is identified by the
+# content of its files alone, read in full. Fingerprints are memoized per
+# prefix until a file's size, mtime or inode changes, so a dataset is
+# read once per session, not before every run.
+DATASET_EXTENSIONS = [('.geno', '.snp', '.ind'), ('.bed', '.bim', '.fam')]
+FINGERPRINT_SAMPLES = 16
+FINGERPRINT_BLOCK_BYTES = 1 << 16
+FINGERPRINT_CHUNK_BYTES = 1 << 22
+fingerprint_full_hash = False
+fingerprint_memo = {}
+fingerprint_memo_lock = threading.Lock()
+
+def set_fingerprint_full_hash(enabled):
+    global fingerprint_full_hash
+    fingerprint_full_hash = enabled
+
+def dataset_files(prefix):
+    # Genotype file first; None if the prefix does not point at an
+    # EIGENSTRAT or PLINK dataset
+    for extensions in DATASET_EXTENSIONS:
+        paths = [prefix + ext for ext in extensions]
+        if all(os.path.isfile(path) for path in paths):
+            return paths
     return None
 
+def file_signature(path):
+    stat = os.stat(path)
+    return (os.path.splitext(path)[1], stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+def hash_file_samples(digest, path, size):
+    with open(path, 'rb') as f:
+        if size <= FINGERPRINT_SAMPLES * FINGERPRINT_BLOCK_BYTES:
+            digest.update(f.read())
+            return
+        step = (size - FINGERPRINT_BLOCK_BYTES) // (FINGERPRINT_SAMPLES - 1)
+        for i in range(FINGERPRINT_SAMPLES):
+            f.seek(i * step)
+            digest.update(f.read(FINGERPRINT_BLOCK_BYTES))
+
+def hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FINGERPRINT_CHUNK_BYTES), b''):
+            digest.update(chunk)
+
+def dataset_fingerprint(prefix, full_hash=None):
+    if full_hash is None:
+        full_hash = fingerprint_full_hash
+    paths = dataset_files(prefix)
+    if paths is None:
+        return None
+
+    signature = tuple(file_signature(path) for path in paths)
+    key = (os.path.abspath(prefix), full_hash)
+    with fingerprint_memo_lock:
+        memo = fingerprint_memo.get(key)
+    if memo and memo[0] == signature:
+        return memo[1]
+
+    if full_hash:
+        digest = hashlib.sha1(b"full")
+        for path in paths:
+            digest.update(os.path.splitext(path)[1].encode('utf-8'))
+            hash_file(digest, path)
+    else:
+        digest = hashlib.sha1(b"sampled")
+        for entry in signature:
+            digest.update(':'.join(map(str, entry)).encode('utf-8'))
+        hash_file_samples(digest, paths[0], signature[0][1])
+    fingerprint = digest.hexdigest()
+
+    # A file written to while it was read is read again next time
+    if tuple(file_signature(path) for path in paths) == signature:
+        with fingerprint_memo_lock:
+            fingerprint_memo[key] = (signature, fingerprint)
+    return fingerprint
+
+def fingerprint_mode(full_hash):
+    return 'full' if full_hash else 'sampled'
+
+def add_fingerprint_mode_column(db, table):
+    # Caches written before fingerprints had modes hold sampled fingerprints
+    columns = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    if 'mode' not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN mode TEXT NOT NULL DEFAULT 'sampled'")
+
+def purge_stale_fingerprints(db, table, dataset, fingerprint, mode):
+    # Rows computed on an older version of the dataset files are stale. A
+    # full and a sampled fingerprint of the same files never match, so only
+    # rows taken in the same mode are compared, and nothing is dropped when
+    # the dataset could not be fingerprinted at all.
+    if fingerprint is not None:
+        db.execute(f"DELETE FROM {table} WHERE dataset = ? AND mode = ? AND fingerprint != ?", (dataset, mode, fingerprint))
+    db.commit()
+
+# --- PARTITIONED F2 EXTRACTION ---
+# extract_f2 reads the whole genome in one R process. With more than one
+# partition the autosomes are split into runs of whole, consecutive
+# chromosomes of about equal SNP count. Each run is written out as a
+# dataset of its own (the SNP rows of those chromosomes, all samples) and
+# extracted with the same extract_f2 arguments in its own R process of a
+# PSOCK cluster. Every SNP filter of extract_f2 looks at one SNP at a time
+# and jackknife blocks never span chromosomes, so concatenating the
+# per-partition block files in chromosome order gives the blocks of a
+# serial extraction. Datasets that cannot be split row by row (transposed
+# genotypes, unexpected file sizes) are extracted serially.
+# The partition datasets are written once, to <prefix>_f2_partitions/<count>
+# next to the dataset, and reused by later extractions until the dataset
+# fingerprint changes. Writing them can be stopped with the job.
+F2_AUTOSOMES = {str(chrom) for chrom in range(1, 23)}
+PACKED_GENO_MAGIC = b"GENO"
+PLINK_BED_MAGIC = b"\x6c\x1b\x01"
+PARTITION_COPY_BYTES = 1 << 22
+PARTITION_MANIFEST_NAME = "partitions.json"
+
+R_F2_PARTITION_CODE = """
+f2_partition_prefixes <- c({prefixes})
+
+load_admixtools <- function(lib_paths) {{
+    .libPaths(lib_paths)
+    suppressMessages(library(admixtools))
+    NULL
+}}
+
+extract_f2_partition <- function(outdir, part_prefix, args) {{
+    do.call(extract_f2, c(list(part_prefix, outdir), args))
+    NULL
+}}
+
+bind_blocks <- function(parts) {{
+    # Blocks are the last dimension of every block file
+    d <- dim(parts[[1]])
+    if (is.null(d)) return(do.call(c, parts))
+    n <- length(d)
+    merged <- array(unlist(lapply(parts, as.vector)), dim = c(d[-n], sum(sapply(parts, function(p) dim(p)[n]))))
+    if (!is.null(dimnames(parts[[1]]))) {{
+        dimnames(merged) <- c(dimnames(parts[[1]])[-n], list(unlist(lapply(parts, function(p) dimnames(p)[[n]]))))
+    }}
+    merged
+}}
+
+merge_f2_partitions <- function(part_dirs, outdir) {{
+    for (file in list.files(part_dirs[1], recursive = TRUE)) {{
+        target <- file.path(outdir, file)
+        dir.create(dirname(target), recursive = TRUE, showWarnings = FALSE)
+        if (grepl("\\\\.rds$", file)) {{
+            saveRDS(bind_blocks(lapply(file.path(part_dirs, file), readRDS)), target)
+        }} else {{
+            file.copy(file.path(part_dirs[1], file), target, overwrite = TRUE)
+        }}
+    }}
+}}
+
+extract_f2_partitioned <- function(pref, outdir, ...) {{
+    # pref has been split into f2_partition_prefixes; every partition gets
+    # the arguments of the serial call
+    part_dirs <- file.path(outdir, paste0(".partition_", seq_along(f2_partition_prefixes)))
+    cat("Extracting f2 in", length(part_dirs), "chromosome partitions\\n")
+    cl <- parallel::makeCluster(length(part_dirs))
+    on.exit(parallel::stopCluster(cl))
+    parallel::clusterCall(cl, load_admixtools, .libPaths())
+    parallel::clusterMap(cl, extract_f2_partition, part_dirs, f2_partition_prefixes,
+                         MoreArgs = list(args = list(...)))
+    merge_f2_partitions(part_dirs, outdir)
+    unlink(part_dirs, recursive = TRUE)
+}}
+"""
+
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+def dataset_layout(prefix):
+    # (genotype, SNP and sample extensions, header bytes, bytes per SNP)
+    # of a dataset stored one SNP per record; None if it is not
+    if all(os.path.isfile(prefix + ext) for ext in ('.geno', '.snp', '.ind')):
+        extensions = ('.geno', '.snp', '.ind')
+        samples = count_lines(prefix + '.ind')
+        with open(prefix + '.geno', 'rb') as f:
+            magic = f.read(len(PACKED_GENO_MAGIC))
+        if magic == PACKED_GENO_MAGIC:
+            record = max(48, (samples + 3) // 4)
+            header = record
+        else:
+            # Text EIGENSTRAT; TGENO and CRLF files do not match the size check
+            record = samples + 1
+            header = 0
+    elif all(os.path.isfile(prefix + ext) for ext in ('.bed', '.bim', '.fam')):
+        extensions = ('.bed', '.bim', '.fam')
+        with open(prefix + '.bed', 'rb') as f:
+            if f.read(len(PLINK_BED_MAGIC)) != PLINK_BED_MAGIC:
+                return None
+        record = (count_lines(prefix + '.fam') + 3) // 4
+        header = len(PLINK_BED_MAGIC)
+    else:
+        return None
+    snps = count_lines(prefix + extensions[1])
+    if os.path.getsize(prefix + extensions[0]) != header + snps * record:
+        return None
+    return extensions, header, record
+
+def chromosome_partitions(prefix, count):
+    # SNP row ranges of up to count runs of consecutive autosomes, balanced
+    # by SNP count; None if the dataset has fewer than two autosomes
+    if os.path.isfile(prefix + ".snp"):
+        path, chrom_column = prefix + ".snp", 1
+    elif os.path.isfile(prefix + ".bim"):
+        path, chrom_column = prefix + ".bim", 0
+    else:
+        return None
+
+    chromosomes = {}
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        row = 0
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            chrom = fields[chrom_column] if len(fields) > chrom_column else ''
+            if chrom.lower().startswith('chr'):
+                chrom = chrom[3:]
+            if chrom in F2_AUTOSOMES:
+                ranges = chromosomes.setdefault(chrom, [])
+                if ranges and ranges[-1][1] == row:
+                    ranges[-1][1] = row + 1
+                else:
+                    ranges.append([row, row + 1])
+            row += 1
+
+    count = min(count, len(chromosomes))
+    if count < 2:
+        return None
+    sizes = {chrom: sum(stop - start for start, stop in ranges) for chrom, ranges in chromosomes.items()}
+    total = sum(sizes.values())
+    partitions = [[]]
+    assigned = 0
+    for chrom, ranges in chromosomes.items():
+        # A chromosome goes to the next partition if most of it is past
+        # this partition's share
+        if partitions[-1] and assigned + sizes[chrom] / 2 > total * len(partitions) / count:
+            partitions.append([])
+        partitions[-1].extend(ranges)
+        assigned += sizes[chrom]
+    return [sorted(ranges) for ranges in partitions]
+
+def write_partition_dataset(prefix, layout, ranges, part_prefix, progress):
+    # False if the job was stopped before the genotypes were copied
+    (geno_ext, snp_ext, sample_ext), header, record = layout
+    rows = sum(stop - start for start, stop in ranges)
+    with open(prefix + geno_ext, 'rb') as source, open(part_prefix + geno_ext, 'wb') as target:
+        head = source.read(header)
+        if geno_ext == '.geno' and header:
+            # The packed header carries the SNP count
+            fields = head.split(b'\0', 1)[0].split()
+            fields[2] = str(rows).encode('ascii')
+            head = b' '.join(fields).ljust(header, b'\0')
+        target.write(head)
+        for start, stop in ranges:
+            source.seek(header + start * record)
+            left = (stop - start) * record
+            while left:
+                if job_cancelled.is_set():
+                    return False
+                chunk = source.read(min(left, PARTITION_COPY_BYTES))
+                if not chunk:
+                    raise OSError(f"{prefix + geno_ext} ended early")
+                target.write(chunk)
+                left -= len(chunk)
+                progress(len(chunk))
+
+    keep = bytearray(ranges[-1][1])
+    for start, stop in ranges:
+        keep[start:stop] = b'\1' * (stop - start)
+    with open(prefix + snp_ext, 'rb') as source, open(part_prefix + snp_ext, 'wb') as target:
+        row = 0
+        for line in source:
+            if not line.strip():
+                continue
+            if row < len(keep) and keep[row]:
+                target.write(line)
+            row += 1
+    shutil.copyfile(prefix + sample_ext, part_prefix + sample_ext)
+    return True
+
+def f2_partitions_dir(prefix, count):
+    return os.path.join(f"{prefix}_f2_partitions", str(count))
+
+def cached_f2_partitions(part_dir, prefix):
+    # Prefixes of a finished partition set written from the current
+    # dataset files; the fingerprint is compared in the mode it was taken in
+    try:
+        with open(os.path.join(part_dir, PARTITION_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        fingerprint = dataset_fingerprint(prefix, manifest['mode'] == 'full')
+        if fingerprint is None or fingerprint != manifest['fingerprint']:
+            return None
+        prefixes = [os.path.join(part_dir, name) for name in manifest['partitions']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return prefixes
+
+def remove_stale_f2_partitions(prefix):
+    # Partition sets of older versions of the dataset files, for any count
+    root = f"{prefix}_f2_partitions"
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        part_dir = os.path.join(root, name)
+        if cached_f2_partitions(part_dir, prefix) is None:
+            shutil.rmtree(part_dir, ignore_errors=True)
+
+def prepare_f2_partitions(prefix, count):
+    # Prefixes of the partition datasets; empty for a serial extraction.
+    # A stopped job also gets none, and its R process is cancelled as it
+    # starts.
+    if count < 2:
+        return []
+    part_dir = f2_partitions_dir(prefix, count)
+    prefixes = cached_f2_partitions(part_dir, prefix)
+    if prefixes is not None:
+        return prefixes
+    partitions = chromosome_partitions(prefix, count)
+    layout = dataset_layout(prefix) if partitions else None
+    if layout is None:
+        return []
+
+    full_hash = fingerprint_full_hash
+    fingerprint = dataset_fingerprint(prefix, full_hash)
+    remove_stale_f2_partitions(prefix)
+    prefixes = [os.path.join(part_dir, f"partition_{i + 1}") for i in range(len(partitions))]
+    total = max(1, sum(stop - start for ranges in partitions for start, stop in ranges) * layout[2])
+    copied = 0
+    shown = None
+
+    def progress(size):
+        nonlocal copied, shown
+        copied += size
+        percent = copied * 100 // total
+        if percent != shown:
+            shown = percent
+            ui_status(f"Writing {len(partitions)} chromosome partitions: {percent}%")
+
+    try:
+        os.makedirs(part_dir, exist_ok=True)
+        for ranges, part_prefix in zip(partitions, prefixes):
+            if not write_partition_dataset(prefix, layout, ranges, part_prefix, progress):
+                shutil.rmtree(part_dir, ignore_errors=True)
+                return []
+        # Files that changed while they were copied give mismatched partitions
+        if fingerprint is None or dataset_fingerprint(prefix, full_hash) != fingerprint:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            return []
+        manifest = {'mode': fingerprint_mode(full_hash), 'fingerprint': fingerprint,
+                    'partitions': [os.path.basename(part_prefix) for part_prefix in prefixes]}
+        manifest_path = os.path.join(part_dir, PARTITION_MANIFEST_NAME)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    except (OSError, ValueError, IndexError):
+        shutil.rmtree(part_dir, ignore_errors=True)
+        return []
+    return prefixes
+
+def f2_partition_code(prefixes):
+    return R_F2_PARTITION_CODE.format(prefixes=','.join(f'"{r_path(prefix)}"' for prefix in prefixes))
+
+# --- F2 CACHE MANAGER ---
+# An f2 directory used for FST runs carries f2_manifest.json with the
+# dataset and its fingerprint, the extraction options and the population
+# pairs it holds. A run extracts only the pairs it is missing, through
+# extract_f2(pops, pops2), and skips extract_f2 when none are. A directory
+# extracted from another dataset or with other options is extracted
+# afresh. Adding pairs must leave the block lengths alone, or the old
+# blocks would no longer line up with the new ones; the generated R code
+# checks this and re-extracts the full population set if they changed.
+# FST blocks are extracted with the f2 blocks, and the pseudohaploid
+# adjustment is applied at extraction, so it is one of the options. Full
+# and incremental extractions can both run in chromosome partitions.
+F2_MANIFEST_NAME = "f2_manifest.json"
+
+R_F2_EXTRACT_CALL = "{extract}(prefix, my_f2_dir, pops = {pops}{pops2}, overwrite = TRUE, maxmiss = 1, adjust_pseudohaploid = adjust_ph, fst = TRUE)"
+
+R_F2_FULL_EXTRACTION = """
+{extract_all}
+cat("F2_READY\\tfull\\n")
+"""
+
+R_F2_INCREMENTAL_EXTRACTION = """
+read_block_lengths <- function() {{
+    paths <- list.files(my_f2_dir, pattern = "^block_lengths", full.names = TRUE)
+    setNames(lapply(paths, readRDS), basename(paths))
+}}
+old_block_lengths <- read_block_lengths()
+{extract_missing}
+if (identical(old_block_lengths, read_block_lengths())) {{
+    cat("F2_READY\\tincremental\\n")
+}} else {{
+    cat("Block lengths changed; re-extracting f2 for all populations\\n")
+    {extract_all}
+    cat("F2_READY\\tfull\\n")
+}}
+"""
+
+def f2_extract_options(adjust_ph):
+    return f"maxmiss=1:adjust_pseudohaploid={adjust_ph}:fst"
+
+def f2_pairs(pops):
+    return {tuple(sorted(pair)) for pair in combinations(dict.fromkeys(pops), 2)}
+
+def pair_cover(pops, known, missing):
+    # Populations whose pairs with the others include every missing pair:
+    # the populations not in known, then, greedily, the population that is
+    # in most of the pairs still uncovered
+    cover = [p for p in dict.fromkeys(pops) if p not in known]
+    leftover = {pair for pair in missing if not set(pair) & set(cover)}
+    while leftover:
+        pop = max(sorted({p for pair in leftover for p in pair}), key=lambda p: sum(p in pair for pair in leftover))
+        cover.append(pop)
+        leftover = {pair for pair in leftover if pop not in pair}
+    return cover
+
+def load_f2_manifest(f2_dir):
+    try:
+        with open(os.path.join(f2_dir, F2_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_f2_manifest(f2_dir, manifest):
+    path = os.path.join(f2_dir, F2_MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+def plan_f2_extraction(f2_dir, prefix, pops, options):
+    # Returns (mode, pops to extract, manifest to save once extract_f2
+    # succeeds); mode is None when every pair is already in the directory
+    fingerprint = dataset_fingerprint(prefix)
+    manifest = load_f2_manifest(f2_dir)
+    needed = f2_pairs(pops)
+    if (manifest is None or fingerprint is None
+            or manifest.get('dataset') != os.path.abspath(prefix)
+            or manifest.get('fingerprint') != fingerprint
+            or manifest.get('options') != options):
+        manifest = {'dataset': os.path.abspath(prefix), 'fingerprint': fingerprint, 'options': options, 'pops': [], 'pairs': []}
+        return 'full', list(dict.fromkeys(pops)), manifest
+
+    present = {tuple(pair) for pair in manifest['pairs']}
+    missing = needed - present
+    if not missing and set(pops) <= set(manifest['pops']):
+        return None, [], manifest
+    # New populations are paired with every population of the run
+    return 'incremental', pair_cover(pops, set(manifest['pops']), missing), manifest
+
+def update_f2_manifest(f2_dir, manifest, mode, pops):
+    if mode == 'full':
+        # A full extraction rewrites the block lengths, so only its own
+        # pairs are known to match them
+        manifest['pops'] = []
+        manifest['pairs'] = []
+    manifest['pops'] = sorted(set(manifest['pops']) | set(pops))
+    manifest['pairs'] = sorted(set(map(tuple, manifest['pairs'])) | f2_pairs(pops))
+    manifest['updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    save_f2_manifest(f2_dir, manifest)
+
+def build_f2_extraction_code(mode, extract_pops, partition_prefixes=()):
+    if mode is None:
+        return ''
+    extract = 'extract_f2_partitioned' if partition_prefixes else 'extract_f2'
+    partition_code = f2_partition_code(partition_prefixes) if partition_prefixes else ''
+    extract_all = R_F2_EXTRACT_CALL.format(extract=extract, pops='f2_pops', pops2='')
+    if mode == 'full':
+        return partition_code + R_F2_FULL_EXTRACTION.format(extract_all=extract_all)
+    extract_pops_code = ','.join(f'"{p}"' for p in extract_pops)
+    extract_missing = R_F2_EXTRACT_CALL.format(extract=extract, pops=f"c({extract_pops_code})", pops2=', pops2 = f2_pops')
+    return partition_code + R_F2_INCREMENTAL_EXTRACTION.format(extract_missing=extract_missing, extract_all=extract_all)
+
+def format_f2_partitions(partition_prefixes):
+    return f" in {len(partition_prefixes)} chromosome partitions" if partition_prefixes else ""
+
+# --- FST PAIR CACHE ---
+# Matrix runs keep the FST and SE of every population pair in an SQLite
+# file, keyed by the dataset fingerprint and the f2 extraction options, so
+# adding populations to a matrix computes only the pairs they bring.
+FST_PAIR_CACHE_PATH = os.path.join(APP_DATA_DIR, "fst_pairs.sqlite")
+
+class FstPairCache:
+    """Persistent pairwise FST values for one dataset."""
+
+    def __init__(self, prefix, options, path=FST_PAIR_CACHE_PATH):
+        full_hash = fingerprint_full_hash
+        self.fingerprint = dataset_fingerprint(prefix, full_hash)
+        self.mode = fingerprint_mode(full_hash)
+        self.options = options
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pairs (
+                dataset TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                mode TEXT NOT NULL DEFAULT 'sampled',
+                options TEXT NOT NULL,
+                pop_a TEXT NOT NULL,
+                pop_b TEXT NOT NULL,
+                est REAL,
+                se REAL,
+                created TEXT NOT NULL,
+                PRIMARY KEY (fingerprint, options, pop_a, pop_b)
+            )
+        """)
+        add_fingerprint_mode_column(self.db, "pairs")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pairs_dataset ON pairs (dataset)")
+        self.dataset = os.path.abspath(prefix)
+        purge_stale_fingerprints(self.db, "pairs", self.dataset, self.fingerprint, self.mode)
+
+    def get_many(self, pairs):
+        # {(pop_a, pop_b): (est, se)} for the cached pairs among pairs
+        if self.fingerprint is None:
+            return {}
+        rows = self.db.execute(
+            "SELECT pop_a, pop_b, est, se FROM pairs WHERE fingerprint = ? AND options = ?",
+            (self.fingerprint, self.options)
+        )
+        return {(a, b): (est, se) for a, b, est, se in rows if (a, b) in pairs}
+
+    def put_many(self, values):
+        if self.fingerprint is None or not values:
+            return
+        created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.db.executemany(
+            "INSERT OR REPLACE INTO pairs (dataset, fingerprint, mode, options, pop_a, pop_b, est, se, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(self.dataset, self.fingerprint, self.mode, self.options, a, b, est, se, created) for (a, b), (est, se) in values.items()]
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+# --- FST MATRIX ---
+# Matrix mode computes FST between every pair of the Pop1 and Pop2
+# populations in one R session. Only pairs missing from the pair cache are
+# computed: fst() runs on cover_pops x f2_pops, where every missing pair
+# has one population in cover_pops, and R prints one FST_PAIR line per
+# pair. The last matrix can be exported as TSV or NPY.
+FST_MATRIX_PRINT_MAX = 30
+last_fst_matrix = None
+
+R_FST_MATRIX_CODE = """
+{lib_path_code}
+library(admixtools)
+library(tidyverse)
+cat("PHASE\\tlibraries\\n")
+
+prefix = "{dataset_prefix}"
+my_f2_dir = "{f2_dir}"
+adjust_ph <- {adj_flag}
+
+f2_pops <- c({f2_pops})
+cover_pops <- c({cover_pops})
+{f2_code}
+fst_blocks <- f2_from_precomp(my_f2_dir, pops = f2_pops, fst = TRUE)
+cat("PHASE\\tdata\\n")
+
+fst_result <- fst(fst_blocks, pop1 = cover_pops, pop2 = f2_pops, boot = FALSE)
+cat("PHASE\\tblocks\\n")
+writeLines(paste("FST_PAIR", fst_result$pop1, fst_result$pop2, fst_result$est, fst_result$se, sep = "\\t"))
+"""
+
+def parse_r_number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')  # NA, NaN
+
+def build_fst_matrix(pops, values):
+    # Symmetric est and SE matrices; pairs without a value are NaN
+    nan = float('nan')
+    est = [[0.0 if a == b else values.get(tuple(sorted((a, b))), (nan, nan))[0] for b in pops] for a in pops]
+    se = [[0.0 if a == b else values.get(tuple(sorted((a, b))), (nan, nan))[1] for b in pops] for a in pops]
+    return {'pops': pops, 'est': est, 'se': se}
+
+def format_fst_matrix(matrix):
+    width = max(8, max(len(p) for p in matrix['pops']))
+    lines = [" " * width + "".join(f" {p:>{width}}" for p in matrix['pops'])]
+    for pop, row in zip(matrix['pops'], matrix['est']):
+        lines.append(f"{pop:<{width}}" + "".join(f" {value:>{width}.5f}" for value in row))
+    return "\n".join(lines) + "\n"
+
+def write_fst_matrix_tsv(path, pops, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write("\t".join([""] + pops) + "\n")
+        for pop, row in zip(pops, rows):
+            f.write("\t".join([pop] + ["NA" if value != value else f"{value:.10g}" for value in row]) + "\n")
+
+def write_npy(path, rows):
+    # NPY 1.0 file holding a float64 matrix, so numpy is not needed
+    header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (len(rows), len(rows[0]) if rows else 0)
+    header += " " * (-(len(header) + 11) % 64) + "\n"
+    with open(path, 'wb') as f:
+        f.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        for row in rows:
+            f.write(struct.pack(f'<{len(row)}d', *row))
+
+def write_fst_matrix(path, matrix):
+    # The SE matrix and, for NPY, the population order go next to it
+    base, ext = os.path.splitext(path)
+    if ext.lower() == '.npy':
+        write_npy(path, matrix['est'])
+        write_npy(base + "_se.npy", matrix['se'])
+        with open(base + "_pops.txt", 'w', encoding='utf-8') as f:
+            f.write("\n".join(matrix['pops']) + "\n")
+    else:
+        write_fst_matrix_tsv(path, matrix['pops'], matrix['est'])
+        write_fst_matrix_tsv(base + "_se" + ext, matrix['pops'], matrix['se'])
+
 def run_fst_analysis():
     pop1_raw = pop1_entry.get()
     pop2_raw = pop2_entry.get()
     dataset_prefix = prefix_entry.get().strip()
     f2_dir = f2_entry.get().strip()
     adjust_ph = pseudohaploid_var.get()
+    matrix_mode = fst_matrix_var.get()
 
-    if not (pop1_raw and pop2_raw and dataset_prefix and f2_dir):
+    # A matrix takes its populations from Pop1 and, optionally, Pop2
+    if not (pop1_raw and (pop2_raw or matrix_mode) and dataset_prefix and f2_dir):
         messagebox.showerror("Missing info", "Please fill in all fields.")
         return
 
@@ -67,7 +1129,7 @@ def run_fst_analysis():
             return
     else:
         rscript_path = 'Rscript'
-        if not shutil.which(rscript_path):
+        if not find_rscript(rscript_path):
             messagebox.showerror("Rscript not found", "Install R or ensure 'Rscript' is in your PATH.")
             return
 
@@ -76,33 +1138,64 @@ def run_fst_analysis():
     # pop2 <- c({pop2})
     # mypops = c(pop1, pop2)  # This is correct R syntax
 
+    try:
+        f2_partitions = int(f2_partitions_entry.get().strip() or 1)
+        if f2_partitions < 1:
+            raise ValueError
+    except ValueError:
+        messagebox.showerror("Invalid input", "f2 partitions must be a positive whole number.")
+        return
+
     # Instead, format the population strings properly
     pop1 = format_pops(pop1_raw)
     pop2 = format_pops(pop2_raw)
     
-    r_lib_paths = get_r_library_paths(rscript_path)
-    package_path = check_package_in_paths("admixtools", r_lib_paths)
-    lib_path_code = f'.libPaths("{package_path}")\n' if package_path else ''
+    if matrix_mode:
+        pops = list(dict.fromkeys(p.strip('"') for p in f"{pop1},{pop2}".split(',') if p.strip('"')))
+        if len(pops) < 2:
+            messagebox.showerror("Missing info", "A pairwise matrix needs at least two populations.")
+            return
+        start_job(fst_matrix_job, rscript_path, dataset_prefix, f2_dir, adjust_ph, pops, f2_partitions)
+        return
+
+    start_job(fst_job, rscript_path, dataset_prefix, f2_dir, adjust_ph, pop1_raw, pop2_raw, pop1, pop2, f2_partitions)
+
+def fst_job(rscript_path, dataset_prefix, f2_dir, adjust_ph, pop1_raw, pop2_raw, pop1, pop2, f2_partitions):
+    package_path = r_package_path(rscript_path, "admixtools")
+    lib_path_code = f'.libPaths("{r_path(package_path)}")\n' if package_path else ''
 
     adj_flag = "TRUE" if adjust_ph else "FALSE"
 
+    # Only the pairs the f2 directory does not hold yet are extracted
+    f2_pops = list(dict.fromkeys(p.strip('"') for p in f"{pop1},{pop2}".split(',') if p.strip('"')))
+    os.makedirs(f2_dir, exist_ok=True)
+    f2_mode, extract_pops, f2_manifest = plan_f2_extraction(f2_dir, dataset_prefix, f2_pops, f2_extract_options(adjust_ph))
+    partition_prefixes = prepare_f2_partitions(dataset_prefix, f2_partitions) if f2_mode else []
+    f2_code = build_f2_extraction_code(f2_mode, extract_pops, partition_prefixes)
+
     r_code = f"""
 {lib_path_code}
 library(admixtools)
 library(tidyverse)
+cat("PHASE\\tlibraries\\n")
 
-prefix = "{dataset_prefix}"
-my_f2_dir = "{f2_dir}"
+prefix = "{r_path(dataset_prefix)}"
+my_f2_dir = "{r_path(f2_dir)}"
+adjust_ph <- {adj_flag}
 
 # Explicit population definitions
 pop1 <- c({pop1})
 pop2 <- c({pop2})
 mypops <- c({pop1}, {pop2})  # Combined directly
-
-extract_f2(prefix, my_f2_dir, pops = c(mypops), overwrite = TRUE, maxmiss = 1)
-f2_blocks = f2_from_precomp(my_f2_dir, pops = mypops, afprod = TRUE)
-
-fst_result <- fst(data = prefix, pop1 = pop1, pop2 = pop2, boot = FALSE, adjust_pseudohaploid = {adj_flag})
+f2_pops <- unique(mypops)
+{f2_code}
+fst_blocks <- f2_from_precomp(my_f2_dir, pops = f2_pops, fst = TRUE)
+cat("PHASE\\tdata\\n")
+
+# FST and its jackknife SE come from the FST blocks; the genotypes are
+# not read again
+fst_result <- fst(fst_blocks, pop1 = pop1, pop2 = pop2, boot = FALSE)
+cat("PHASE\\tblocks\\n")
 print(fst_result, n = Inf)
 """
 
@@ -111,17 +1204,159 @@ print(fst_result, n = Inf)
         r_script.write(r_code.encode('utf-8'))
         r_script_path = r_script.name
 
+    timer = PhaseTimer('fst', dataset_prefix)
     try:
-        process = subprocess.Popen(
-            [rscript_path, r_script_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding='utf-8'
-        )
-        output_text.insert(tk.END, f"\n--- Run started at {datetime.now()} ---\n")
-        output_text.insert(tk.END, f"Pop1: {pop1_raw}\nPop2: {pop2_raw}\n\n")
-        output_text.see(tk.END)
+        process = RProcess([rscript_path, r_script_path])
+        timer.mark('spawn')
+        ui_insert(f"\n--- Run started at {datetime.now()} ---\n")
+        ui_insert(f"Pop1: {pop1_raw}\nPop2: {pop2_raw}\n\n")
+        if f2_mode is None:
+            ui_insert(f"Using cached f2 blocks for {len(f2_pops)} populations in {f2_dir}\n")
+        elif f2_mode == 'incremental':
+            ui_insert(f"Extracting f2 for {len(extract_pops)} new or incomplete of {len(f2_pops)} populations into {f2_dir}{format_f2_partitions(partition_prefixes)}\n")
+        else:
+            ui_insert(f"Extracting f2 for {len(f2_pops)} populations into {f2_dir}{format_f2_partitions(partition_prefixes)}\n")
+
+        # Buffer to store the last SNP read line
+        last_snp_line = ""
+
+        for line in process.stdout:
+            if line.startswith("PHASE\t"):
+                timer.feed(line)
+            elif line.startswith("F2_READY\t"):
+                try:
+                    update_f2_manifest(f2_dir, f2_manifest, line.split('\t', 1)[1].strip(), f2_pops)
+                except OSError as e:
+                    ui_insert(f"Could not update the f2 manifest: {str(e)}\n")
+            elif "SNPs read" in line:
+                # Strip and overwrite the previous SNP line
+                last_snp_line = line.strip()
+                ui_replace_last_line(last_snp_line + "\n")
+            else:
+                timer.feed(line)
+                ui_insert(line)
+        timer.mark('result')
+
+        process.wait()
+        if job_cancelled.is_set():
+            ui_insert("\n⏹ FST analysis stopped.\n")
+            ui_status("FST analysis stopped.")
+        else:
+            timer.failed = process.returncode != 0
+            timer.mark('parse')
+            ui_phase(timer)
+            ui_status("FST analysis completed.")
+    except Exception as e:
+        ui_error("Error", str(e))
+    finally:
+        os.remove(r_script_path)
+
+def fst_matrix_job(rscript_path, dataset_prefix, f2_dir, adjust_ph, pops, f2_partitions):
+    global last_fst_matrix
+    options = f2_extract_options(adjust_ph)
+    needed = f2_pairs(pops)
+    cache = FstPairCache(dataset_prefix, options)
+    try:
+        values = cache.get_many(needed)
+        missing = needed - set(values)
+        ui_insert(f"\n--- FST matrix run started at {datetime.now()} ---\n")
+        ui_insert(f"{len(pops)} populations, {len(needed)} pairs, {len(needed) - len(missing)} cached\n")
+
+        returncode = 0
+        if missing:
+            # Only populations in a missing pair need f2 blocks
+            f2_pops = [p for p in pops if any(p in pair for pair in missing)]
+            cover_pops = pair_cover(f2_pops, {p for pair in values for p in pair}, missing)
+            package_path = r_package_path(rscript_path, "admixtools")
+            os.makedirs(f2_dir, exist_ok=True)
+            f2_mode, extract_pops, f2_manifest = plan_f2_extraction(f2_dir, dataset_prefix, f2_pops, options)
+            partition_prefixes = prepare_f2_partitions(dataset_prefix, f2_partitions) if f2_mode else []
+            r_code = R_FST_MATRIX_CODE.format(
+                lib_path_code=f'.libPaths("{r_path(package_path)}")\n' if package_path else '',
+                dataset_prefix=r_path(dataset_prefix),
+                f2_dir=r_path(f2_dir),
+                adj_flag="TRUE" if adjust_ph else "FALSE",
+                f2_pops=','.join(f'"{p}"' for p in f2_pops),
+                cover_pops=','.join(f'"{p}"' for p in cover_pops),
+                f2_code=build_f2_extraction_code(f2_mode, extract_pops, partition_prefixes)
+            )
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".R") as r_script:
+                r_script.write(r_code.encode('utf-8'))
+                r_script_path = r_script.name
+
+            timer = PhaseTimer('fst_matrix', dataset_prefix)
+            computed = {}
+            try:
+                process = RProcess([rscript_path, r_script_path])
+                timer.mark('spawn')
+                ui_insert(f"Computing {len(missing)} pairs ({len(cover_pops)} x {len(f2_pops)} populations)\n")
+                if f2_mode:
+                    ui_insert(f"Extracting f2 for {len(extract_pops)} populations into {f2_dir}{format_f2_partitions(partition_prefixes)}\n")
+                for line in process.stdout:
+                    if line.startswith("FST_PAIR\t"):
+                        fields = line.rstrip('\n').split('\t')
+                        if len(fields) == 5 and fields[1] != fields[2]:
+                            computed[tuple(sorted(fields[1:3]))] = (parse_r_number(fields[3]), parse_r_number(fields[4]))
+                    elif line.startswith("PHASE\t"):
+                        timer.feed(line)
+                    elif line.startswith("F2_READY\t"):
+                        try:
+                            update_f2_manifest(f2_dir, f2_manifest, line.split('\t', 1)[1].strip(), f2_pops)
+                        except OSError as e:
+                            ui_insert(f"Could not update the f2 manifest: {str(e)}\n")
+                    elif "SNPs read" in line:
+                        ui_replace_last_line(line.strip() + "\n")
+                    else:
+                        timer.feed(line)
+                        ui_insert(line)
+                timer.mark('result')
+                process.wait()
+            finally:
+                os.remove(r_script_path)
+
+            if job_cancelled.is_set():
+                ui_insert("\n⏹ FST matrix run stopped.\n")
+                ui_status("FST matrix run stopped.")
+                return
+            # Pairs R printed are complete even if it failed afterwards
+            cache.put_many(computed)
+            values.update(computed)
+            returncode = process.returncode
+            timer.failed = returncode != 0
+            timer.mark('parse')
+            ui_phase(timer)
+
+        matrix = build_fst_matrix(pops, values)
+        unresolved = len(needed - set(values))
+        complete = returncode == 0 and not unresolved
+        # Only a complete matrix can be exported
+        last_fst_matrix = matrix if complete else None
+        if len(pops) <= FST_MATRIX_PRINT_MAX:
+            ui_insert(("\nFST matrix:\n" if complete else "\nPartial FST matrix:\n") + format_fst_matrix(matrix))
+        elif complete:
+            ui_insert(f"\nFST matrix of {len(pops)} populations is ready; use Export Matrix to save it.\n")
+        if returncode != 0:
+            ui_insert(f"\n❌ Rscript exited with code {returncode}.\n")
+        if unresolved:
+            ui_insert(f"⚠ {unresolved} pairs have no FST value; the matrix cannot be exported.\n")
+        if complete:
+            ui_status("FST matrix completed.")
+        else:
+            ui_status("FST matrix failed!" if returncode != 0 else f"FST matrix incomplete: {unresolved} pairs missing.")
+    except Exception as e:
+        ui_error("Error", str(e))
+    finally:
+        cache.close()
+
+def custom_r_code_job(rscript_path, edited_code):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".R") as temp_r_file:
+        temp_r_file.write(edited_code.encode('utf-8'))
+        r_script_path = temp_r_file.name
+
+    try:
+        process = RProcess([rscript_path, r_script_path])
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ui_insert(f"\n---\n[Custom FST R Code Output - {timestamp}]\n")
 
         # Buffer to store the last SNP read line
         last_snp_line = ""
@@ -130,16 +1365,18 @@ print(fst_result, n = Inf)
             if "SNPs read" in line:
                 # Strip and overwrite the previous SNP line
                 last_snp_line = line.strip()
-                output_text.delete("end-2l", "end-1l")
-                output_text.insert(tk.END, last_snp_line + "\n")
+                ui_replace_last_line(last_snp_line + "\n")
             else:
-                output_text.insert(tk.END, line)
-            output_text.see(tk.END)
+                ui_insert(line)
 
         process.wait()
-        status_label.config(text="FST analysis completed.")
+        if job_cancelled.is_set():
+            ui_insert("\n⏹ Custom R code stopped.\n")
+            ui_status("Custom R code stopped.")
+        else:
+            ui_status("Custom R code executed.")
     except Exception as e:
-        messagebox.showerror("Error", str(e))
+        ui_error("Execution Error", str(e))
     finally:
         os.remove(r_script_path)
 
@@ -161,21 +1398,20 @@ def edit_and_run_r_code():
             return
     else:
         rscript_path = 'Rscript'
-        if not shutil.which(rscript_path):
+        if not find_rscript(rscript_path):
             messagebox.showerror("Rscript not found", "Install R or ensure 'Rscript' is in PATH.")
             return
 
-    r_lib_paths = get_r_library_paths(rscript_path)
-    package_path = check_package_in_paths("admixtools", r_lib_paths)
-    lib_path_code = f'.libPaths("{package_path}")\n' if package_path else ''
+    package_path = r_package_path(rscript_path, "admixtools")
+    lib_path_code = f'.libPaths("{r_path(package_path)}")\n' if package_path else ''
     
     default_r_code = f"""
 {lib_path_code}
 library(admixtools)
 library(tidyverse)
 
-prefix = "{dataset_prefix}"
-my_f2_dir = "{f2_dir}"
+prefix = "{r_path(dataset_prefix)}"
+my_f2_dir = "{r_path(f2_dir)}"
 
 # Edit these manually:
 pop1 <- c("POP1")  # Replace with your actual population
@@ -214,40 +1450,7 @@ print(fst_result, n = Inf)
         edited_code = text_editor.get("1.0", tk.END)
         custom_r_code = edited_code
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".R") as temp_r_file:
-            temp_r_file.write(edited_code.encode('utf-8'))
-            r_script_path = temp_r_file.name
-
-        try:
-            process = subprocess.Popen(
-                [rscript_path, r_script_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8'
-            )
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            output_text.insert(tk.END, f"\n---\n[Custom FST R Code Output - {timestamp}]\n")
-
-            # Buffer to store the last SNP read line
-            last_snp_line = ""
-
-            for line in process.stdout:
-                if "SNPs read" in line:
-                    # Strip and overwrite the previous SNP line
-                    last_snp_line = line.strip()
-                    output_text.delete("end-2l", "end-1l")
-                    output_text.insert(tk.END, last_snp_line + "\n")
-                else:
-                    output_text.insert(tk.END, line)
-                output_text.see(tk.END)
-
-            process.wait()
-            status_label.config(text="Custom R code executed.")
-        except Exception as e:
-            messagebox.showerror("Execution Error", str(e))
-        finally:
-            os.remove(r_script_path)
+        start_job(custom_r_code_job, rscript_path, edited_code)
 
     def save_edited_code():
         global custom_r_code
@@ -411,8 +1614,28 @@ else:
     # Hide R folder widgets on Linux
     r_folder_entry = None
 
+fst_options_frame = tk.Frame(scrollable_frame)
+fst_options_frame.grid(row=5, column=0, sticky='w', padx=5)
+
 pseudohaploid_var = tk.BooleanVar(value=True)
-tk.Checkbutton(scrollable_frame, text="Adjust Pseudohaploid", variable=pseudohaploid_var).grid(row=5, column=0, sticky='w', padx=5)
+tk.Checkbutton(fst_options_frame, text="Adjust Pseudohaploid", variable=pseudohaploid_var).pack(anchor='w')
+
+# All pairs of Pop1 + Pop2, with per-pair caching
+fst_matrix_var = tk.BooleanVar(value=False)
+tk.Checkbutton(fst_options_frame, text="Pairwise matrix (all pairs of Pop1 + Pop2)", variable=fst_matrix_var).pack(anchor='w')
+
+# More than one partition extracts f2 in parallel R processes, by chromosome
+f2_partitions_frame = tk.Frame(fst_options_frame)
+f2_partitions_frame.pack(anchor='w')
+tk.Label(f2_partitions_frame, text="f2 partitions:").pack(side=tk.LEFT)
+f2_partitions_entry = tk.Entry(f2_partitions_frame, width=4)
+f2_partitions_entry.insert(0, "1")
+f2_partitions_entry.pack(side=tk.LEFT, padx=5)
+
+# Identify datasets by hashing every byte instead of sampled blocks
+full_fingerprint_var = tk.BooleanVar(value=False)
+tk.Checkbutton(fst_options_frame, text="Full-hash dataset fingerprint", variable=full_fingerprint_var,
+               command=lambda: set_fingerprint_full_hash(full_fingerprint_var.get())).pack(anchor='w')
 
 tk.Button(scrollable_frame, text="Run FST", command=run_fst_analysis, bg="lightblue").grid(row=5, column=1, pady=10, sticky='we')
 tk.Button(scrollable_frame, text="Edit and Run R Code", command=edit_and_run_r_code, bg="lightyellow").grid(row=5, column=2, pady=10, sticky='we')
@@ -569,6 +1792,41 @@ def save_output_to_file():
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save file: {str(e)}")
 
+def export_phase_timings():
+    records = load_phase_timings()
+    if not records:
+        messagebox.showerror("No timings", "No phase timings have been recorded yet.")
+        return
+
+    file_path = filedialog.asksaveasfilename(
+        defaultextension=".csv",
+        filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")]
+    )
+
+    if file_path:
+        try:
+            write_phase_timings_csv(file_path, records)
+            status_label.config(text=f"{len(records)} phase timings exported to {file_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export timings: {str(e)}")
+
+def export_fst_matrix():
+    if last_fst_matrix is None:
+        messagebox.showerror("No matrix", "No complete pairwise FST matrix to export; run FST in pairwise matrix mode first.")
+        return
+
+    file_path = filedialog.asksaveasfilename(
+        defaultextension=".tsv",
+        filetypes=[("TSV Files", "*.tsv"), ("NumPy Arrays", "*.npy"), ("All Files", "*.*")]
+    )
+
+    if file_path:
+        try:
+            write_fst_matrix(file_path, last_fst_matrix)
+            status_label.config(text=f"FST matrix exported to {file_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export matrix: {str(e)}")
+
 def add_to_pop1():
     global population_history, history_index
     pops = get_selected_populations()
@@ -704,10 +1962,22 @@ status_label.pack(side=tk.LEFT)
 button_frame = tk.Frame(status_button_frame)
 button_frame.pack(side=tk.RIGHT)
 
+# Stop button: cancels the running analysis and its R processes
+stop_button = tk.Button(button_frame, text="⏹ Stop", command=stop_job, bg="#F4A6A6", width=10, height=1)
+stop_button.pack(side=tk.LEFT, padx=5)
+
 # Clear button
 clear_button = tk.Button(button_frame, text="Clear", command=clear_output, bg="lightgray", width=10, height=1)
 clear_button.pack(side=tk.LEFT, padx=5)
 
+# Exports the phase timings of past runs as CSV
+timings_button = tk.Button(button_frame, text="⏱ Timings", command=export_phase_timings, bg="lightgray", width=10, height=1)
+timings_button.pack(side=tk.LEFT, padx=5)
+
+# Exports the last pairwise FST matrix as TSV or NPY
+matrix_button = tk.Button(button_frame, text="▦ Matrix", command=export_fst_matrix, bg="lightgray", width=10, height=1)
+matrix_button.pack(side=tk.LEFT, padx=5)
+
 # Add this near the other search functions (around line 1000)
 def setup_output_search():
     # Create search frame for output console (placed at bottom)
@@ -802,6 +2072,9 @@ def setup_output_search():
 # Call this function after creating the output_text widget
 setup_output_search()
 
+# Apply output/status events posted by running analyses
+root.after(50, process_ui_events)
+
 # Make columns expandable
 scrollable_frame.grid_columnconfigure(1, weight=1)
 scrollable_frame.grid_rowconfigure(7, weight=1)